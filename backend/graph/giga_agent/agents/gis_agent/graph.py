@@ -20,6 +20,7 @@ from giga_agent.agents.gis_agent.utils.gis_client import Location, Attraction, P
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
 from giga_agent.utils.env import load_project_env
+from giga_agent.utils.metrics import instrument_node
 
 load_project_env()
 
@@ -47,9 +48,9 @@ def get_center(
 
 workflow = StateGraph(MapState)
 
-workflow.add_node("attractions_node", attractions_node)
-workflow.add_node("hotels_node", hotels_node)
-workflow.add_node("food_node", food_node)
+workflow.add_node("attractions_node", instrument_node(attractions_node, "gis"))
+workflow.add_node("hotels_node", instrument_node(hotels_node, "gis"))
+workflow.add_node("food_node", instrument_node(food_node, "gis"))
 
 workflow.add_edge(START, "attractions_node")
 workflow.add_edge("attractions_node", "hotels_node")
@@ -27,6 +27,7 @@ from giga_agent.agents.landing_agent.prompts.ru import AGENT_PROMPT
 from giga_agent.utils.lang import LANG
 from giga_agent.utils.env import load_project_env
 from giga_agent.utils.messages import filter_tool_messages
+from giga_agent.utils.metrics import instrument_node
 
 load_project_env()
 
@@ -100,11 +101,11 @@ def router(
 
 workflow = StateGraph(LandingState, ConfigSchema)
 
-workflow.add_node("agent", agent)
-workflow.add_node("plan_node", plan_node)
-workflow.add_node("image", image_node)
-workflow.add_node("coder", coder_node)
-workflow.add_node("done_node", done_node)
+workflow.add_node("agent", instrument_node(agent, "landing"))
+workflow.add_node("plan_node", instrument_node(plan_node, "landing"))
+workflow.add_node("image", instrument_node(image_node, "landing"))
+workflow.add_node("coder", instrument_node(coder_node, "landing"))
+workflow.add_node("done_node", instrument_node(done_node, "landing"))
 
 workflow.add_edge(START, "agent")
 workflow.add_conditional_edges("agent", router)
@@ -12,6 +12,7 @@ from typing_extensions import TypedDict, Annotated
 
 from giga_agent.utils.lang import LANG
 from giga_agent.utils.llm import load_llm
+from giga_agent.utils.metrics import instrument_node
 
 llm = load_llm().with_config(tags=["nostream"])
 
@@ -321,17 +322,20 @@ from langgraph.checkpoint.memory import MemorySaver
 
 graph = StateGraph(LeanGraphState)
 
-graph.add_node("1_customer_segments", customer_segments)
-graph.add_node("2_problem", problem)
-graph.add_node("3_unique_value_proposition", unique_value_proposition)
-graph.add_node("3.1_check_unique", check_unique)
-graph.add_node("4_solution", solution)
-graph.add_node("5_channels", channels)
-graph.add_node("6_revenue_streams", revenue_streams)
-graph.add_node("7_cost_structure", cost_structure)
-graph.add_node("8_key_metrics", key_metrics)
-graph.add_node("9_unfair_advantage", unfair_advantage)
-graph.add_node("get_feedback", get_feedback)
+graph.add_node("1_customer_segments", instrument_node(customer_segments, "lean_canvas"))
+graph.add_node("2_problem", instrument_node(problem, "lean_canvas"))
+graph.add_node(
+    "3_unique_value_proposition",
+    instrument_node(unique_value_proposition, "lean_canvas"),
+)
+graph.add_node("3.1_check_unique", instrument_node(check_unique, "lean_canvas"))
+graph.add_node("4_solution", instrument_node(solution, "lean_canvas"))
+graph.add_node("5_channels", instrument_node(channels, "lean_canvas"))
+graph.add_node("6_revenue_streams", instrument_node(revenue_streams, "lean_canvas"))
+graph.add_node("7_cost_structure", instrument_node(cost_structure, "lean_canvas"))
+graph.add_node("8_key_metrics", instrument_node(key_metrics, "lean_canvas"))
+graph.add_node("9_unfair_advantage", instrument_node(unfair_advantage, "lean_canvas"))
+graph.add_node("get_feedback", instrument_node(get_feedback, "lean_canvas"))
 
 graph.add_edge(START, "1_customer_segments")
 graph.add_edge("1_customer_segments", "2_problem")
@@ -14,16 +14,17 @@ from langgraph_sdk import get_client
 from giga_agent.agents.meme_agent.config import MemeState, ConfigSchema
 from giga_agent.agents.meme_agent.nodes.images import image_node
 from giga_agent.agents.meme_agent.nodes.text import text_node
-from giga_agent.utils.llm import is_llm_image_inline
+from giga_agent.utils.attachments import upload_image
 from giga_agent.utils.env import load_project_env
 from giga_agent.utils.messages import filter_tool_calls
+from giga_agent.utils.metrics import instrument_node
 
 load_project_env()
 
 workflow = StateGraph(MemeState, ConfigSchema)
 
-workflow.add_node("text", text_node)
-workflow.add_node("image", image_node)
+workflow.add_node("text", instrument_node(text_node, "meme"))
+workflow.add_node("image", instrument_node(image_node, "meme"))
 
 workflow.add_edge(START, "text")
 workflow.add_edge("text", "image")
@@ -43,8 +44,6 @@ async def create_meme(
     Args:
         task: Описание мема
     """
-    from giga_agent.config import llm
-
     last_mes = filter_tool_calls(state["messages"][-1])
     client = get_client(url=os.getenv("LANGGRAPH_API_URL", "http://0.0.0.0:2024"))
     thread = await client.threads.create()
@@ -81,12 +80,7 @@ async def create_meme(
                     "node": list(chunk.data.keys())[0],
                 },
             )
-    if is_llm_image_inline():
-        uploaded_file_id = (
-            await llm.aupload_file(("image.png", base64.b64decode(state["meme_image"])))
-        ).id_
-    else:
-        uploaded_file_id = str(uuid.uuid4())
+    uploaded_file_id = await upload_image(base64.b64decode(state["meme_image"]))
     return {
         "meme_text": state["meme_idea"],
         "message": f'В результате выполнения было сгенерировано изображение {uploaded_file_id}. Покажи его пользователю через "![мем](graph:{uploaded_file_id})" и напиши куда двигаться пользователю дальше',
@@ -34,6 +34,7 @@ from giga_agent.agents.podcast.utils import parse_url, generate_script
 from giga_agent.utils.lang import LANG
 from giga_agent.utils.env import load_project_env
 from giga_agent.utils.messages import filter_tool_calls
+from giga_agent.utils.metrics import instrument_node
 
 load_project_env()
 
@@ -140,10 +141,10 @@ async def audio_gen(state: PodcastState):
 
 workflow = StateGraph(PodcastState, ConfigSchema)
 
-workflow.add_node("download", download_url)
-workflow.add_node("summarize_messages", summarize_messages)
-workflow.add_node("script", script)
-workflow.add_node("audio_gen", audio_gen)
+workflow.add_node("download", instrument_node(download_url, "podcast"))
+workflow.add_node("summarize_messages", instrument_node(summarize_messages, "podcast"))
+workflow.add_node("script", instrument_node(script, "podcast"))
+workflow.add_node("audio_gen", instrument_node(audio_gen, "podcast"))
 
 workflow.add_edge(START, "download")
 workflow.add_edge("download", "summarize_messages")
@@ -17,12 +17,13 @@ from giga_agent.agents.presentation_agent.nodes.plan import plan_node
 from giga_agent.agents.presentation_agent.nodes.slides import slides_node
 from giga_agent.utils.env import load_project_env
 from giga_agent.utils.messages import filter_tool_calls
+from giga_agent.utils.metrics import instrument_node
 
 workflow = StateGraph(PresentationState, ConfigSchema)
 
-workflow.add_node("plan_node", plan_node)
-workflow.add_node("image", image_node)
-workflow.add_node("slides_node", slides_node)
+workflow.add_node("plan_node", instrument_node(plan_node, "presentation"))
+workflow.add_node("image", instrument_node(image_node, "presentation"))
+workflow.add_node("slides_node", instrument_node(slides_node, "presentation"))
 
 workflow.add_edge(START, "plan_node")
 workflow.add_edge("plan_node", "image")
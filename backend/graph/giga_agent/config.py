@@ -46,6 +46,9 @@ class AgentState(TypedDict):  # noqa: D101
 
 llm = load_llm()
 
+# Разрешает модели несколько вызовов инструментов за шаг; они выполняются параллельно
+PARALLEL_TOOL_CALLS = os.getenv("PARALLEL_TOOL_CALLS", "0") == "1"
+
 if os.getenv("REPL_FROM_MESSAGE", "1") == "1":
     from giga_agent.tools.repl.message_tool import python
 else:
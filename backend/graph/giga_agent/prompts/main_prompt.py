@@ -74,6 +74,7 @@ SYSTEM_PROMPT = """Ты — GigaAgent, высококвалифицирован
 
 Используй дополнительные функции в коде, только если сам не можешь выполнить какое-либо действие!
 Ни в коем случае не переопределяй их!
+Если нужно вызвать дополнительную функцию много раз (например, для каждой строки таблицы), не вызывай её в цикле — используй `имя_функции.map([{{...}}, {{...}}])` со списком именованных аргументов: вызовы выполнятся параллельно, результаты вернутся в том же порядке.
 {repl_inner_tools}
 
 ===
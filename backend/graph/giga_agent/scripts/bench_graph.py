@@ -0,0 +1,463 @@
+"""
+Офлайн-бенчмарк главного графа (tool_graph.workflow).
+
+LLM заменяется детерминированной моделью, которая проигрывает записанный
+сценарий вызовов инструментов, сервис инструментов — локальной заглушкой на
+aiohttp, а код выполняется через `ExecuteTool` в настоящем REPL-сервисе
+(поднимается локально или указывается через --repl-url). Сеть не нужна.
+
+Запуск:
+    uv run python -m giga_agent.scripts.bench_graph --threads 8 --turns 2
+
+Сценарий (--scenario) — JSON-список ходов модели:
+    [{"content": "...", "tool_calls": [{"name": "weather", "args": {...}}]}, ...]
+Код для `python` берётся из блока ```python в content, если не задан в args.
+Ответы инструментов-заглушек можно задать рядом со списком ходов:
+    {"turns": [...], "tool_results": {"weather": {...}}}
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Optional
+from uuid import uuid4
+
+from aiohttp import web
+
+REPL_DIR = Path(__file__).resolve().parents[3] / "repl"
+
+DEFAULT_TURNS = [
+    {
+        "content": "Посмотрю на данные.\n```python\nimport pandas as pd\n"
+        "df = pd.DataFrame({'x': range(10000), 'y': range(10000)})\n"
+        "print(df.describe())\n```",
+        "tool_calls": [{"name": "python", "args": {}}],
+    },
+    {
+        "content": "Узнаю погоду.",
+        "tool_calls": [{"name": "weather", "args": {"city": "Москва"}}],
+    },
+    {
+        "content": "Построю график.\n```python\nimport plotly.express as px\n"
+        "fig = px.line(df.sample(500, random_state=0), x='x', y='y')\n"
+        "fig.show()\n```",
+        "tool_calls": [{"name": "python", "args": {}}],
+    },
+    {"content": "Готово: данные изучены, график построен.", "tool_calls": []},
+]
+
+DEFAULT_TOOL_RESULTS = {
+    "weather": {"city": "Москва", "temperature": 12, "description": "облачно"},
+}
+
+DEFAULT_MESSAGES = [
+    "Получи погоду в Москве и построй график",
+    "Проанализируй таблицу и нарисуй зависимость y от x",
+]
+
+
+def _setup_env(repl_url: str, tool_url: str):
+    """Переменные, которые tool_graph читает при импорте и на каждом шаге."""
+    os.environ["JUPYTER_CLIENT_API"] = repl_url
+    os.environ["TOOL_CLIENT_API"] = tool_url
+    # Модели создаются при импорте конфигов, но в бенчмарке не вызываются
+    os.environ.setdefault("GIGA_AGENT_LLM", "openai:gpt-4o-mini")
+    # Быстрая модель нужна инструментам (scraper, repl_tools.llm) при импорте
+    os.environ.setdefault("GIGA_AGENT_LLM_FAST", os.environ["GIGA_AGENT_LLM"])
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+
+def _code_from_content(content: str) -> Optional[str]:
+    if "```python" not in content:
+        return None
+    return content.split("```python", 1)[1].split("```", 1)[0].strip()
+
+
+def make_replay_model(turns: list[dict], latency: float):
+    """Детерминированная модель: номер хода — число AI-ответов после human."""
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessage, HumanMessage
+    from langchain_core.outputs import ChatGeneration, ChatResult
+
+    class ReplayChatModel(BaseChatModel):
+        turns: list
+        latency: float = 0.0
+
+        @property
+        def _llm_type(self) -> str:
+            return "replay"
+
+        def bind_tools(self, tools, **kwargs: Any):
+            return self
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            last_human = max(
+                (
+                    idx
+                    for idx, msg in enumerate(messages)
+                    if isinstance(msg, HumanMessage)
+                ),
+                default=-1,
+            )
+            answers = messages[last_human + 1 :]
+            step = sum(isinstance(msg, AIMessage) for msg in answers)
+            turn = self.turns[min(step, len(self.turns) - 1)]
+            content = turn["content"]
+            tool_calls = []
+            for idx, call in enumerate(turn.get("tool_calls", [])):
+                args = dict(call.get("args", {}))
+                if call["name"] == "python" and "code" not in args:
+                    args["code"] = _code_from_content(content) or ""
+                tool_calls.append(
+                    {"name": call["name"], "args": args, "id": f"call_{step}_{idx}"}
+                )
+            prompt_chars = sum(len(str(msg.content)) for msg in messages)
+            message = AIMessage(
+                content=content,
+                tool_calls=tool_calls,
+                usage_metadata={
+                    "input_tokens": prompt_chars // 4,
+                    "output_tokens": len(content) // 4,
+                    "total_tokens": (prompt_chars + len(content)) // 4,
+                },
+            )
+            return ChatResult(generations=[ChatGeneration(message=message)])
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return self._generate(messages, stop, run_manager, **kwargs)
+
+    return ReplayChatModel(turns=turns, latency=latency)
+
+
+def _dumps(data) -> str:
+    # В ответе ExecuteTool картинки лежат в base64-байтах, как у jsonable_encoder
+    return json.dumps(
+        data,
+        ensure_ascii=False,
+        default=lambda value: value.decode() if isinstance(value, bytes) else str(value),
+    )
+
+
+def make_tool_server(tool_results: dict, tool_latency: float):
+    """
+    Заглушка сервиса инструментов. `python` выполняется тем же `ExecuteTool`,
+    что и в tool_server (через `/code/stream` настоящего REPL, с рендером
+    графиков и загрузкой картинок), остальные инструменты отвечают из
+    `tool_results`.
+    """
+    from giga_agent.tools.python import EXECUTION_EVENTS, ExecuteTool
+
+    schemas = [
+        {
+            "name": "python",
+            "description": "Компилятор ipython",
+            "parameters": {
+                "type": "object",
+                "properties": {"code": {"type": "string"}},
+                "required": ["code"],
+            },
+        }
+    ] + [
+        {
+            "name": name,
+            "description": f"Заглушка {name}",
+            "parameters": {"type": "object", "properties": {}},
+        }
+        for name in tool_results
+    ]
+
+    async def get_tools(request: web.Request):
+        return web.json_response(schemas)
+
+    async def run_tool(tool_name: str, payload: dict) -> tuple[int, Any]:
+        kwargs = payload.get("kwargs") or {}
+        state = payload.get("state") or {}
+        if tool_name == "python":
+            tool = ExecuteTool(kernel_id=state.get("kernel_id"))
+            return 200, {"data": await tool.ainvoke({"code": kwargs.get("code")})}
+        if tool_name in tool_results:
+            if tool_latency:
+                await asyncio.sleep(tool_latency)
+            return 200, {"data": json.dumps(tool_results[tool_name], ensure_ascii=False)}
+        return 404, f"Tool with name {tool_name} not found!"
+
+    async def call_tool(request: web.Request):
+        status, content = await run_tool(
+            request.match_info["tool_name"], await request.json()
+        )
+        return web.json_response(content, status=status, dumps=_dumps)
+
+    async def call_tool_stream(request: web.Request):
+        """NDJSON, как `POST /stream/{tool_name}` в tool_server."""
+        tool_name = request.match_info["tool_name"]
+        payload = await request.json()
+        events: asyncio.Queue = asyncio.Queue()
+
+        async def run():
+            EXECUTION_EVENTS.set(events.put_nowait)
+            return await run_tool(tool_name, payload)
+
+        response = web.StreamResponse(
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        await response.prepare(request)
+        task = asyncio.create_task(run())
+        try:
+            while not task.done():
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({task, getter}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    await response.write(
+                        (_dumps({"event": getter.result()}) + "\n").encode()
+                    )
+                else:
+                    getter.cancel()
+            while not events.empty():
+                line = _dumps({"event": events.get_nowait()})
+                await response.write((line + "\n").encode())
+            try:
+                status, content = task.result()
+            except Exception as e:
+                status, content = 500, str(e)
+            line = _dumps({"status": status, "content": content})
+            await response.write((line + "\n").encode())
+        finally:
+            if not task.done():
+                task.cancel()
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/tools", get_tools)
+    app.router.add_post("/stream/{tool_name}", call_tool_stream)
+    app.router.add_post("/{tool_name}", call_tool)
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_http(url: str, timeout: float):
+    from giga_agent.utils.http import get_http_session
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with get_http_session().get(url) as res:
+                if res.status < 500:
+                    return
+        except Exception:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"{url} не поднялся за {timeout} с")
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+def _rss_mb() -> float:
+    """Пиковый RSS процесса бенчмарка (граф и заглушка инструментов)."""
+    # ru_maxrss в Linux — в килобайтах, в macOS — в байтах
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+async def _sample_kernels_rss(repl_url: str, samples: list[int], interval: float):
+    """
+    Суммарный RSS ядер REPL (вместе с их дочерними процессами) из `/kernels`.
+    Ядра гасятся в конце каждого треда, поэтому память снимается по ходу
+    прогона, а в отчёт идёт пик.
+    """
+    from giga_agent.utils.http import get_http_session
+
+    while True:
+        try:
+            async with get_http_session().get(f"{repl_url}/kernels") as res:
+                samples.append((await res.json())["total_rss"])
+        except Exception:
+            pass
+        await asyncio.sleep(interval)
+
+
+async def run_thread(graph, jupyter, messages: list[str], step_latencies: dict):
+    from langchain_core.messages import HumanMessage
+    from langgraph.types import Command
+
+    config = {"configurable": {"thread_id": str(uuid4())}}
+    turn_times = []
+    for message in messages:
+        started = time.perf_counter()
+        graph_input = {"messages": [HumanMessage(content=message)]}
+        while True:
+            interrupted = False
+            step_started = time.perf_counter()
+            async for update in graph.astream(
+                graph_input, config, stream_mode="updates"
+            ):
+                now = time.perf_counter()
+                for node in update:
+                    if node == "__interrupt__":
+                        interrupted = True
+                    else:
+                        step_latencies[node].append(now - step_started)
+                step_started = now
+            if not interrupted:
+                break
+            graph_input = Command(resume={"type": "approve"})
+        turn_times.append(time.perf_counter() - started)
+    kernel_id = (await graph.aget_state(config)).values.get("kernel_id")
+    if kernel_id:
+        await jupyter.shutdown_kernel(kernel_id)
+    return turn_times
+
+
+async def main(args):
+    repl_process = None
+    repl_url = args.repl_url
+    if repl_url is None:
+        port = _free_port()
+        repl_url = f"http://127.0.0.1:{port}"
+        repl_process = subprocess.Popen(
+            args.repl_cmd.format(port=port).split(), cwd=REPL_DIR
+        )
+    tool_port = _free_port()
+    tool_url = f"http://127.0.0.1:{tool_port}"
+    _setup_env(repl_url, tool_url)
+
+    scenario = {"turns": DEFAULT_TURNS, "tool_results": DEFAULT_TOOL_RESULTS}
+    if args.scenario:
+        loaded = json.loads(Path(args.scenario).read_text())
+        scenario = loaded if isinstance(loaded, dict) else {"turns": loaded}
+        scenario.setdefault("tool_results", {})
+
+    from langgraph.checkpoint.memory import InMemorySaver
+    from langgraph.store.memory import InMemoryStore
+
+    import giga_agent.tool_graph as tool_graph
+    from giga_agent.utils.http import close_http_sessions
+    from giga_agent.utils.plot_render import shutdown_render_pool
+    from giga_agent.utils.jupyter import JupyterClient
+
+    tool_graph.llm = make_replay_model(scenario["turns"], args.llm_latency)
+    graph = tool_graph.workflow.compile(
+        checkpointer=InMemorySaver(), store=InMemoryStore()
+    )
+    jupyter = JupyterClient(base_url=repl_url)
+
+    runner = web.AppRunner(
+        make_tool_server(scenario["tool_results"], args.tool_latency)
+    )
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", tool_port).start()
+    sampler = None
+    try:
+        await _wait_http(f"{repl_url}/pool", args.repl_timeout)
+        # Прогрев: импорт модулей графа и первый запуск ядра не должны попадать в замер
+        await run_thread(graph, jupyter, DEFAULT_MESSAGES[:1], defaultdict(list))
+
+        step_latencies = defaultdict(list)
+        rss_before = _rss_mb()
+        kernels_rss = [0]
+        sampler = asyncio.create_task(
+            _sample_kernels_rss(repl_url, kernels_rss, args.rss_interval)
+        )
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(
+                run_thread(
+                    graph,
+                    jupyter,
+                    [
+                        DEFAULT_MESSAGES[(thread + turn) % len(DEFAULT_MESSAGES)]
+                        for turn in range(args.turns)
+                    ],
+                    step_latencies,
+                )
+                for thread in range(args.threads)
+            )
+        )
+        elapsed = time.perf_counter() - started
+        rss_after = _rss_mb()
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+        await runner.cleanup()
+        shutdown_render_pool()
+        await close_http_sessions()
+        if repl_process is not None:
+            repl_process.terminate()
+            repl_process.wait(timeout=30)
+
+    turn_times = [value for thread in results for value in thread]
+    report = {
+        "threads": args.threads,
+        "turns": len(turn_times),
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(len(turn_times) / elapsed, 3),
+        "turn_p50_s": round(_percentile(turn_times, 0.5), 4),
+        "turn_p95_s": round(_percentile(turn_times, 0.95), 4),
+        "steps": {
+            node: {
+                "count": len(values),
+                "p50_s": round(_percentile(values, 0.5), 4),
+                "p95_s": round(_percentile(values, 0.95), 4),
+            }
+            for node, values in sorted(step_latencies.items())
+        },
+        "bench_peak_rss_mb": round(rss_after, 1),
+        "bench_rss_per_thread_mb": round((rss_after - rss_before) / args.threads, 3),
+        "kernels_peak_rss_mb": round(max(kernels_rss) / 1024 / 1024, 1),
+        "kernel_rss_per_thread_mb": round(
+            max(kernels_rss) / 1024 / 1024 / args.threads, 3
+        ),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--turns", type=int, default=1, help="Ходов на тред")
+    parser.add_argument("--scenario", help="JSON со сценарием ходов модели")
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.0, help="Задержка ответа модели, с"
+    )
+    parser.add_argument(
+        "--tool-latency", type=float, default=0.0, help="Задержка инструментов, с"
+    )
+    parser.add_argument("--repl-url", help="Уже запущенный REPL-сервис")
+    parser.add_argument(
+        "--repl-cmd",
+        default="uv run uvicorn app.main:app --port {port}",
+        help="Команда запуска REPL-сервиса (в каталоге backend/repl)",
+    )
+    parser.add_argument("--repl-timeout", type=float, default=120.0)
+    parser.add_argument(
+        "--rss-interval", type=float, default=0.5, help="Период опроса /kernels, с"
+    )
+    parser.add_argument("--output", help="Куда сохранить отчёт в JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
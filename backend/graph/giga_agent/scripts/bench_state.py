@@ -0,0 +1,100 @@
+"""
+Сравнение подготовки состояния в `tool_call`: прежний `copy.deepcopy` всего
+состояния против `project_state`.
+
+Состояние синтетическое: `--messages` сообщений истории с результатами
+инструментов по `--result-kb` КБ и `--tools` схем инструментов. Печатает
+время и пиковый объём выделенной памяти (tracemalloc) на один шаг.
+
+Запуск:
+    uv run python -m giga_agent.scripts.bench_state --messages 200
+"""
+
+import argparse
+import copy
+import json
+import time
+import tracemalloc
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from giga_agent.utils.state import project_state
+
+
+def make_state(messages: int, result_kb: int, tools: int) -> dict:
+    history = [HumanMessage(content="Построй график по данным")]
+    payload = json.dumps({"data": "x" * (result_kb * 1024)})
+    for idx in range(messages // 2):
+        call_id = f"call_{idx}"
+        history.append(
+            AIMessage(
+                content="```python\nprint(df.describe())\n```",
+                tool_calls=[{"name": "python", "args": {"code": "..."}, "id": call_id}],
+            )
+        )
+        history.append(ToolMessage(content=payload, tool_call_id=call_id))
+    schemas = [
+        {
+            "name": f"tool_{idx}",
+            "description": "Описание инструмента " * 20,
+            "parameters": {
+                "type": "object",
+                "properties": {f"arg_{arg}": {"type": "string"} for arg in range(10)},
+            },
+        }
+        for idx in range(tools)
+    ]
+    return {
+        "messages": history,
+        "tools": schemas,
+        "kernel_id": "kernel",
+        "file_ids": [f"file_{idx}" for idx in range(20)],
+        "tool_call_index": messages // 2,
+    }
+
+
+def step_deepcopy(state: dict):
+    action = copy.deepcopy(state["messages"][-2].tool_calls[0])
+    state_ = copy.deepcopy(state)
+    state_.pop("messages")
+    return action, state_
+
+
+def step_projection(state: dict):
+    call = state["messages"][-2].tool_calls[0]
+    action = {**call, "args": dict(call.get("args") or {})}
+    return action, project_state(state)
+
+
+def measure(step, state: dict, repeat: int) -> dict:
+    tracemalloc.start()
+    step(state)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        step(state)
+    return {
+        "ms_per_step": round((time.perf_counter() - started) / repeat * 1000, 3),
+        "peak_alloc_kb": round(peak / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк подготовки состояния")
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--result-kb", type=int, default=40)
+    parser.add_argument("--tools", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    state = make_state(args.messages, args.result_kb, args.tools)
+    report = {
+        "before_deepcopy": measure(step_deepcopy, state, args.repeat),
+        "after_projection": measure(step_projection, state, args.repeat),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,19 @@
 import asyncio
 import base64
-import io
 import json
 import os
-import uuid
 from contextlib import asynccontextmanager
 from pathlib import Path
 from uuid import uuid4
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.responses import (
+    HTMLResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from sqlmodel import SQLModel, Field, select, func
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
@@ -20,7 +23,24 @@ from sqlalchemy.orm import sessionmaker
 from langgraph_sdk import get_client
 
 from giga_agent.utils.env import load_project_env
-from giga_agent.utils.llm import is_llm_image_inline
+from giga_agent.utils.http import (
+    close_http_sessions,
+    get_http_pool_stats,
+    get_http_session,
+    make_timeout,
+)
+from giga_agent.utils.prompt_cache import get_prefix_cache_stats
+from giga_agent.utils.attachments import (
+    get_attachment_cache_stats,
+    inline_bytes,
+    is_stored,
+    mark_stored,
+    offload_blob,
+    store_digest,
+    upload_image as upload_attachment,
+)
+from giga_agent.utils.blob_store import get_blob_store
+from giga_agent.utils.metrics import render_prometheus
 
 from giga_agent.config import llm
 
@@ -107,6 +127,7 @@ async def lifespan(app: FastAPI):
     await init_db()
     yield
     # Clean up connections
+    await close_http_sessions()
 
 
 # Запускаем инициализацию при старте
@@ -195,39 +216,139 @@ async def delete_task(task_id: str):
         await session.commit()
 
 
+# Блобы адресуются по содержимому и не меняются, их можно кэшировать надолго
+BLOB_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+def _parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Один диапазон `bytes=start-end` (а также `start-` и `-suffix`).
+    None — отдать весь блоб: так же поступаем с несколькими диапазонами.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        else:
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    end = min(end, size - 1)
+    if start > end:
+        raise HTTPException(416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def _blob_response(namespace: tuple, file_id: str, request: Request):
+    """Отдаёт байты вложения потоком, с поддержкой Range и кэширования."""
+    result = await get_client().store.get_item(namespace, key=file_id)
+    if not result:
+        raise HTTPException(404, "Attachment not found")
+    value = result["value"]
+    if "blob_key" not in value:
+        # Запись до переноса байтов в блоб-хранилище
+        inline = inline_bytes(value)
+        if inline is None:
+            raise HTTPException(404, "Attachment not found")
+        data, content_type = inline
+        return Response(content=data, media_type=content_type)
+
+    blob_store = get_blob_store()
+    key = value["blob_key"]
+    # Ключ блоба — хэш содержимого, поэтому байты по нему никогда не меняются
+    headers = {
+        "ETag": f'"{key}"',
+        "Cache-Control": BLOB_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    size = value.get("size")
+    if size is None:
+        size = await blob_store.size(key)
+        if size is None:
+            raise HTTPException(404, "Attachment not found")
+    byte_range = _parse_range(request.headers.get("range"), size)
+    start, end = byte_range or (0, size - 1)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        blob_store.iter_range(key, start, end),
+        status_code=206 if byte_range is not None else 200,
+        media_type=value["content_type"],
+        headers=headers,
+    )
+
+
 @app.get("/html/{html_id}/", response_class=HTMLResponse)
-async def get_task(html_id: str):
-    client = get_client()
-    result = await client.store.get_item(("html",), key=html_id)
-    if result:
-        return HTMLResponse(content=result["value"]["data"], status_code=200)
-    else:
-        raise HTTPException(404, "Page not found")
+async def get_html(html_id: str, request: Request):
+    return await _blob_response(("html",), html_id, request)
+
+
+@app.get("/attachments/{file_id}/")
+async def get_attachment(file_id: str, request: Request):
+    return await _blob_response(("attachments",), file_id, request)
+
+
+@app.get("/audio/{file_id}/")
+async def get_audio(file_id: str, request: Request):
+    return await _blob_response(("audio",), file_id, request)
 
 
 @app.post("/upload/image/")
 async def upload_image(file: UploadFile = File(...)):
     client = get_client()
     file_bytes = await file.read()
-    if is_llm_image_inline():
-        uploaded_id = (
-            await llm.aupload_file(
-                (
-                    f"{uuid.uuid4()}.jpg",
-                    io.BytesIO(file_bytes),
-                )
-            )
-        ).id_
-    else:
-        uploaded_id = str(uuid.uuid4())
-    await client.store.put_item(
-        ("attachments",),
-        uploaded_id,
+    uploaded_id = await upload_attachment(file_bytes, filename="image.jpg")
+    # Те же метаданные и тот же хэш, что и у вложений из tool_call: повторная
+    # загрузка картинки получает тот же id и не пишется в store заново
+    metadata = await offload_blob(
         {
             "file_id": uploaded_id,
-            "data": base64.b64encode(file_bytes).decode(),
             "type": "image/png",
-        },
-        ttl=None,
+            "data": base64.b64encode(file_bytes).decode(),
+        }
     )
+    digest, size = store_digest(metadata)
+    if not is_stored(("attachments",), uploaded_id, digest, size):
+        await client.store.put_item(("attachments",), uploaded_id, metadata, ttl=None)
+        mark_stored(("attachments",), uploaded_id, digest)
     return {"id": uploaded_id}
+
+
+@app.get("/metrics/http/")
+async def http_metrics():
+    return get_http_pool_stats()
+
+
+@app.get("/metrics/prompt-cache/")
+async def prompt_cache_metrics():
+    return get_prefix_cache_stats()
+
+
+@app.get("/metrics/attachments/")
+async def attachment_cache_metrics():
+    """
+    Кэш вложений этого процесса (gen_image, мемы, `/upload/image/`) и
+    tool_server, где загружаются картинки и графики из ячеек python.
+    """
+    tool_url = os.getenv("TOOL_CLIENT_API", "http://127.0.0.1:8811")
+    try:
+        async with get_http_session().get(
+            f"{tool_url}/metrics/attachments", timeout=make_timeout(10)
+        ) as res:
+            tool_server = await res.json()
+    except Exception as e:
+        tool_server = {"error": str(e)}
+    return {"graph": get_attachment_cache_stats(), "tool_server": tool_server}
+
+
+@app.get("/metrics/")
+async def prometheus_metrics():
+    """Время, токены LLM и HTTP-трафик по узлам графов в формате Prometheus."""
+    return PlainTextResponse(
+        render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
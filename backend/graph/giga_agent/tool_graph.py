@@ -1,4 +1,6 @@
+import asyncio
 import copy
+import functools
 import json
 import os
 import re
@@ -12,7 +14,8 @@ from genson import SchemaBuilder
 from langchain_core.messages import (
     ToolMessage,
 )
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import StateGraph
 from langgraph.prebuilt.tool_node import _handle_tool_error, ToolNode
 from langgraph.store.base import BaseStore
@@ -20,6 +23,7 @@ from langgraph.types import interrupt
 
 from giga_agent.config import (
     AgentState,
+    PARALLEL_TOOL_CALLS,
     REPL_TOOLS,
     SERVICE_TOOLS,
     AGENT_MAP,
@@ -29,10 +33,20 @@ from giga_agent.prompts.few_shots import FEW_SHOTS_ORIGINAL, FEW_SHOTS_UPDATED
 from giga_agent.prompts.main_prompt import SYSTEM_PROMPT
 from giga_agent.repl_tools.utils import describe_repl_tool
 from giga_agent.tool_server.tool_client import ToolClient
+from giga_agent.tools.python import push_execution_event
+from giga_agent.utils.attachments import put_attachments
+from giga_agent.utils.compaction import compact_messages
 from giga_agent.utils.env import load_project_env
 from giga_agent.utils.jupyter import JupyterClient
 from giga_agent.utils.lang import LANG
-from giga_agent.utils.python import prepend_code
+from giga_agent.utils.metrics import instrument_node
+from giga_agent.utils.prompt_cache import get_prefix, provider_cache_session
+from giga_agent.utils.python import (
+    is_state_missing,
+    mark_state_sent,
+    prepend_code,
+)
+from giga_agent.utils.state import project_state
 
 load_project_env()
 
@@ -62,7 +76,6 @@ prompt = ChatPromptTemplate.from_messages(
         if os.getenv("REPL_FROM_MESSAGE", "1") == "1"
         else FEW_SHOTS_UPDATED
     )
-    + [MessagesPlaceholder("messages", optional=True)]
 ).partial(repl_inner_tools=generate_repl_tools_description(), language=LANG)
 
 
@@ -85,7 +98,7 @@ client = JupyterClient(
 )
 
 
-async def agent(state: AgentState):
+async def agent(state: AgentState, config: RunnableConfig):
     tool_client = ToolClient(
         base_url=os.getenv("TOOL_CLIENT_API", "http://127.0.0.1:8811")
     )
@@ -97,7 +110,7 @@ async def agent(state: AgentState):
         await client.execute(kernel_id, "function_results = []")
     if not tools:
         tools = await tool_client.get_tools()
-    ch = (prompt | llm.bind_tools(tools, parallel_tool_calls=False)).with_retry()
+    ch = llm.bind_tools(tools, parallel_tool_calls=PARALLEL_TOOL_CALLS).with_retry()
     if state["messages"][-1].type == "human":
         user_input = state["messages"][-1].content
         files = state["messages"][-1].additional_kwargs.get("files", [])
@@ -129,7 +142,10 @@ async def agent(state: AgentState):
         state["messages"][
             -1
         ].content = f"<task>{user_input}</task> Активно планируй и следуй своему плану! Действуй по простым шагам!{generate_user_info(state)}\n{file_prompt}\n{selected_prompt}\nСледующий шаг: "
-    message = await ch.ainvoke({"messages": state["messages"]})
+    prefix_key, prefix = get_prefix(prompt, tools)
+    thread_id = config.get("configurable", {}).get("thread_id")
+    with provider_cache_session(prefix_key, thread_id):
+        message = await ch.ainvoke(prefix + compact_messages(state["messages"]))
     message.additional_kwargs.pop("function_call", None)
     message.additional_kwargs["rendered"] = True
     return {
@@ -140,137 +156,249 @@ async def agent(state: AgentState):
     }
 
 
+async def _run_action(action: dict, state: AgentState, tool_client: ToolClient):
+    if action.get("name") == "python":
+        # Вывод ячейки показывается в UI по мере выполнения
+        on_event = functools.partial(
+            push_execution_event, tool_call_id=action.get("id")
+        )
+        result = await tool_client.aexecute_stream(
+            "python", action.get("args"), on_event
+        )
+        if is_state_missing(result):
+            # Ядро перезапускалось и забыло состояние — повторяем с ним целиком
+            args = {
+                **action["args"],
+                "code": prepend_code(action["user_code"], state, resend_state=True),
+            }
+            result = await tool_client.aexecute_stream("python", args, on_event)
+        if not is_state_missing(result):
+            # Пролог отработал — ядро знает текущее состояние
+            mark_state_sent(state)
+        return result
+    if action.get("name") not in AGENT_MAP:
+        return await tool_client.aexecute(action.get("name"), action.get("args"))
+    tool_node = ToolNode(tools=list(AGENT_MAP.values()))
+    injected_args = tool_node.inject_tool_args(
+        {"name": action.get("name"), "args": action.get("args"), "id": "123"},
+        state,
+        None,
+    )["args"]
+    return await AGENT_MAP[action.get("name")].ainvoke(injected_args)
+
+
+async def _run_actions(
+    actions: list[dict], state: AgentState, tool_client: ToolClient
+) -> list:
+    """
+    Выполняет вызовы конкурентно. Возвращает результат или исключение на месте
+    каждого вызова. Несколько обычных инструментов уходят одним запросом
+    `/batch`; `python` (его вывод стримится) и агенты — по отдельности.
+    """
+    batched = [
+        idx
+        for idx, action in enumerate(actions)
+        if action.get("name") != "python" and action.get("name") not in AGENT_MAP
+    ]
+    if len(batched) < 2:
+        batched = []
+    separate = [idx for idx in range(len(actions)) if idx not in batched]
+    calls = [_run_action(actions[idx], state, tool_client) for idx in separate]
+    if batched:
+        calls.append(
+            tool_client.abatch(
+                [(actions[idx]["name"], actions[idx].get("args")) for idx in batched]
+            )
+        )
+    gathered = await asyncio.gather(*calls, return_exceptions=True)
+    results = [None] * len(actions)
+    for idx, result in zip(separate, gathered):
+        results[idx] = result
+    if batched:
+        batch_results = gathered[-1]
+        if isinstance(batch_results, Exception):
+            batch_results = [batch_results] * len(batched)
+        for idx, result in zip(batched, batch_results):
+            results[idx] = result
+    return results
+
+
+def _prepare_python_action(action: dict, state: AgentState, code_taken: bool):
+    """Достаёт код для `python`. Возвращает текст ошибки, если кода нет."""
+    if os.getenv("REPL_FROM_MESSAGE", "1") == "1":
+        if code_taken:
+            # Код в сообщении один — второй вызов `python` за шаг его не получит
+            return "За один шаг можно выполнить только один блок кода!"
+        action["args"]["code"] = get_code_arg(state["messages"][-1].content)
+    else:
+        # На случай если гига отправить в аргумент ```python(.+)``` строку
+        code_arg = get_code_arg(action["args"].get("code"))
+        if code_arg:
+            action["args"]["code"] = code_arg
+    if "code" not in action["args"] or not action["args"]["code"]:
+        return "Напиши код в своем сообщении!"
+    action["user_code"] = action["args"]["code"]
+    action["args"]["code"] = prepend_code(action["user_code"], state)
+
+
 async def tool_call(
     state: AgentState,
     store: BaseStore,
 ):
+    """
+    Выполняет вызовы инструментов из последнего сообщения. По умолчанию — только
+    первый; при PARALLEL_TOOL_CALLS=1 все вызовы выполняются конкурентно после
+    одного подтверждения, а их результаты одним запросом дописываются в
+    `function_results` ядра.
+    """
     tool_client = ToolClient(
         base_url=os.getenv("TOOL_CLIENT_API", "http://127.0.0.1:8811")
     )
-    action = copy.deepcopy(state["messages"][-1].tool_calls[0])
+    tool_calls = state["messages"][-1].tool_calls
+    if not PARALLEL_TOOL_CALLS:
+        tool_calls = tool_calls[:1]
+    # Меняем только args (подставляем код), поэтому глубокая копия не нужна
+    actions = [{**call, "args": dict(call.get("args") or {})} for call in tool_calls]
     value = interrupt({"type": "approve"})
     if value.get("type") == "comment":
         return {
-            "messages": ToolMessage(
-                tool_call_id=action.get("id", str(uuid4())),
-                content=json.dumps(
-                    {
-                        "message": f'Пользователь оставил комментарий к твоему вызову инструмента. Прочитай его и реши, как действовать дальше: "{value.get("message")}"'
-                    },
-                    ensure_ascii=False,
-                ),
-            )
-        }
-    tool_call_index = state.get("tool_call_index", -1)
-    if action.get("name") == "python":
-        if os.getenv("REPL_FROM_MESSAGE", "1") == "1":
-            action["args"]["code"] = get_code_arg(state["messages"][-1].content)
-        else:
-            # На случай если гига отправить в аргумент ```python(.+)``` строку
-            code_arg = get_code_arg(action["args"].get("code"))
-            if code_arg:
-                action["args"]["code"] = code_arg
-        if "code" not in action["args"] or not action["args"]["code"]:
-            return {
-                "messages": ToolMessage(
+            "messages": [
+                ToolMessage(
                     tool_call_id=action.get("id", str(uuid4())),
                     content=json.dumps(
-                        {"message": "Напиши код в своем сообщении!"},
+                        {
+                            "message": f'Пользователь оставил комментарий к твоему вызову инструмента. Прочитай его и реши, как действовать дальше: "{value.get("message")}"'
+                        },
                         ensure_ascii=False,
                     ),
                 )
-            }
-        action["args"]["code"] = prepend_code(action["args"]["code"], state)
+                for action in actions
+            ]
+        }
+    tool_call_index = state.get("tool_call_index", -1)
+    messages = [None] * len(actions)
+    ready = []
+    code_taken = False
+    for idx, action in enumerate(actions):
+        if action.get("name") == "python":
+            error = _prepare_python_action(action, state, code_taken)
+            code_taken = True
+            if error:
+                messages[idx] = ToolMessage(
+                    tool_call_id=action.get("id", str(uuid4())),
+                    content=json.dumps({"message": error}, ensure_ascii=False),
+                )
+                continue
+        ready.append(idx)
+
+    tool_client.set_state(project_state(state))
+    results = await _run_actions([actions[idx] for idx in ready], state, tool_client)
+
     file_ids = []
-    try:
-        state_ = copy.deepcopy(state)
-        state_.pop("messages")
-        tool_client.set_state(state_)
-        if action.get("name") not in AGENT_MAP:
-            result = await tool_client.aexecute(action.get("name"), action.get("args"))
-        else:
-            tool_node = ToolNode(tools=list(AGENT_MAP.values()))
-            injected_args = tool_node.inject_tool_args(
-                {"name": action.get("name"), "args": action.get("args"), "id": "123"},
-                state,
-                None,
-            )["args"]
-            result = await AGENT_MAP[action.get("name")].ainvoke(injected_args)
-        tool_call_index += 1
+    function_results = []
+    stored = []
+    # (индекс вызова, текст сообщения, вложения) успешно обработанных
+    pending = []
+    # Если запись в ядро не удастся, индексы в сообщениях модели не должны сдвинуться
+    start_index = tool_call_index
+    for idx, result in zip(ready, results):
+        action = actions[idx]
         try:
-            result = json.loads(result)
+            if isinstance(result, Exception):
+                raise result
+            try:
+                result = json.loads(result)
+            except Exception as e:
+                pass
+            if result:
+                # Индекс растёт только для результатов, которые попадут в ядро
+                tool_call_index += 1
+                add_data = {
+                    "data": result,
+                    "message": f"Результат функции сохранен в переменную `function_results[{tool_call_index}]['data']` ",
+                }
+                # Копия: ниже из result убираются attention и giga_attachments,
+                # а в ядро результат должен попасть целиком
+                function_results.append(copy.deepcopy(add_data))
+                stored.append(idx)
+                if (
+                    len(json.dumps(result, ensure_ascii=False)) > 10000 * 4
+                    and action.get("name") not in AGENT_MAP
+                ):
+                    schema = SchemaBuilder()
+                    schema.add_object(obj=add_data.pop("data"))
+                    add_data[
+                        "message"
+                    ] += f"Результат функции вышел слишком длинным изучи результат функции в переменной с помощью python. Схема данных:\n"
+                    add_data["schema"] = schema.to_schema()
+                if action.get("name") == "get_urls":
+                    add_data["message"] += result.pop("attention")
+            else:
+                add_data = result
+            attachments = []
+            if isinstance(result, dict) and "giga_attachments" in result:
+                add_data = result
+                attachments = result.pop("giga_attachments")
+                file_ids.extend(attachment["file_id"] for attachment in attachments)
+            # Сообщение собирается после общей записи вложений всех результатов
+            pending.append((idx, json.dumps(add_data, ensure_ascii=False), attachments))
         except Exception as e:
-            pass
-        if result:
-            add_data = {
-                "data": result,
-                "message": f"Результат функции сохранен в переменную `function_results[{tool_call_index}]['data']` ",
-            }
-            await client.execute(
-                state.get("kernel_id"), f"function_results.append({repr(add_data)})"
+            traceback.print_exception(type(e), e, e.__traceback__)
+            messages[idx] = ToolMessage(
+                tool_call_id=action.get("id", str(uuid4())),
+                content=_handle_tool_error(e, flag=True),
             )
-            if (
-                len(json.dumps(result, ensure_ascii=False)) > 10000 * 4
-                and action.get("name") not in AGENT_MAP
-            ):
-                schema = SchemaBuilder()
-                schema.add_object(obj=add_data.pop("data"))
-                add_data[
-                    "message"
-                ] += f"Результат функции вышел слишком длинным изучи результат функции в переменной с помощью python. Схема данных:\n"
-                add_data["schema"] = schema.to_schema()
-            if action.get("name") == "get_urls":
-                add_data["message"] += result.pop("attention")
-        else:
-            add_data = result
-        tool_attachments = []
-        if isinstance(result, dict) and "giga_attachments" in result:
-            add_data = result
-            attachments = result.pop("giga_attachments")
-            file_ids = [attachment["file_id"] for attachment in attachments]
-            for attachment in attachments:
-                if attachment["type"] == "text/html":
-                    await store.aput(
-                        ("html",),
-                        attachment["file_id"],
-                        attachment,
-                        ttl=None,
-                    )
-                elif attachment["type"] == "audio/mp3":
-                    await store.aput(
-                        ("audio",),
-                        attachment["file_id"],
-                        attachment,
-                        ttl=None,
-                    )
-                else:
-                    await store.aput(
-                        ("attachments",),
-                        attachment["file_id"],
-                        attachment,
-                        ttl=None,
-                    )
-
-                tool_attachments.append(
-                    {
-                        "type": attachment["type"],
-                        "file_id": attachment["file_id"],
-                    }
-                )
-        message = ToolMessage(
-            tool_call_id=action.get("id", str(uuid4())),
-            content=json.dumps(add_data, ensure_ascii=False),
-            additional_kwargs={"tool_attachments": tool_attachments},
-        )
+
+    # Вложения всех результатов шага пишутся в store одним put_attachments
+    all_attachments = [
+        attachment for _, _, attachments in pending for attachment in attachments
+    ]
+    try:
+        timings = iter(await put_attachments(store, all_attachments))
     except Exception as e:
         traceback.print_exc()
-        message = ToolMessage(
-            tool_call_id=action.get("id", str(uuid4())),
-            content=_handle_tool_error(e, flag=True),
+        timings = None
+        attachments_error = _handle_tool_error(e, flag=True)
+    for idx, content, attachments in pending:
+        tool_call_id = actions[idx].get("id", str(uuid4()))
+        if attachments and timings is None:
+            messages[idx] = ToolMessage(
+                tool_call_id=tool_call_id, content=attachments_error
+            )
+            continue
+        tool_attachments = [
+            {
+                "type": attachment["type"],
+                "file_id": attachment["file_id"],
+                "timings": next(timings),
+            }
+            for attachment in attachments
+        ]
+        messages[idx] = ToolMessage(
+            tool_call_id=tool_call_id,
+            content=content,
+            additional_kwargs={"tool_attachments": tool_attachments},
         )
 
+    if function_results:
+        try:
+            await client.put_data(
+                state.get("kernel_id"),
+                "function_results",
+                function_results,
+                extend=True,
+            )
+        except Exception as e:
+            traceback.print_exc()
+            tool_call_index = start_index
+            for idx in stored:
+                messages[idx] = ToolMessage(
+                    tool_call_id=actions[idx].get("id", str(uuid4())),
+                    content=_handle_tool_error(e, flag=True),
+                )
+
     return {
-        "messages": [message],
+        "messages": messages,
         "tool_call_index": tool_call_index,
         "file_ids": file_ids,
     }
@@ -284,8 +412,8 @@ def router(state: AgentState) -> Literal["tool_call", "__end__"]:
 
 
 workflow = StateGraph(AgentState)
-workflow.add_node(agent)
-workflow.add_node(tool_call)
+workflow.add_node(instrument_node(agent, "chat"))
+workflow.add_node(instrument_node(tool_call, "chat"))
 workflow.add_edge("__start__", "agent")
 workflow.add_conditional_edges("agent", router)
 workflow.add_edge("tool_call", "agent")
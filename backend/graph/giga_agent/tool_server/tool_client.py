@@ -4,11 +4,30 @@ import json
 import os
 from typing import Any
 
-import aiohttp
 import requests
 from pydantic import BaseModel
 
-from giga_agent.utils.jupyter import JupyterClient
+from giga_agent.utils.http import get_http_session, make_timeout
+
+
+# base_url -> (ETag, схемы инструментов)
+_TOOLS_CACHE: dict[str, tuple[str, list]] = {}
+
+
+async def _iter_ndjson(res):
+    """
+    Объекты из NDJSON-ответа. Строки с графиками бывают длиннее лимита
+    readline, поэтому ответ режется на строки вручную.
+    """
+    buffer = b""
+    async for chunk in res.content.iter_any():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
 
 
 class ToolExecuteException(Exception):
@@ -22,34 +41,67 @@ class ToolNotFoundException(Exception):
 class ToolClient(BaseModel):
     base_url: str
     state: Any = {}
+    timeout: float = 600.0
 
     def set_state(self, state):
         self.state = state
 
     async def aexecute(self, tool_name, kwargs):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/{tool_name}",
-                json={"kwargs": kwargs, "state": self.state},
-                timeout=600.0,
-            ) as res:
-                if res.status == 200:
-                    data = (await res.json())["data"]
-                    try:
-                        data = json.loads(data)
-                    except Exception:
-                        pass
-                    return data
-                elif res.status == 404:
-                    raise ToolNotFoundException((await res.json()))
+        session = get_http_session()
+        async with session.post(
+            f"{self.base_url}/{tool_name}",
+            json={"kwargs": kwargs, "state": self.state},
+            timeout=make_timeout(self.timeout),
+        ) as res:
+            if res.status == 200:
+                data = (await res.json())["data"]
+                try:
+                    data = json.loads(data)
+                except Exception:
+                    pass
+                return data
+            elif res.status == 404:
+                raise ToolNotFoundException((await res.json()))
+            else:
+                raise ToolExecuteException((await res.json()))
+
+    async def aexecute_stream(self, tool_name, kwargs, on_event):
+        """
+        Как `aexecute`, но через `/stream/{tool_name}`: промежуточные события
+        инструмента передаются в `on_event` по мере выполнения.
+        """
+        session = get_http_session()
+        final = None
+        async with session.post(
+            f"{self.base_url}/stream/{tool_name}",
+            json={"kwargs": kwargs, "state": self.state},
+            timeout=make_timeout(self.timeout),
+        ) as res:
+            if res.status != 200:
+                raise ToolExecuteException(await res.text())
+            async for item in _iter_ndjson(res):
+                if "event" in item:
+                    on_event(item["event"])
                 else:
-                    raise ToolExecuteException((await res.json()))
+                    final = item
+        if final is None:
+            raise ToolExecuteException("Инструмент не вернул результат")
+        if final["status"] == 200:
+            data = final["content"]["data"]
+            try:
+                data = json.loads(data)
+            except Exception:
+                pass
+            return data
+        elif final["status"] == 404:
+            raise ToolNotFoundException(final["content"])
+        raise ToolExecuteException(final["content"])
 
     def execute(self, tool_name, kwargs):
         url = f"{self.base_url}/{tool_name}"
         try:
             response = requests.post(
-                url, json={"kwargs": kwargs, "state": self.state}, timeout=600.0
+                url, json={"kwargs": kwargs, "state": self.state}, timeout=self.timeout
             )
         except requests.RequestException as e:
             # Ошибка сети или таймаут
@@ -69,13 +121,60 @@ class ToolClient(BaseModel):
             # Любая другая ошибка выполнения
             raise ToolExecuteException(response.json())
 
+    async def abatch(self, calls, concurrency=None):
+        """
+        Выполняет список пар `(tool_name, kwargs)` одним запросом к `/batch`.
+        Возвращает результаты по порядку; ошибка элемента приходит как
+        исключение на его месте, а не прерывает весь пакет.
+        """
+        session = get_http_session()
+        payload = {
+            "items": [{"tool": name, "kwargs": kwargs} for name, kwargs in calls],
+            "state": self.state,
+            "concurrency": concurrency,
+        }
+        results = []
+        async with session.post(
+            f"{self.base_url}/batch",
+            json=payload,
+            timeout=make_timeout(self.timeout),
+        ) as res:
+            if res.status != 200:
+                raise ToolExecuteException(await res.text())
+            async for item in _iter_ndjson(res):
+                if item["status"] == 200:
+                    data = item["content"]["data"]
+                    try:
+                        data = json.loads(data)
+                    except Exception:
+                        pass
+                    results.append(data)
+                elif item["status"] == 404:
+                    results.append(ToolNotFoundException(item["content"]))
+                else:
+                    results.append(ToolExecuteException(item["content"]))
+        return results
+
     async def get_tools(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/tools",
-                timeout=600.0,
-            ) as res:
-                return await res.json()
+        """
+        Схемы инструментов. Ответ кэшируется по `base_url` и перепроверяется
+        условным запросом с ETag: пока каталог не поменялся, сервер отвечает 304.
+        """
+        session = get_http_session()
+        cached = _TOOLS_CACHE.get(self.base_url)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        async with session.get(
+            f"{self.base_url}/tools",
+            headers=headers,
+            timeout=make_timeout(self.timeout),
+        ) as res:
+            if res.status == 304 and cached:
+                return cached[1]
+            tools = await res.json()
+            etag = res.headers.get("ETag")
+            if res.status == 200 and etag:
+                _TOOLS_CACHE[self.base_url] = (etag, tools)
+            return tools
 
     def call_tool(self, func):
         """
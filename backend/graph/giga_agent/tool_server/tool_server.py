@@ -1,87 +1,270 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
 import traceback
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Body
+from fastapi import FastAPI, Body, Request, Response
 from langchain_gigachat.utils.function_calling import convert_to_gigachat_tool
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from langgraph.prebuilt.tool_node import _handle_tool_error, ToolNode
 from pydantic_core import ValidationError
-from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from giga_agent.utils.env import load_project_env
+from giga_agent.utils.http import close_http_sessions
 from giga_agent.config import MCP_CONFIG, TOOLS, REPL_TOOLS, AGENT_MAP
+from giga_agent.tools.python import EXECUTION_EVENTS
+from giga_agent.utils.attachments import get_attachment_cache_stats
+from giga_agent.utils.plot_render import get_plot_render_stats, shutdown_render_pool
 
 tool_map = {}
 repl_tool_map = {}
 config = {}
+tool_semaphores = {}
+
+# Сколько вызовов одного инструмента из пакетов `/batch` выполняется
+# одновременно (по умолчанию и точечно: TOOL_CONCURRENCY_LIMITS='{"search": 4}').
+# Одиночные вызовы не ограничиваются: их параллелизм задаёт сам граф
+TOOL_CONCURRENCY = int(os.getenv("TOOL_CONCURRENCY", 16))
+TOOL_CONCURRENCY_LIMITS = json.loads(os.getenv("TOOL_CONCURRENCY_LIMITS", "{}"))
+# Как часто перечитывать инструменты MCP-серверов, секунд (0 — только при старте)
+TOOLS_REFRESH_INTERVAL = float(os.getenv("TOOLS_REFRESH_INTERVAL", 0))
 
 load_project_env()
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    client = MultiServerMCPClient(MCP_CONFIG)
+def _build_catalog(tools):
+    """Схемы инструментов для `GET /tools` и их версия (хэш содержимого)."""
+    schemas = [convert_to_gigachat_tool(tool)["function"] for tool in tools]
+    body = json.dumps(schemas, ensure_ascii=False, sort_keys=True, default=str)
+    version = hashlib.sha256(body.encode()).hexdigest()[:16]
+    return schemas, version
+
+
+async def _load_tools(client: MultiServerMCPClient):
+    """Перечитывает инструменты MCP-серверов; каталог пересобирается, только если они поменялись."""
     tools = TOOLS + await client.get_tools()
+    schemas, version = _build_catalog(tools)
+    if version == config.get("tools_version"):
+        return
     config["tool_node"] = ToolNode(tools=tools)
+    tool_map.clear()
     for tool in tools:
         tool_map[tool.name] = tool
+    config["tool_schemas"] = schemas
+    config["tools_version"] = version
+
+
+async def _refresh_tools_loop(client: MultiServerMCPClient):
+    while True:
+        await asyncio.sleep(TOOLS_REFRESH_INTERVAL)
+        try:
+            await _load_tools(client)
+        except Exception:
+            traceback.print_exc()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    client = MultiServerMCPClient(MCP_CONFIG)
+    await _load_tools(client)
     for tool in REPL_TOOLS:
         repl_tool_map[tool.__name__] = tool
+    refresh_task = None
+    if TOOLS_REFRESH_INTERVAL > 0:
+        refresh_task = asyncio.create_task(_refresh_tools_loop(client))
     yield
+    if refresh_task is not None:
+        refresh_task.cancel()
+    await close_http_sessions()
+    shutdown_render_pool()
     repl_tool_map.clear()
     tool_map.clear()
+    tool_semaphores.clear()
     config.clear()
 
 
 app = FastAPI(lifespan=lifespan)
 
 
-@app.post("/{tool_name}")
-async def call_tool(tool_name: str, payload: dict = Body(...)):
-    if tool_name in tool_map or tool_name in repl_tool_map:
-        if tool_name in AGENT_MAP:
-            return JSONResponse(
-                status_code=500,
-                content=f"Ты пытался вызвать '{tool_name}'. "
-                f"Нельзя вызывать '{tool_name}' из кода! Вызывай их через function_call",
+def _tool_semaphore(tool_name: str) -> asyncio.Semaphore:
+    semaphore = tool_semaphores.get(tool_name)
+    if semaphore is None:
+        limit = TOOL_CONCURRENCY_LIMITS.get(tool_name, TOOL_CONCURRENCY)
+        semaphore = tool_semaphores[tool_name] = asyncio.Semaphore(limit)
+    return semaphore
+
+
+def _prepare_call(tool_name: str, kwargs: dict, state: dict):
+    """
+    Проверяет вызов и подставляет injected-аргументы.
+    Возвращает `(args, None)` или `(None, (status_code, content))` с ошибкой.
+    """
+    if tool_name not in tool_map and tool_name not in repl_tool_map:
+        return None, (404, f"Tool with name {tool_name} not found!")
+    if tool_name in AGENT_MAP:
+        return None, (
+            500,
+            f"Ты пытался вызвать '{tool_name}'. "
+            f"Нельзя вызывать '{tool_name}' из кода! Вызывай их через function_call",
+        )
+    if tool_name in repl_tool_map:
+        return kwargs, None
+    tool = tool_map[tool_name]
+    try:
+        injected_args = config["tool_node"].inject_tool_args(
+            {"name": tool.name, "args": kwargs, "id": "123"}, state, None
+        )["args"]
+        if tool.name == "python":
+            injected_args["code"] = kwargs.get("code")
+        tool._to_args_and_kwargs(injected_args, None)
+    except ValidationError as e:
+        content = _handle_tool_error(e, flag=True)
+        tool_schema = convert_to_gigachat_tool(tool)["function"]
+        return None, (
+            500,
+            f"Ошибка в заполнении функции!\n{content}\nЗаполни параметры функции по следующей схеме: {tool_schema}",
+        )
+    except Exception as e:
+        traceback.print_exc()
+        return None, (500, _handle_tool_error(e, flag=True))
+    return injected_args, None
+
+
+async def _run_prepared(tool_name: str, args: dict):
+    """Выполняет уже проверенный вызов. Возвращает `(status_code, content)`."""
+    try:
+        if tool_name in repl_tool_map:
+            return 200, {"data": await repl_tool_map[tool_name](**args)}
+        return 200, {"data": await tool_map[tool_name].ainvoke(args)}
+    except Exception as e:
+        traceback.print_exc()
+        return 500, _handle_tool_error(e, flag=True)
+
+
+async def _run_batched(tool_name: str, args: dict, batch_semaphore=None):
+    """`_run_prepared` под ограничением пакета и инструмента."""
+    batch_limit = batch_semaphore or contextlib.nullcontext()
+    async with batch_limit, _tool_semaphore(tool_name):
+        return await _run_prepared(tool_name, args)
+
+
+# Объявлен до `/{tool_name}`, иначе запрос уйдёт в вызов инструмента "batch"
+@app.post("/batch")
+async def call_batch(payload: dict = Body(...)):
+    """
+    Пакетный вызов: `{"items": [{"tool": ..., "kwargs": {...}}, ...], "state": {...},
+    "concurrency": n}`.
+
+    Все элементы проверяются до запуска, затем выполняются конкурентно с
+    ограничением на каждый инструмент и, если задан `concurrency`, на весь пакет. Ответ — NDJSON, по строке
+    `{"index", "status", "content"}` на элемент в порядке запроса.
+    """
+    items = payload.get("items") or []
+    state = payload.get("state")
+    concurrency = payload.get("concurrency")
+    batch_semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+    tasks = []
+    for item in items:
+        tool_name = item.get("tool")
+        args, error = _prepare_call(tool_name, item.get("kwargs") or {}, state)
+        if error is not None:
+            tasks.append(error)
+        else:
+            tasks.append(
+                asyncio.create_task(_run_batched(tool_name, args, batch_semaphore))
             )
+
+    async def stream():
         try:
-            if tool_name in repl_tool_map:
-                kwargs = payload.get("kwargs")
-                return JSONResponse({"data": await repl_tool_map[tool_name](**kwargs)})
-            tool = tool_map[tool_name]
-            kwargs = payload.get("kwargs")
-            state = payload.get("state")
-            injected_args = config["tool_node"].inject_tool_args(
-                {"name": tool.name, "args": kwargs, "id": "123"}, state, None
-            )["args"]
-            if tool.name == "python":
-                injected_args["code"] = kwargs.get("code")
-            try:
-                tool._to_args_and_kwargs(injected_args, None)
-            except ValidationError as e:
-                content = _handle_tool_error(e, flag=True)
-                tool_schema = convert_to_gigachat_tool(tool)["function"]
-                return JSONResponse(
-                    status_code=500,
-                    content=f"Ошибка в заполнении функции!\n{content}\nЗаполни параметры функции по следующей схеме: {tool_schema}",
-                )
-            data = await tool_map[tool_name].ainvoke(injected_args)
-            return {"data": data}
-        except Exception as e:
-            traceback.print_exc()
-            return JSONResponse(
-                status_code=500, content=_handle_tool_error(e, flag=True)
-            )
+            for index, task in enumerate(tasks):
+                status, content = task if isinstance(task, tuple) else await task
+                line = {"index": index, "status": status, "content": content}
+                yield json.dumps(jsonable_encoder(line), ensure_ascii=False) + "\n"
+        finally:
+            # Клиент отключился — незачем достраивать оставшиеся результаты
+            for task in tasks:
+                if isinstance(task, asyncio.Task) and not task.done():
+                    task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/stream/{tool_name}")
+async def call_tool_stream(tool_name: str, payload: dict = Body(...)):
+    """
+    Как `POST /{tool_name}`, но ответ — NDJSON: строки `{"event": ...}` с
+    промежуточными событиями инструмента (их шлёт `python` через
+    `EXECUTION_EVENTS`) и последняя `{"status", "content"}` с результатом.
+    """
+    args, error = _prepare_call(tool_name, payload.get("kwargs"), payload.get("state"))
+    events: asyncio.Queue = asyncio.Queue()
+
+    async def run():
+        EXECUTION_EVENTS.set(events.put_nowait)
+        return await _run_prepared(tool_name, args)
+
+    def line(item: dict) -> str:
+        return json.dumps(jsonable_encoder(item), ensure_ascii=False) + "\n"
+
+    async def stream():
+        if error is not None:
+            status, content = error
+            yield line({"status": status, "content": content})
+            return
+        # Переменная контекста выставляется внутри задачи и наружу не утекает
+        task = asyncio.create_task(run())
+        try:
+            while not task.done():
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({task, getter}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield line({"event": getter.result()})
+                else:
+                    getter.cancel()
+            while not events.empty():
+                yield line({"event": events.get_nowait()})
+            status, content = task.result()
+            yield line({"status": status, "content": content})
+        finally:
+            if not task.done():
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/{tool_name}")
+async def call_tool(tool_name: str, payload: dict = Body(...)):
+    args, error = _prepare_call(tool_name, payload.get("kwargs"), payload.get("state"))
+    if error is None:
+        status, content = await _run_prepared(tool_name, args)
     else:
-        return JSONResponse(
-            status_code=404, content=f"Tool with name {tool_name} not found!"
-        )
+        status, content = error
+    if status == 200:
+        return content
+    return JSONResponse(status_code=status, content=content)
+
+
+@app.get("/metrics/plot-render")
+async def plot_render_metrics():
+    """Счётчики рендера графиков: `ExecuteTool` выполняется в этом процессе."""
+    return get_plot_render_stats()
+
+
+@app.get("/metrics/attachments")
+async def attachment_metrics():
+    """Кэш вложений процесса, где `ExecuteTool` загружает картинки и графики."""
+    return get_attachment_cache_stats()
 
 
 @app.get("/tools")
-async def get_tools():
-    tools = []
-    for tool in tool_map.values():
-        tools.append(convert_to_gigachat_tool(tool)["function"])
-    return tools
+async def get_tools(request: Request):
+    etag = f'"{config["tools_version"]}"'
+    headers = {"ETag": etag, "X-Tools-Version": config["tools_version"]}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(config["tool_schemas"], headers=headers)
@@ -1,5 +1,4 @@
 import base64
-import uuid
 from typing import List, Annotated
 
 from langchain_core.output_parsers import JsonOutputParser
@@ -15,6 +14,7 @@ from pydantic import Field
 
 from langgraph_sdk import get_client
 
+from giga_agent.utils.attachments import load_attachment_base64, upload_image
 from giga_agent.utils.llm import is_llm_image_inline, load_llm
 from giga_agent.generators.image import load_image_gen
 from giga_agent.prompts.image import IMAGE_PROMPT
@@ -162,11 +162,7 @@ async def ask_about_image(
     else:
         client = get_client()
         result = await client.store.get_item(("attachments",), key=image_id)
-        data = (
-            result["value"]["img_data"]
-            if "img_data" in result["value"]
-            else result["value"]["data"]
-        )
+        data = await load_attachment_base64(result["value"])
         return (
             (
                 await llm.ainvoke(
@@ -218,12 +214,7 @@ async def gen_image(theme: str):
     image_data = await generator.generate_image(
         i["description"], i["width"], i["height"]
     )
-    if is_llm_image_inline():
-        uploaded_file_id = (
-            await llm.aupload_file(("image.png", base64.b64decode(image_data)))
-        ).id_
-    else:
-        uploaded_file_id = str(uuid.uuid4())
+    uploaded_file_id = await upload_image(base64.b64decode(image_data))
     return {
         "image_description": i["description"],
         "message": f'В результате выполнения было сгенерировано изображение {uploaded_file_id}. Покажи его пользователю через "![описание изображения](graph:{uploaded_file_id})"',
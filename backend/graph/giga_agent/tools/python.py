@@ -1,14 +1,13 @@
-import asyncio
-import json
-import uuid
 from base64 import b64decode, b64encode
+from contextvars import ContextVar
 
-import plotly
 from pydantic import BaseModel, Field
 
-from giga_agent.utils.llm import is_llm_image_inline, load_llm
+from giga_agent.utils.attachments import upload_images
 from giga_agent.utils.jupyter import JupyterClient
+from giga_agent.utils.plot_render import render_plots
 from langchain_core.tools import BaseTool
+from langgraph.graph.ui import push_ui_message
 import re
 import os
 
@@ -21,6 +20,30 @@ INPUT_REGEX = re.compile(r"input\(.+?\)")
 FILE_NOT_FOUND_REGEX = re.compile(r"FileNotFoundError:.+?No such file or directory")
 
 
+# Куда ExecuteTool отдаёт промежуточные события ячейки. Задаёт tool_server на
+# время `POST /stream/{tool_name}`, оттуда события по NDJSON доходят до узла графа
+EXECUTION_EVENTS: ContextVar = ContextVar("execution_events", default=None)
+UI_EVENT_TYPES = ("stream", "display_data", "execute_result")
+
+
+def push_execution_event(event: dict, tool_call_id: str | None = None):
+    """Отправляет промежуточный результат выполнения ячейки в UI.
+
+    Вызывается в узле графа; вне запуска графа событие пропускается.
+    """
+    if event["type"] == "stream":
+        props = {"text": event["text"]}
+    elif event["type"] in ("display_data", "execute_result"):
+        props = {"attachment": event["data"]}
+    else:
+        return
+    props["tool_call_id"] = tool_call_id
+    try:
+        push_ui_message("python_execution", props)
+    except (KeyError, RuntimeError):
+        pass
+
+
 class ExecuteTool(BaseTool):
     name: str = "python"
     description: str = (
@@ -47,7 +70,15 @@ class ExecuteTool(BaseTool):
                 "is_exception": True,
             }
 
-        response = await client.execute(self.kernel_id, code)
+        response = None
+        emit = EXECUTION_EVENTS.get()
+        async for event in client.execute_stream(self.kernel_id, code):
+            if event["type"] == "done":
+                response = event
+            elif emit is not None and event["type"] in UI_EVENT_TYPES:
+                emit(event)
+        if response is None:
+            raise Exception("Выполнение кода прервалось без результата")
         result = response["result"]
         results = []
         if result is not None:
@@ -55,6 +86,18 @@ class ExecuteTool(BaseTool):
         file_ids = []
         have_images = False
         attachments = []
+        # (позиция в results, текст, вложение, PNG) — загружаются после цикла разом
+        images = []
+        # Все графики ячейки рисуются параллельно в пуле процессов
+        plots = iter(
+            await render_plots(
+                [
+                    attachment["application/vnd.plotly.v1+json"]
+                    for attachment in response["attachments"]
+                    if "application/vnd.plotly.v1+json" in attachment
+                ]
+            )
+        )
         for attachment in response["attachments"]:
             img = None
             attachment_info = ""
@@ -64,9 +107,7 @@ class ExecuteTool(BaseTool):
                 results.append(
                     "В результате выполнения был сгенерирован график. "  # Он показан пользователю.
                 )
-                data = json.dumps(attachment["application/vnd.plotly.v1+json"])
-                plot = plotly.io.from_json(data)
-                img = await asyncio.to_thread(plotly.io.to_image, plot, format="png")
+                img = next(plots)
                 attachment_data["type"] = "application/vnd.plotly.v1+json"
                 attachment_data["data"] = attachment["application/vnd.plotly.v1+json"]
             elif "image/png" in attachment:
@@ -76,16 +117,19 @@ class ExecuteTool(BaseTool):
                 attachment_data["data"] = attachment["image/png"]
             if img is not None:
                 have_images = True
-                if is_llm_image_inline():
-                    llm = load_llm()
-                    uploaded_file_id = (await llm.aupload_file(("image.png", img))).id_
-                else:
-                    uploaded_file_id = str(uuid.uuid4())
-                attachment_data["img_data"] = b64encode(img)
-                attachment_data["file_id"] = uploaded_file_id
-                attachment_info += f"ID изображения '{uploaded_file_id}'. Ты можешь показать это пользователю с помощью через \"![График](graph:{uploaded_file_id})\" "
-                results.append(attachment_info)
-                attachments.append(attachment_data)
+                images.append((len(results), attachment_info, attachment_data, img))
+                results.append(None)
+        uploads = await upload_images([img for *_, img in images])
+        for (position, attachment_info, attachment_data, img), upload in zip(
+            images, uploads
+        ):
+            uploaded_file_id, upload_ms = upload
+            attachment_data["img_data"] = b64encode(img)
+            attachment_data["file_id"] = uploaded_file_id
+            attachment_data["timings"] = {"upload_ms": upload_ms}
+            attachment_info += f"ID изображения '{uploaded_file_id}'. Ты можешь показать это пользователю с помощью через \"![График](graph:{uploaded_file_id})\" "
+            results[position] = attachment_info
+            attachments.append(attachment_data)
         result = "\n".join(results)
         if have_images:
             result += "\nНе забывай, что у тебя есть анализ изображений. С помощью анализа ты можешь сравнить то, что ты ожидал получить в графике с тем что получилось на деле!\nТакже не забывай, что ты ОБЯЗАН вывести изображения/графики пользователю при формировании финального ответа!"
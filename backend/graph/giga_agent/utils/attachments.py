@@ -0,0 +1,265 @@
+"""
+Кэш вложений по содержимому.
+
+Агенты часто заново рисуют тот же график или показывают ту же картинку.
+Ключ вложения — SHA-256 его байтов: повторная картинка получает прежний
+`file_id` без новой загрузки в LLM (`aupload_file`), а запись в store с тем же
+ключом и тем же содержимым пропускается. Одновременные загрузки одинаковых
+байтов объединяются в одну.
+
+Кэш живёт в процессе и ограничен ATTACHMENT_CACHE_SIZE записями и
+ATTACHMENT_CACHE_TTL секундами (файлы у провайдера LLM живут не вечно).
+
+Байты вложений (картинки, PNG графиков, HTML, MP3) уходят в блоб-хранилище
+(`giga_agent.utils.blob_store`), в store пишутся только метаданные с
+`blob_key`. Старые записи с base64 в `data` по-прежнему читаются.
+"""
+
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from langgraph.store.base import BaseStore, PutOp
+
+from giga_agent.utils.blob_store import get_blob_store
+from giga_agent.utils.llm import is_llm_image_inline, load_llm
+
+ATTACHMENT_CACHE_SIZE = int(os.getenv("ATTACHMENT_CACHE_SIZE", 10000))
+ATTACHMENT_CACHE_TTL = float(os.getenv("ATTACHMENT_CACHE_TTL", 24 * 3600))
+# Сколько загрузок в LLM и записей в блоб-хранилище идёт одновременно
+ATTACHMENT_CONCURRENCY = int(os.getenv("ATTACHMENT_CONCURRENCY", 8))
+
+# Пространство имён store по типу вложения; остальные типы — ("attachments",)
+ATTACHMENT_NAMESPACES = {"text/html": ("html",), "audio/mp3": ("audio",)}
+# Тип вложения -> (поля с байтами по приоритету, base64 ли они, Content-Type);
+# у графиков Plotly в store остаётся JSON фигуры, в блоб уходит только PNG
+BLOB_FIELDS = {
+    "image/png": (("img_data", "data"), True, "image/png"),
+    "application/vnd.plotly.v1+json": (("img_data",), True, "image/png"),
+    "text/html": (("data",), False, "text/html; charset=utf-8"),
+    "audio/mp3": (("data",), True, "audio/mpeg"),
+}
+
+# sha256 -> (file_id, время загрузки)
+_FILE_IDS: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+# sha256 -> загрузка, которая уже идёт
+_PENDING: dict[str, asyncio.Future] = {}
+# (namespace, file_id) -> sha256 записанного в store вложения
+_STORED: "OrderedDict[tuple, str]" = OrderedDict()
+_semaphore: asyncio.Semaphore | None = None
+_STATS = {
+    "uploads": 0,
+    "upload_hits": 0,
+    "store_writes": 0,
+    "store_hits": 0,
+    "bytes_saved": 0,
+}
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _remember(cache: OrderedDict, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > ATTACHMENT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _cached_file_id(key: str) -> str | None:
+    cached = _FILE_IDS.get(key)
+    if cached is None:
+        return None
+    file_id, uploaded_at = cached
+    if time.monotonic() - uploaded_at > ATTACHMENT_CACHE_TTL:
+        _FILE_IDS.pop(key, None)
+        return None
+    _FILE_IDS.move_to_end(key)
+    return file_id
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(ATTACHMENT_CONCURRENCY)
+    return _semaphore
+
+
+async def _upload(data: bytes, filename: str) -> str:
+    if not is_llm_image_inline():
+        return str(uuid.uuid4())
+    async with _get_semaphore():
+        return (await load_llm().aupload_file((filename, data))).id_
+
+
+async def upload_image(data: bytes, filename: str = "image.png") -> str:
+    """
+    `file_id` изображения: из кэша, если такие байты уже загружались, иначе
+    после загрузки в LLM (или новый uuid, если LLM не принимает файлы).
+    """
+    key = content_hash(data)
+    file_id = _cached_file_id(key)
+    if file_id is None and key in _PENDING:
+        file_id = await asyncio.shield(_PENDING[key])
+    if file_id is not None:
+        _STATS["upload_hits"] += 1
+        _STATS["bytes_saved"] += len(data)
+        return file_id
+    future = asyncio.ensure_future(_upload(data, filename))
+    _PENDING[key] = future
+    try:
+        file_id = await asyncio.shield(future)
+    finally:
+        _PENDING.pop(key, None)
+    _STATS["uploads"] += 1
+    _remember(_FILE_IDS, key, (file_id, time.monotonic()))
+    return file_id
+
+
+async def _timed_upload(data: bytes) -> tuple[str, float]:
+    started = time.perf_counter()
+    file_id = await upload_image(data)
+    return file_id, round((time.perf_counter() - started) * 1000, 2)
+
+
+async def upload_images(images: list[bytes]) -> list[tuple[str, float]]:
+    """Загружает картинки параллельно. Возвращает `(file_id, мс на загрузку)`."""
+    return list(await asyncio.gather(*(_timed_upload(data) for data in images)))
+
+
+def is_stored(namespace: tuple, file_id: str, digest: str, size: int = 0) -> bool:
+    """
+    Записано ли уже вложение с таким `file_id` и хэшем содержимого `digest`.
+    Попадание учитывается в статистике как сэкономленные `size` байт.
+    """
+    key = (namespace, file_id)
+    if _STORED.get(key) != digest:
+        return False
+    _STORED.move_to_end(key)
+    _STATS["store_hits"] += 1
+    _STATS["bytes_saved"] += size
+    return True
+
+
+def mark_stored(namespace: tuple, file_id: str, digest: str):
+    _STATS["store_writes"] += 1
+    _remember(_STORED, (namespace, file_id), digest)
+
+
+def _decode(value: str | bytes, is_base64: bool) -> bytes:
+    if is_base64:
+        return base64.b64decode(value)
+    return value.encode() if isinstance(value, str) else value
+
+
+async def offload_blob(attachment: dict) -> dict:
+    """
+    Переносит байты вложения в блоб-хранилище. Возвращает метаданные для store:
+    вложение без полей с байтами, плюс `blob_key`, `size` и `content_type`.
+    """
+    spec = BLOB_FIELDS.get(attachment.get("type"))
+    if spec is None or "blob_key" in attachment:
+        return attachment
+    fields, is_base64, content_type = spec
+    field = next((name for name in fields if attachment.get(name)), None)
+    if field is None:
+        return attachment
+    data = await asyncio.to_thread(_decode, attachment[field], is_base64)
+    metadata = {key: value for key, value in attachment.items() if key not in fields}
+    metadata["blob_key"] = await get_blob_store().put(data, content_type)
+    metadata["size"] = len(data)
+    metadata["content_type"] = content_type
+    return metadata
+
+
+def inline_bytes(value: dict) -> tuple[bytes, str] | None:
+    """Байты и Content-Type старой записи, где они лежат в store в `data`."""
+    spec = BLOB_FIELDS.get(value.get("type"))
+    if spec is None:
+        return None
+    fields, is_base64, content_type = spec
+    field = next((name for name in fields if value.get(name)), None)
+    if field is None:
+        return None
+    return _decode(value[field], is_base64), content_type
+
+
+async def load_attachment_base64(value: dict) -> str:
+    """base64 картинки вложения из store — из блоба или из старой записи."""
+    if "blob_key" in value:
+        data = await get_blob_store().get(value["blob_key"])
+        return base64.b64encode(data).decode()
+    data = value["img_data"] if "img_data" in value else value["data"]
+    return data.decode() if isinstance(data, bytes) else data
+
+
+def store_digest(metadata: dict) -> tuple[str, int]:
+    """
+    Хэш метаданных для `is_stored`/`mark_stored` и сколько байт сэкономит
+    пропуск записи. Одно определение для всех путей записи в store.
+    """
+    payload = json.dumps(metadata, sort_keys=True, default=str).encode()
+    return content_hash(payload), len(payload) + metadata.get("size", 0)
+
+
+async def _offload(attachment: dict) -> tuple[dict, float]:
+    async with _get_semaphore():
+        started = time.perf_counter()
+        metadata = await offload_blob(attachment)
+        return metadata, round((time.perf_counter() - started) * 1000, 2)
+
+
+async def put_attachments(store: BaseStore, attachments: list[dict]) -> list[dict]:
+    """
+    Сохраняет вложения: байты параллельно уходят в блоб-хранилище, метаданные —
+    одним `store.abatch`, кроме уже записанных ранее. Тайминги из поля
+    `timings` вложения в store не попадают, а дополняются `blob_ms` и `store_ms`
+    и возвращаются по каждому вложению в порядке входа.
+    """
+    timings = [dict(attachment.get("timings") or {}) for attachment in attachments]
+    offloaded = await asyncio.gather(
+        *(
+            _offload({k: v for k, v in attachment.items() if k != "timings"})
+            for attachment in attachments
+        )
+    )
+    # (namespace, file_id) -> (PutOp, хэш метаданных); повторы в пачке пишутся раз
+    ops = {}
+    written = []
+    for (metadata, blob_ms), timing in zip(offloaded, timings):
+        timing["blob_ms"] = blob_ms
+        namespace = ATTACHMENT_NAMESPACES.get(metadata["type"], ("attachments",))
+        digest, size = store_digest(metadata)
+        key = (namespace, metadata["file_id"])
+        if key in ops or is_stored(*key, digest, size):
+            written.append(False)
+            continue
+        ops[key] = (PutOp(*key, metadata, ttl=None), digest)
+        written.append(True)
+
+    started = time.perf_counter()
+    if ops:
+        await store.abatch([op for op, _ in ops.values()])
+        for key, (_, digest) in ops.items():
+            mark_stored(*key, digest)
+    store_ms = round((time.perf_counter() - started) * 1000, 2)
+    for timing, is_written in zip(timings, written):
+        timing["store_ms"] = store_ms if is_written else 0.0
+    return timings
+
+
+def get_attachment_cache_stats() -> dict:
+    uploads = _STATS["uploads"] + _STATS["upload_hits"]
+    writes = _STATS["store_writes"] + _STATS["store_hits"]
+    return {
+        **_STATS,
+        "cached_files": len(_FILE_IDS),
+        "upload_hit_rate": _STATS["upload_hits"] / uploads if uploads else 0.0,
+        "store_hit_rate": _STATS["store_hits"] / writes if writes else 0.0,
+    }
@@ -0,0 +1,175 @@
+"""
+Хранилище байтов вложений (картинки, PNG графиков, HTML, MP3).
+
+В LangGraph store лежат только метаданные вложения и ключ блоба, сами байты —
+здесь, без base64. Ключ — SHA-256 содержимого, поэтому одинаковые вложения
+занимают место один раз.
+
+BLOB_STORE выбирает реализацию:
+- `local` (по умолчанию) — файлы в BLOB_STORE_DIR, разложенные по
+  подкаталогам `ab/cd/<ключ>`, чтобы в одном каталоге не копились тысячи файлов;
+- `s3` — S3-совместимое хранилище: BLOB_S3_BUCKET, BLOB_S3_PREFIX,
+  BLOB_S3_ENDPOINT_URL (для MinIO и т.п.). Нужен пакет `boto3`.
+"""
+
+import asyncio
+import hashlib
+import os
+import uuid
+from pathlib import Path
+from typing import AsyncIterator
+
+BLOB_STORE = os.getenv("BLOB_STORE", "local")
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "db/blobs")
+BLOB_S3_BUCKET = os.getenv("BLOB_S3_BUCKET", "")
+BLOB_S3_PREFIX = os.getenv("BLOB_S3_PREFIX", "giga-agent/")
+BLOB_S3_ENDPOINT_URL = os.getenv("BLOB_S3_ENDPOINT_URL") or None
+BLOB_CHUNK_SIZE = 64 * 1024
+
+
+def blob_key(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobStore:
+    """Интерфейс хранилища. `end` в `iter_range` включительно, как в HTTP Range."""
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        raise NotImplementedError
+
+    async def get(self, key: str) -> bytes:
+        raise NotImplementedError
+
+    async def size(self, key: str) -> int | None:
+        """Размер блоба или None, если его нет."""
+        raise NotImplementedError
+
+    def iter_range(self, key: str, start: int, end: int) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+
+
+class LocalBlobStore(BlobStore):
+    def __init__(self, root: str):
+        self.root = Path(root)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:4] / key
+
+    def _write(self, key: str, data: bytes):
+        path = self._path(key)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Через временный файл: читатель не увидит недописанный блоб
+        tmp = path.with_name(f"{key}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        key = blob_key(data)
+        await asyncio.to_thread(self._write, key, data)
+        return key
+
+    async def get(self, key: str) -> bytes:
+        return await asyncio.to_thread(self._path(key).read_bytes)
+
+    async def size(self, key: str) -> int | None:
+        try:
+            return (await asyncio.to_thread(self._path(key).stat)).st_size
+        except FileNotFoundError:
+            return None
+
+    async def iter_range(self, key: str, start: int, end: int):
+        f = await asyncio.to_thread(open, self._path(key), "rb")
+        try:
+            await asyncio.to_thread(f.seek, start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await asyncio.to_thread(
+                    f.read, min(BLOB_CHUNK_SIZE, remaining)
+                )
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            await asyncio.to_thread(f.close)
+
+
+class S3BlobStore(BlobStore):
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str | None = None):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("Для BLOB_STORE=s3 установите пакет boto3") from e
+        if not bucket:
+            raise RuntimeError("BLOB_S3_BUCKET is empty! Fill it with your bucket")
+        self.bucket = bucket
+        self.prefix = prefix
+        # Клиент boto3 потокобезопасен, вызовы уходят в пул потоков
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key[:2]}/{key}"
+
+    async def put(self, data: bytes, content_type: str) -> str:
+        key = blob_key(data)
+        if await self.size(key) is None:
+            await asyncio.to_thread(
+                self.client.put_object,
+                Bucket=self.bucket,
+                Key=self._key(key),
+                Body=data,
+                ContentType=content_type,
+            )
+        return key
+
+    async def get(self, key: str) -> bytes:
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=self._key(key)
+        )
+        return await asyncio.to_thread(response["Body"].read)
+
+    async def size(self, key: str) -> int | None:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = await asyncio.to_thread(
+                self.client.head_object, Bucket=self.bucket, Key=self._key(key)
+            )
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+        return head["ContentLength"]
+
+    async def iter_range(self, key: str, start: int, end: int):
+        response = await asyncio.to_thread(
+            self.client.get_object,
+            Bucket=self.bucket,
+            Key=self._key(key),
+            Range=f"bytes={start}-{end}",
+        )
+        body = response["Body"]
+        try:
+            while chunk := await asyncio.to_thread(body.read, BLOB_CHUNK_SIZE):
+                yield chunk
+        finally:
+            body.close()
+
+
+_BLOB_STORE: BlobStore | None = None
+
+
+def get_blob_store() -> BlobStore:
+    global _BLOB_STORE
+    if _BLOB_STORE is None:
+        if BLOB_STORE == "s3":
+            _BLOB_STORE = S3BlobStore(
+                BLOB_S3_BUCKET, BLOB_S3_PREFIX, BLOB_S3_ENDPOINT_URL
+            )
+        elif BLOB_STORE == "local":
+            _BLOB_STORE = LocalBlobStore(BLOB_STORE_DIR)
+        else:
+            raise RuntimeError(f"Неизвестный BLOB_STORE: {BLOB_STORE}")
+    return _BLOB_STORE
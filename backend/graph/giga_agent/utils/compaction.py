@@ -0,0 +1,142 @@
+"""
+Сжатие истории диалога перед отправкой в LLM.
+
+Старые результаты инструментов заменяются короткой заглушкой с указателем на
+`function_results[i]` в ядре, а код в старых сообщениях агента — пометкой, пока
+история не уложится в бюджет токенов. Решения кэшируются по id сообщения:
+однажды сжатое сообщение остаётся сжатым, поэтому префикс истории между шагами
+не меняется и каждый шаг пересчитывает только новые сообщения.
+"""
+
+import json
+import os
+import re
+from collections import OrderedDict
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+
+# Бюджет истории в токенах; 0 отключает сжатие
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 32000))
+# Сколько последних результатов инструментов никогда не сжимаются
+CONTEXT_KEEP_TOOL_RESULTS = int(os.getenv("CONTEXT_KEEP_TOOL_RESULTS", 3))
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", 20000))
+# Грубая оценка, та же что и для длинных результатов в tool_call
+CHARS_PER_TOKEN = 4
+PREVIEW_CHARS = 300
+
+CODE_REGEX = re.compile(r"```python(.+?)```", re.DOTALL)
+
+# id сообщения -> сжатая копия
+_COMPACTED: "OrderedDict[str, BaseMessage]" = OrderedDict()
+# id сообщения -> оценка токенов
+_TOKENS: "OrderedDict[str, int]" = OrderedDict()
+
+
+def _remember(cache: OrderedDict, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > CONTEXT_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _content_length(message: BaseMessage) -> int:
+    content = message.content
+    if isinstance(content, str):
+        return len(content)
+    return len(json.dumps(content, ensure_ascii=False, default=str))
+
+
+def estimate_tokens(message: BaseMessage) -> int:
+    if message.id is not None and message.id in _TOKENS:
+        return _TOKENS[message.id]
+    tokens = _content_length(message) // CHARS_PER_TOKEN + 1
+    if message.id is not None:
+        _remember(_TOKENS, message.id, tokens)
+    return tokens
+
+
+def _compact_tool_message(message: ToolMessage) -> ToolMessage:
+    content = message.content if isinstance(message.content, str) else ""
+    try:
+        data = json.loads(content)
+    except Exception:
+        data = None
+    stub = {"compacted": True}
+    if isinstance(data, dict) and "message" in data:
+        # В "message" лежит указатель на function_results[i] — его сохраняем
+        stub["message"] = data["message"]
+    stub["preview"] = content[:PREVIEW_CHARS]
+    stub["note"] = (
+        "Старый результат сокращён для экономии контекста. "
+        "Полные данные доступны в ядре python, если указана переменная."
+    )
+    return message.model_copy(
+        update={"content": json.dumps(stub, ensure_ascii=False)}
+    )
+
+
+def _compact_ai_message(message: AIMessage) -> AIMessage:
+    content = CODE_REGEX.sub(
+        "```python\n# код уже выполнен, переменные доступны в ядре\n```",
+        message.content,
+    )
+    return message.model_copy(update={"content": content})
+
+
+def _candidates(messages: list[BaseMessage]):
+    """Индексы сообщений, которые можно сжать: сначала результаты инструментов, потом код."""
+    tool_indices = [
+        idx for idx, message in enumerate(messages) if isinstance(message, ToolMessage)
+    ]
+    if CONTEXT_KEEP_TOOL_RESULTS:
+        protected_from = (
+            tool_indices[-CONTEXT_KEEP_TOOL_RESULTS]
+            if len(tool_indices) >= CONTEXT_KEEP_TOOL_RESULTS
+            else 0
+        )
+    else:
+        protected_from = len(messages)
+    yield from (idx for idx in tool_indices if idx < protected_from)
+    yield from (
+        idx
+        for idx, message in enumerate(messages[:protected_from])
+        if isinstance(message, AIMessage)
+        and isinstance(message.content, str)
+        and "```python" in message.content
+    )
+
+
+def compact_messages(
+    messages: list[BaseMessage], budget: int = CONTEXT_TOKEN_BUDGET
+) -> list[BaseMessage]:
+    """
+    Возвращает историю, уложенную (насколько возможно) в `budget` токенов.
+    Исходные сообщения не изменяются.
+    """
+    if not budget:
+        return messages
+    result = [
+        _COMPACTED.get(message.id, message) if message.id is not None else message
+        for message in messages
+    ]
+    total = sum(estimate_tokens(message) for message in result)
+    if total <= budget:
+        return result
+    for idx in _candidates(result):
+        message = result[idx]
+        if message.id is None or message.id in _COMPACTED:
+            continue
+        if isinstance(message, ToolMessage):
+            compacted = _compact_tool_message(message)
+        else:
+            compacted = _compact_ai_message(message)
+        before = estimate_tokens(message)
+        _remember(_COMPACTED, message.id, compacted)
+        # Токены кэшируются по id, поэтому сжатую копию считаем напрямую
+        after = _content_length(compacted) // CHARS_PER_TOKEN + 1
+        _remember(_TOKENS, message.id, after)
+        result[idx] = compacted
+        total -= before - after
+        if total <= budget:
+            break
+    return result
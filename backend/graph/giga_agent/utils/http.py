@@ -0,0 +1,121 @@
+import asyncio
+import os
+import time
+import weakref
+from typing import Dict, Optional
+
+import aiohttp
+
+from giga_agent.utils.env import load_project_env
+from giga_agent.utils.metrics import record_current
+
+load_project_env()
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 60))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+
+# aiohttp-сессия привязана к event loop, поэтому держим по одной сессии на loop
+_SESSIONS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, aiohttp.ClientSession]" = (
+    weakref.WeakKeyDictionary()
+)
+
+_POOL_STATS: Dict[str, int] = {
+    "sessions_created": 0,
+    "requests": 0,
+    "connections_created": 0,
+    "connections_reused": 0,
+}
+
+
+async def _on_request_start(session, ctx, params):
+    _POOL_STATS["requests"] += 1
+
+
+async def _on_connection_create_end(session, ctx, params):
+    _POOL_STATS["connections_created"] += 1
+
+
+async def _on_connection_reuseconn(session, ctx, params):
+    _POOL_STATS["connections_reused"] += 1
+
+
+async def _on_request_chunk_sent(session, ctx, params):
+    record_current(http_sent=len(params.chunk))
+
+
+async def _on_response_chunk_received(session, ctx, params):
+    record_current(http_received=len(params.chunk))
+
+
+async def _on_connection_queued_start(session, ctx, params):
+    ctx.queued_at = time.perf_counter()
+
+
+async def _on_connection_queued_end(session, ctx, params):
+    record_current(queue_wait=time.perf_counter() - ctx.queued_at)
+
+
+def _create_trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    # Байты и ожидание пула относятся к узлу графа, который сделал запрос
+    trace_config.on_request_chunk_sent.append(_on_request_chunk_sent)
+    trace_config.on_response_chunk_received.append(_on_response_chunk_received)
+    trace_config.on_connection_queued_start.append(_on_connection_queued_start)
+    trace_config.on_connection_queued_end.append(_on_connection_queued_end)
+    return trace_config
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Возвращает общую для процесса aiohttp-сессию с пулом keep-alive соединений.
+
+    Сессию нельзя закрывать через `async with` — её жизненным циклом управляет
+    `close_http_sessions`.
+    """
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        )
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(sock_connect=HTTP_CONNECT_TIMEOUT),
+            trace_configs=[_create_trace_config()],
+        )
+        _SESSIONS[loop] = session
+        _POOL_STATS["sessions_created"] += 1
+    return session
+
+
+def make_timeout(
+    total: Optional[float], sock_read: Optional[float] = None
+) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(
+        total=total, sock_read=sock_read, sock_connect=HTTP_CONNECT_TIMEOUT
+    )
+
+
+async def close_http_sessions() -> None:
+    """Закрывает сессию текущего event loop. Вызывается при остановке приложения."""
+    loop = asyncio.get_running_loop()
+    session = _SESSIONS.pop(loop, None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+def get_http_pool_stats() -> dict:
+    stats = dict(_POOL_STATS)
+    connections = stats["connections_created"] + stats["connections_reused"]
+    stats["reuse_ratio"] = (
+        stats["connections_reused"] / connections if connections else 0.0
+    )
+    return stats
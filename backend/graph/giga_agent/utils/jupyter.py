@@ -1,8 +1,11 @@
 import asyncio
+import json
 
 import aiohttp
 from pydantic import BaseModel
 
+from giga_agent.utils.http import get_http_session, make_timeout
+
 
 class KernelNotFoundException(Exception):
     pass
@@ -10,67 +13,119 @@ class KernelNotFoundException(Exception):
 
 class JupyterClient(BaseModel):
     base_url: str
+    timeout: float = 60.0
 
     async def execute(self, kernel_id, code):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/code",
-                json={"kernel_id": kernel_id, "script": code},
-                timeout=60.0,
-            ) as res:
-                if res.status == 200:
-                    data = await res.json()
-                    return data
-                elif res.status == 404:
-                    raise KernelNotFoundException()
-                else:
-                    raise Exception(f"Error {res.status}: {res.reason}")
+        session = get_http_session()
+        async with session.post(
+            f"{self.base_url}/code",
+            json={"kernel_id": kernel_id, "script": code},
+            timeout=make_timeout(self.timeout),
+        ) as res:
+            if res.status == 200:
+                data = await res.json()
+                return data
+            elif res.status == 404:
+                raise KernelNotFoundException()
+            else:
+                raise Exception(f"Error {res.status}: {res.reason}")
+
+    async def execute_stream(self, kernel_id, code):
+        """
+        Асинхронный итератор по событиям выполнения (`stream`, `display_data`,
+        `execute_result`, `error`). Последнее событие — `done` с полным результатом,
+        как у `execute`.
+        """
+        session = get_http_session()
+        async with session.post(
+            f"{self.base_url}/code/stream",
+            json={"kernel_id": kernel_id, "script": code},
+            timeout=make_timeout(None, sock_read=self.timeout),
+        ) as res:
+            if res.status == 404:
+                raise KernelNotFoundException()
+            elif res.status != 200:
+                raise Exception(f"Error {res.status}: {res.reason}")
+            # Строки с графиками бывают больше лимита readline, поэтому режем сами
+            buffer = b""
+            async for chunk in res.content.iter_any():
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line)
+            if buffer.strip():
+                yield json.loads(buffer)
+
+    async def put_data(
+        self, kernel_id, variable, data, append=False, extend=False
+    ):
+        """
+        Кладёт JSON-сериализуемые `data` в переменную ядра `variable`
+        (добавляет в список при `append=True` или дописывает все элементы
+        списка `data` при `extend=True`) без генерации Python-кода.
+        """
+        mode = "extend" if extend else "append" if append else "set"
+        session = get_http_session()
+        async with session.post(
+            f"{self.base_url}/data/{kernel_id}",
+            params={"variable": variable, "mode": mode},
+            data=json.dumps(data, ensure_ascii=False, default=str).encode(),
+            headers={"Content-Type": "application/json"},
+            timeout=make_timeout(self.timeout),
+        ) as res:
+            if res.status == 200:
+                return await res.json()
+            elif res.status == 404:
+                raise KernelNotFoundException()
+            else:
+                raise Exception(f"Error {res.status}: {res.reason}")
 
     async def start_kernel(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/start",
-                timeout=60.0,
-            ) as res:
-                if res.status == 200:
-                    return await res.json()
-                else:
-                    raise Exception(f"Error {res.status}: {res.reason}")
+        session = get_http_session()
+        async with session.post(
+            f"{self.base_url}/start",
+            timeout=make_timeout(self.timeout),
+        ) as res:
+            if res.status == 200:
+                return await res.json()
+            else:
+                raise Exception(f"Error {res.status}: {res.reason}")
 
     async def shutdown_kernel(self, kernel_id):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{self.base_url}/shutdown",
-                json={"kernel_id": kernel_id},
-                timeout=60.0,
-            ) as res:
-                if res.status == 200:
-                    return await res.json()
-                elif res.status == 404:
-                    raise KernelNotFoundException()
-                else:
-                    raise Exception(f"Error {res.status}: {res.reason}")
+        session = get_http_session()
+        async with session.post(
+            f"{self.base_url}/shutdown",
+            json={"kernel_id": kernel_id},
+            timeout=make_timeout(self.timeout),
+        ) as res:
+            if res.status == 200:
+                return await res.json()
+            elif res.status == 404:
+                raise KernelNotFoundException()
+            else:
+                raise Exception(f"Error {res.status}: {res.reason}")
 
     async def upload_file(self, file):
-        async with aiohttp.ClientSession() as session:
-            form = aiohttp.FormData()
-            # Ожидаем кортеж (filename, bytes/IO). Иные варианты добавляем как есть
-            try:
-                if isinstance(file, tuple) and len(file) == 2:
-                    filename, content = file
-                    form.add_field("file", content, filename=str(filename))
-                else:
-                    form.add_field("file", file)
-            except Exception:
+        session = get_http_session()
+        form = aiohttp.FormData()
+        # Ожидаем кортеж (filename, bytes/IO). Иные варианты добавляем как есть
+        try:
+            if isinstance(file, tuple) and len(file) == 2:
+                filename, content = file
+                form.add_field("file", content, filename=str(filename))
+            else:
                 form.add_field("file", file)
-
-            async with session.post(
-                f"{self.base_url}/upload", data=form, timeout=60.0
-            ) as res:
-                if res.status == 200:
-                    return await res.json()
-                else:
-                    raise Exception(f"Error {res.status}: {res.reason}")
+        except Exception:
+            form.add_field("file", file)
+
+        async with session.post(
+            f"{self.base_url}/upload", data=form, timeout=make_timeout(self.timeout)
+        ) as res:
+            if res.status == 200:
+                return await res.json()
+            else:
+                raise Exception(f"Error {res.status}: {res.reason}")
 
 
 if __name__ == "__main__":
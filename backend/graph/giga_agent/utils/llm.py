@@ -5,6 +5,7 @@ from langchain.chat_models import init_chat_model
 from langchain.embeddings import init_embeddings
 
 from giga_agent.utils.env import load_project_env
+from giga_agent.utils.metrics import metrics_callback
 
 GIGACHAT_PROVIDER = "gigachat:"
 
@@ -75,6 +76,8 @@ def load_llm(tag: str = None, is_main: bool = False):
         llm = load_gigachat(tag=tag, is_main=is_main)
     else:
         llm = init_chat_model(llm_str)
+    # Токены и время вызовов по узлам графов, см. giga_agent.utils.metrics
+    llm.callbacks = [*(llm.callbacks or []), metrics_callback]
 
     _LLM_SINGLETONS[singleton_key] = llm
     return llm
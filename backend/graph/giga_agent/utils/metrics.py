@@ -0,0 +1,257 @@
+"""
+Учёт времени и токенов по узлам графов.
+
+- `instrument_node` оборачивает узел графа: время выполнения, ошибки, а также
+  контекст (граф, узел, thread_id), к которому привязываются HTTP-байты и
+  ожидание соединения из пула (трассировка aiohttp в `giga_agent.utils.http`).
+- `MetricsCallbackHandler` — callback LangChain, считает вызовы LLM, их время и
+  токены. Узел берётся из метаданных LangGraph (`langgraph_node`).
+- `render_prometheus` отдаёт всё в текстовом формате Prometheus.
+
+Метки thread_id хранятся для последних METRICS_MAX_THREADS тредов, более
+старые сворачиваются в thread_id="other", чтобы не раздувать кардинальность.
+"""
+
+import contextvars
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+METRICS_MAX_THREADS = int(os.getenv("METRICS_MAX_THREADS", 500))
+OTHER_THREAD = "other"
+
+COUNTERS = {
+    "node_calls": ("giga_node_calls_total", "Вызовы узла графа"),
+    "node_errors": ("giga_node_errors_total", "Узлы, завершившиеся исключением"),
+    "node_seconds": ("giga_node_seconds_total", "Время выполнения узла, с"),
+    "llm_calls": ("giga_llm_calls_total", "Вызовы LLM"),
+    "llm_seconds": ("giga_llm_seconds_total", "Время вызовов LLM, с"),
+    "tokens_in": ("giga_llm_input_tokens_total", "Входные токены LLM"),
+    "tokens_out": ("giga_llm_output_tokens_total", "Выходные токены LLM"),
+    "http_sent": ("giga_http_sent_bytes_total", "Отправлено по HTTP, байт"),
+    "http_received": ("giga_http_received_bytes_total", "Получено по HTTP, байт"),
+    "queue_wait": (
+        "giga_http_queue_wait_seconds_total",
+        "Ожидание свободного соединения в пуле HTTP, с",
+    ),
+}
+
+# (graph, node) текущего узла и thread_id; наследуется задачами и callback-ами
+_CURRENT: contextvars.ContextVar = contextvars.ContextVar(
+    "giga_metrics_node", default=None
+)
+_LOCK = threading.Lock()
+# thread_id -> {(graph, node): {counter: value}}
+_STATS: "OrderedDict[str, dict]" = OrderedDict()
+
+
+def _fold_oldest_thread(keep: str):
+    """Сворачивает самый старый тред в "other". Вызывается под `_LOCK`."""
+    for thread_id in _STATS:
+        if thread_id not in (OTHER_THREAD, keep):
+            break
+    else:
+        return False
+    other = _STATS.setdefault(OTHER_THREAD, {})
+    for key, values in _STATS.pop(thread_id).items():
+        target = other.setdefault(key, dict.fromkeys(COUNTERS, 0))
+        for name, value in values.items():
+            target[name] += value
+    return True
+
+
+def _labels_stats(graph: str, node: str, thread_id: str | None) -> dict:
+    """Счётчики для меток. Вызывается под `_LOCK`."""
+    thread_id = thread_id or OTHER_THREAD
+    threads = _STATS.get(thread_id)
+    if threads is None:
+        threads = _STATS[thread_id] = {}
+        # +1 — место под сам "other"
+        while len(_STATS) > METRICS_MAX_THREADS + 1:
+            if not _fold_oldest_thread(thread_id):
+                break
+    else:
+        _STATS.move_to_end(thread_id)
+    return threads.setdefault((graph, node), dict.fromkeys(COUNTERS, 0))
+
+
+def record(graph: str, node: str, thread_id: str | None, **values):
+    with _LOCK:
+        stats = _labels_stats(graph, node, thread_id)
+        for name, value in values.items():
+            stats[name] += value
+
+
+def record_current(**values):
+    """Добавляет значения к узлу, который сейчас выполняется (или к "unknown")."""
+    current = _CURRENT.get()
+    if current is None:
+        record("unknown", "unknown", None, **values)
+    else:
+        record(*current, **values)
+
+
+def _node_context(graph: str, default_node: str):
+    try:
+        from langgraph.config import get_config
+
+        config = get_config()
+    except Exception:
+        return graph, default_node, None
+    node = config.get("metadata", {}).get("langgraph_node", default_node)
+    thread_id = config.get("configurable", {}).get("thread_id")
+    return graph, node, str(thread_id) if thread_id is not None else None
+
+
+def instrument_node(func, graph: str = "main"):
+    """
+    Оборачивает узел графа. Сигнатура сохраняется (`functools.wraps`), так что
+    LangGraph по-прежнему передаёт узлу `config`/`store` и прочие аргументы.
+    """
+
+    def start():
+        labels = _node_context(graph, func.__name__)
+        return labels, _CURRENT.set(labels), time.perf_counter()
+
+    def finish(labels, token, started, failed):
+        _CURRENT.reset(token)
+        record(
+            *labels,
+            node_calls=1,
+            node_errors=int(failed),
+            node_seconds=time.perf_counter() - started,
+        )
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            labels, token, started = start()
+            failed = True
+            try:
+                result = await func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                finish(labels, token, started, failed)
+
+    else:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            labels, token, started = start()
+            failed = True
+            try:
+                result = func(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                finish(labels, token, started, failed)
+
+    return wrapper
+
+
+def _usage(response: LLMResult) -> tuple[int, int]:
+    tokens_in = tokens_out = 0
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            usage = getattr(message, "usage_metadata", None)
+            if usage:
+                tokens_in += usage.get("input_tokens", 0)
+                tokens_out += usage.get("output_tokens", 0)
+    if not tokens_in and not tokens_out and response.llm_output:
+        usage = response.llm_output.get("token_usage") or {}
+        if not isinstance(usage, dict):
+            usage = getattr(usage, "__dict__", {})
+        tokens_in = usage.get("prompt_tokens", 0) or 0
+        tokens_out = usage.get("completion_tokens", 0) or 0
+    return tokens_in, tokens_out
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Считает вызовы LLM, их длительность и токены по узлам графа."""
+
+    # Выполняется прямо в event loop: так виден контекст узла, а работа — O(1)
+    run_inline = True
+
+    def __init__(self):
+        self._runs: dict[UUID, tuple[tuple, float]] = {}
+
+    def _start(self, run_id: UUID, metadata: dict | None):
+        current = _CURRENT.get()
+        metadata = metadata or {}
+        if current is not None:
+            graph, node, thread_id = current
+        else:
+            graph = metadata.get("graph_id", "unknown")
+            node, thread_id = "unknown", None
+        node = metadata.get("langgraph_node", node)
+        thread_id = metadata.get("thread_id", thread_id)
+        labels = (graph, node, str(thread_id) if thread_id is not None else None)
+        self._runs[run_id] = (labels, time.perf_counter())
+
+    def on_chat_model_start(
+        self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs: Any
+    ):
+        self._start(run_id, metadata)
+
+    def on_llm_start(
+        self, serialized, prompts, *, run_id: UUID, metadata=None, **kwargs: Any
+    ):
+        self._start(run_id, metadata)
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        labels, started = run
+        tokens_in, tokens_out = _usage(response)
+        record(
+            *labels,
+            llm_calls=1,
+            llm_seconds=time.perf_counter() - started,
+            tokens_in=tokens_in,
+            tokens_out=tokens_out,
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            labels, started = run
+            record(*labels, llm_calls=1, llm_seconds=time.perf_counter() - started)
+
+
+metrics_callback = MetricsCallbackHandler()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus() -> str:
+    with _LOCK:
+        snapshot = [
+            (thread_id, key, dict(values))
+            for thread_id, nodes in _STATS.items()
+            for key, values in nodes.items()
+        ]
+    lines = []
+    for counter, (metric, description) in COUNTERS.items():
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} counter")
+        for thread_id, (graph, node), values in snapshot:
+            labels = (
+                f'graph="{_escape(graph)}",node="{_escape(node)}",'
+                f'thread_id="{_escape(thread_id)}"'
+            )
+            lines.append(f"{metric}{{{labels}}} {values[counter]}")
+    return "\n".join(lines) + "\n"
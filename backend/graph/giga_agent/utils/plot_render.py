@@ -0,0 +1,168 @@
+"""
+Растеризация графиков Plotly в PNG вне event loop.
+
+Kaleido запускает отдельный процесс Chromium на каждый интерпретатор, а
+`plotly.io.from_json`/`to_image` держат GIL, поэтому рендер вынесен в пул
+процессов. Каждый воркер при старте рисует пустую фигуру, чтобы Kaleido был
+уже прогрет к первому запросу. Число одновременно отправленных в пул фигур
+ограничено PLOT_RENDER_QUEUE, готовые PNG кэшируются по хэшу JSON фигуры.
+
+PLOT_MAX_SIDE ограничивает большую сторону картинки: изображения уходят в LLM
+на анализ, и лишние пиксели там только тратят токены. 0 отключает уменьшение.
+"""
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+PLOT_RENDER_WORKERS = int(
+    os.getenv("PLOT_RENDER_WORKERS", min(4, os.cpu_count() or 1))
+)
+PLOT_RENDER_QUEUE = int(os.getenv("PLOT_RENDER_QUEUE", PLOT_RENDER_WORKERS * 4))
+PLOT_RENDER_CACHE_SIZE = int(os.getenv("PLOT_RENDER_CACHE_SIZE", 256))
+PLOT_MAX_SIDE = int(os.getenv("PLOT_MAX_SIDE", 1024))
+
+# Размер по умолчанию, с которым Kaleido рисует фигуру без width/height
+DEFAULT_WIDTH = 700
+DEFAULT_HEIGHT = 500
+
+_executor: ProcessPoolExecutor | None = None
+_semaphore: asyncio.Semaphore | None = None
+# хэш фигуры -> PNG
+_CACHE: "OrderedDict[str, bytes]" = OrderedDict()
+# хэш фигуры -> рендер, который уже идёт
+_PENDING: dict[str, asyncio.Future] = {}
+_STATS = {"hits": 0, "misses": 0, "renders": 0, "errors": 0, "render_seconds": 0.0}
+
+
+def _warm_up():
+    import plotly.graph_objects as go
+    import plotly.io as pio
+
+    pio.to_image(go.Figure(), format="png", width=10, height=10)
+
+
+def _render(figure_json: str, max_side: int) -> bytes:
+    import plotly.io as pio
+
+    plot = pio.from_json(figure_json)
+    width = plot.layout.width or DEFAULT_WIDTH
+    height = plot.layout.height or DEFAULT_HEIGHT
+    scale = 1.0
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+    return pio.to_image(plot, format="png", width=width, height=height, scale=scale)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: форк процесса с работающим event loop и потоками небезопасен
+        _executor = ProcessPoolExecutor(
+            max_workers=PLOT_RENDER_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up,
+        )
+    return _executor
+
+
+def _reset_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def shutdown_render_pool():
+    """Останавливает воркеры пула; вызывается при остановке сервера."""
+    _reset_executor()
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(PLOT_RENDER_QUEUE)
+    return _semaphore
+
+
+def figure_key(figure_json: str, max_side: int = PLOT_MAX_SIDE) -> str:
+    return hashlib.sha256(f"{max_side}:{figure_json}".encode()).hexdigest()
+
+
+def _remember(key: str, png: bytes):
+    _CACHE[key] = png
+    _CACHE.move_to_end(key)
+    while len(_CACHE) > PLOT_RENDER_CACHE_SIZE:
+        _CACHE.popitem(last=False)
+
+
+async def _submit(figure_json: str, max_side: int) -> bytes:
+    loop = asyncio.get_running_loop()
+    async with _get_semaphore():
+        started = time.perf_counter()
+        try:
+            png = await loop.run_in_executor(
+                _get_executor(), _render, figure_json, max_side
+            )
+        except BrokenProcessPool:
+            # Воркер упал (например, Chromium убит по памяти) — пересоздаём пул
+            _reset_executor()
+            png = await loop.run_in_executor(
+                _get_executor(), _render, figure_json, max_side
+            )
+        _STATS["renders"] += 1
+        _STATS["render_seconds"] += time.perf_counter() - started
+        return png
+
+
+async def render_plot(figure: dict | str, max_side: int = PLOT_MAX_SIDE) -> bytes:
+    """PNG фигуры Plotly (`application/vnd.plotly.v1+json` или её JSON)."""
+    figure_json = figure if isinstance(figure, str) else json.dumps(figure)
+    key = figure_key(figure_json, max_side)
+    png = _CACHE.get(key)
+    if png is not None:
+        _STATS["hits"] += 1
+        _CACHE.move_to_end(key)
+        return png
+    pending = _PENDING.get(key)
+    if pending is not None:
+        _STATS["hits"] += 1
+        return await asyncio.shield(pending)
+    _STATS["misses"] += 1
+    future = asyncio.ensure_future(_submit(figure_json, max_side))
+    _PENDING[key] = future
+    try:
+        png = await asyncio.shield(future)
+    except Exception:
+        _STATS["errors"] += 1
+        raise
+    finally:
+        _PENDING.pop(key, None)
+    _remember(key, png)
+    return png
+
+
+async def render_plots(
+    figures: list[dict | str], max_side: int = PLOT_MAX_SIDE
+) -> list[bytes]:
+    """Рендерит все фигуры параллельно, порядок результатов совпадает с входом."""
+    return list(
+        await asyncio.gather(*(render_plot(figure, max_side) for figure in figures))
+    )
+
+
+def get_plot_render_stats() -> dict:
+    total = _STATS["hits"] + _STATS["misses"]
+    return {
+        **_STATS,
+        "cached": len(_CACHE),
+        "in_flight": len(_PENDING),
+        "workers": PLOT_RENDER_WORKERS,
+        "hit_rate": _STATS["hits"] / total if total else 0.0,
+    }
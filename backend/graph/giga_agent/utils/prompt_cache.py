@@ -0,0 +1,97 @@
+"""
+Кэш статического префикса промпта главного агента.
+
+Системный промпт и few-shot примеры одинаковы для всех пользователей, поэтому
+рендерятся один раз на ключ (язык, REPL_FROM_MESSAGE, набор инструментов) и
+переиспользуются как байт-в-байт одинаковый префикс. Это позволяет провайдерам
+с кэшированием префикса (OpenAI — автоматически, GigaChat — по X-Session-ID,
+Anthropic — по `cache_control`) не обрабатывать его заново.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+
+from langchain_core.messages import BaseMessage, SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+from giga_agent.utils.lang import LANG
+
+_PREFIXES: dict[str, list[BaseMessage]] = {}
+_STATS = {"hits": 0, "misses": 0}
+
+
+def _tools_hash(tools: list) -> str:
+    return hashlib.sha256(
+        json.dumps(tools, sort_keys=True, ensure_ascii=False, default=str).encode()
+    ).hexdigest()[:16]
+
+
+def prefix_key(tools: list) -> str:
+    return "|".join([LANG, os.getenv("REPL_FROM_MESSAGE", "1"), _tools_hash(tools)])
+
+
+def _with_cache_hint(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """Помечает конец префикса для Anthropic (`cache_control`); остальным не мешает."""
+    llm_str = os.getenv("GIGA_AGENT_LLM", "")
+    if not llm_str.startswith("anthropic:") or not messages:
+        return messages
+    system = messages[0]
+    if isinstance(system, SystemMessage) and isinstance(system.content, str):
+        messages = list(messages)
+        messages[0] = system.model_copy(
+            update={
+                "content": [
+                    {
+                        "type": "text",
+                        "text": system.content,
+                        "cache_control": {"type": "ephemeral"},
+                    }
+                ]
+            }
+        )
+    return messages
+
+
+def get_prefix(prompt: ChatPromptTemplate, tools: list) -> tuple[str, list]:
+    """Отрендеренный префикс `prompt` без истории и его ключ."""
+    key = prefix_key(tools)
+    prefix = _PREFIXES.get(key)
+    if prefix is None:
+        _STATS["misses"] += 1
+        prefix = _with_cache_hint(prompt.format_messages())
+        _PREFIXES[key] = prefix
+    else:
+        _STATS["hits"] += 1
+    return key, prefix
+
+
+@contextlib.contextmanager
+def provider_cache_session(key: str, thread_id: str | None = None):
+    """
+    Передаёт GigaChat X-Session-ID, по которому он кэширует совпадающий префикс.
+    Сессия своя у каждого треда: GigaChat привязывает к ней контекст диалога,
+    и общая сессия смешала бы историю разных пользователей.
+    Для остальных провайдеров ничего не делает.
+    """
+    try:
+        from gigachat.context import session_id_cvar
+    except ImportError:
+        yield
+        return
+    session_id = hashlib.sha256(f"{key}|{thread_id or ''}".encode()).hexdigest()[:32]
+    token = session_id_cvar.set(session_id)
+    try:
+        yield
+    finally:
+        session_id_cvar.reset(token)
+
+
+def get_prefix_cache_stats() -> dict:
+    total = _STATS["hits"] + _STATS["misses"]
+    return {
+        **_STATS,
+        "prefixes": len(_PREFIXES),
+        "hit_rate": _STATS["hits"] / total if total else 0.0,
+    }
@@ -1,37 +1,74 @@
-import copy
+import hashlib
+import json
 import os
+from collections import OrderedDict
 
 from giga_agent.config import REPL_TOOLS
+from giga_agent.utils.state import project_state
 
+# По этому имени в тексте ошибки граф понимает, что ядро не знает состояние
+STATE_MISSING_ERROR = "ToolStateMissing"
+# Срез состояния для tool_client в ядре. tool_call_index сюда не входит: он
+# меняется после каждого вызова, и хэш состояния тогда менялся бы каждую ячейку
+KERNEL_STATE_KEYS = ("kernel_id", "file_ids")
+KERNEL_STATE_CACHE_SIZE = int(os.getenv("KERNEL_STATE_CACHE_SIZE", 10000))
 
-def prepend_code(code: str, state: dict):
-    state = copy.deepcopy(state)
-    state.pop("messages")
-    tools_code = []
-    for tool in state["tools"]:
-        tools_code.append(
-            f"""
-@tool_client.call_tool
-def {tool['name']}(**kwargs):
-    pass
-"""
-        )
-    for tool in REPL_TOOLS:
-        tools_code.append(
-            f"""
-@tool_client.call_tool
-def {tool.__name__}(**kwargs):
-    pass
-"""
-        )
+# kernel_id -> хэш состояния, которое последним отправлено в ядро
+_SENT_STATE: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _hash(value) -> str:
+    return hashlib.sha256(
+        json.dumps(value, sort_keys=True, ensure_ascii=False, default=str).encode()
+    ).hexdigest()[:16]
+
+
+def _kernel_state(state: dict) -> tuple[dict, str]:
+    kernel_state = project_state(state, KERNEL_STATE_KEYS)
+    return kernel_state, _hash(kernel_state)
+
+
+def mark_state_sent(state: dict):
+    """
+    Запоминает, что ядро приняло состояние. Вызывается после выполнения
+    ячейки, а не при сборке кода: отклонённая ячейка ничего не передала.
+    """
+    kernel_id = state.get("kernel_id")
+    _SENT_STATE[kernel_id] = _kernel_state(state)[1]
+    _SENT_STATE.move_to_end(kernel_id)
+    while len(_SENT_STATE) > KERNEL_STATE_CACHE_SIZE:
+        _SENT_STATE.popitem(last=False)
+
+
+def prepend_code(code: str, state: dict, resend_state: bool = False):
+    """
+    Добавляет к коду короткий пролог. Заглушки инструментов ставятся в ядро
+    модулем `app.tool_stubs` один раз на набор инструментов, а само состояние
+    попадает в код, только если поменялось с прошлой принятой ядром ячейки
+    (см. `mark_state_sent`) или `resend_state` (ядро ответило `ToolStateMissing`).
+    """
     tool_url = os.getenv("TOOL_CLIENT_API", "http://127.0.0.1:8811")
-    state.pop("tools")
-    prepend = f"""import importlib
-importlib.invalidate_caches()
-import pandas as pd
-import numpy as np
-import datetime
-from app.tool_client import ToolClient
-tool_client = ToolClient(base_url='{tool_url}')
-tool_client.set_state({repr(state)})"""
-    return prepend + "\n\n".join(tools_code) + code
+    tool_names = [tool["name"] for tool in state["tools"]] + [
+        tool.__name__ for tool in REPL_TOOLS
+    ]
+    tools_hash = _hash([tool_url, tool_names])
+    kernel_state, state_hash = _kernel_state(state)
+    if resend_state or _SENT_STATE.get(state.get("kernel_id")) != state_hash:
+        state_args = f"{state_hash!r}, {kernel_state!r}"
+    else:
+        state_args = repr(state_hash)
+    prepend = f"""import app.tool_stubs as _tool_stubs
+if not _tool_stubs.is_installed({tools_hash!r}, globals()):
+    _tool_stubs.install(globals(), {tool_url!r}, {tool_names!r}, {tools_hash!r})
+_tool_stubs.before_cell({state_args})
+"""
+    return prepend + code
+
+
+def is_state_missing(result) -> bool:
+    """Упала ли ячейка в прологе из-за того, что ядро не знает состояние."""
+    return (
+        isinstance(result, dict)
+        and bool(result.get("is_exception"))
+        and STATE_MISSING_ERROR in result.get("message", "")
+    )
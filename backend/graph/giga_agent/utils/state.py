@@ -0,0 +1,11 @@
+# Поля состояния графа, которые нужны сервису инструментов и ядру.
+# messages и tools сюда не входят: они большие, а инструментам не нужны
+TOOL_STATE_KEYS = ("kernel_id", "file_ids", "tool_call_index")
+
+
+def project_state(state: dict, keys: tuple = TOOL_STATE_KEYS) -> dict:
+    """
+    Небольшой срез состояния для передачи наружу (сервису инструментов, в ядро).
+    Значения не копируются: срез только сериализуется и не должен изменяться.
+    """
+    return {key: state[key] for key in keys if key in state}
@@ -0,0 +1,27 @@
+"""
+Подготовка загруженных картинок для LLM.
+
+Функции выполняются в пуле процессов upload_server, поэтому модуль нарочно
+лёгкий: при spawn воркер импортирует только его и PIL.
+"""
+
+import io
+
+from PIL import Image, ImageOps
+
+
+def to_jpeg(path: str, max_side: int = 1024, quality: int = 85) -> bytes:
+    """Поворачивает по EXIF, уменьшает до `max_side` и кодирует в JPEG."""
+    with Image.open(path) as opened:
+        image = ImageOps.exif_transpose(opened)
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        buf = io.BytesIO()
+        image.convert("RGB").save(
+            buf,
+            format="JPEG",
+            quality=quality,
+            optimize=True,
+            progressive=True,
+        )
+    return buf.getvalue()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Awaitable, Callable
+
+from app.run_jupyter import StatefulKernel
+from app.scheduler import KernelScheduler
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARMUP_CODE = """import pandas as pd
+import numpy as np
+import datetime"""
+
+
+class KernelPool:
+    """
+    Пул заранее запущенных ядер:
+    - при старте приложения поднимает `size` ядер и выполняет в них `warmup_code`
+    - `acquire` отдаёт готовое ядро, а если пул пуст — запускает новое
+    - после выдачи ядра пул пополняется в фоне
+
+    С `scheduler` ядра пула учитываются в его лимитах (`kernels`), новое ядро
+    при пустом пуле запускается через `admission`, а пополнение идёт только
+    пока ресурсов хватает без выгрузки ядер пользователей.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], Awaitable[StatefulKernel]],
+        size: int = 2,
+        warmup_code: str = DEFAULT_WARMUP_CODE,
+        scheduler: KernelScheduler | None = None,
+    ):
+        self.factory = factory
+        self.size = size
+        self.warmup_code = warmup_code
+        self.scheduler = scheduler
+        self._ready: asyncio.Queue[tuple[str, StatefulKernel]] = asyncio.Queue()
+        # Все ядра пула: готовые и ещё прогреваемые
+        self._kernels: dict[str, StatefulKernel] = {}
+        self._refill_task: asyncio.Task | None = None
+        self._refill_event = asyncio.Event()
+        self.hits = 0
+        self.misses = 0
+
+    def kernels(self) -> dict[str, StatefulKernel]:
+        return dict(self._kernels)
+
+    async def _spawn(self) -> tuple[str, StatefulKernel]:
+        kernel_id = str(uuid.uuid4())
+        wrapper = await self.factory(kernel_id)
+        self._kernels[kernel_id] = wrapper
+        try:
+            if self.warmup_code:
+                await wrapper.execute(self.warmup_code)
+                # Прогрев не считается активностью пользователя
+                wrapper.last_used = None
+        except BaseException:
+            # Процесс ядра уже запущен — не оставляем его неучтённым
+            self._kernels.pop(kernel_id, None)
+            await wrapper.close()
+            raise
+        return kernel_id, wrapper
+
+    async def _refill_one(self) -> bool:
+        """Запускает ядро в пул, если на него есть ресурсы. False — ресурсов нет."""
+        if self.scheduler is None:
+            self._ready.put_nowait(await self._spawn())
+            return True
+        if not await self.scheduler.try_admit():
+            return False
+        try:
+            self._ready.put_nowait(await self._spawn())
+        finally:
+            self.scheduler.settle()
+        return True
+
+    async def _refill_loop(self):
+        while True:
+            while self._ready.qsize() < self.size:
+                try:
+                    if not await self._refill_one():
+                        # Не вытесняем ядра пользователей ради пула — ждём
+                        await asyncio.sleep(self.scheduler.interval)
+                except Exception:
+                    logger.exception("Не удалось запустить ядро для пула")
+                    await asyncio.sleep(5)
+            self._refill_event.clear()
+            await self._refill_event.wait()
+
+    def start(self):
+        if self.size > 0 and self._refill_task is None:
+            self._refill_task = asyncio.create_task(self._refill_loop())
+
+    async def acquire(self) -> tuple[str, StatefulKernel]:
+        """
+        Готовое ядро из пула или новое. Ядро отдаётся уже вне пула: его учёт
+        и выгрузку дальше ведёт вызывающий.
+        """
+        try:
+            kernel_id, wrapper = self._ready.get_nowait()
+            self.hits += 1
+        except asyncio.QueueEmpty:
+            self.misses += 1
+            if self.scheduler is None:
+                kernel_id, wrapper = await self._spawn()
+            else:
+                async with self.scheduler.admission():
+                    kernel_id, wrapper = await self._spawn()
+        self._kernels.pop(kernel_id, None)
+        # Иначе watcher простоя не заберёт ядро, в котором так и не выполнили код
+        wrapper.last_used = time.time()
+        self._refill_event.set()
+        return kernel_id, wrapper
+
+    async def close(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+        while not self._ready.empty():
+            _, wrapper = self._ready.get_nowait()
+            await wrapper.close()
+        self._kernels.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": self.size,
+            "ready": self._ready.qsize(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
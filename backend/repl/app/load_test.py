@@ -0,0 +1,238 @@
+"""
+Нагрузочный тест REPL-сервиса.
+
+Каждый виртуальный пользователь делает `/start`, выполняет `--cells` ячеек из
+смеси `--mix` и завершает ядро через `/shutdown`. Ячейка `idle` — пауза в
+`--idle-seconds` и короткая ячейка после неё: если пауза больше MAX_KERNEL_LIVE
+сервиса, ядро успевает уйти в гибернацию, и замер показывает восстановление.
+
+Запуск против уже работающего сервиса:
+    uv run python -m app.load_test --url http://127.0.0.1:9090 --users 16
+или с локальным сервисом (пиковый RSS считается по его дереву процессов):
+    uv run python -m app.load_test --spawn --server-idle-timeout 20 --idle-seconds 30
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+import psutil
+
+from app.run_jupyter import percentile
+
+CELLS = {
+    "short": "x = sum(range(1000))\nprint(x)",
+    "plot": (
+        "import numpy as np\nimport plotly.express as px\n"
+        "points = np.random.rand(2000, 2)\n"
+        "fig = px.scatter(x=points[:, 0], y=points[:, 1])\nfig.show()"
+    ),
+    "pandas": (
+        "import numpy as np\nimport pandas as pd\n"
+        "df = pd.DataFrame({'key': np.random.randint(0, 1000, 300_000), "
+        "'value': np.random.rand(300_000)})\n"
+        "stats = df.groupby('key')['value'].agg(['mean', 'std', 'count'])\n"
+        "merged = df.merge(stats, left_on='key', right_index=True)\n"
+        "print(len(merged))"
+    ),
+}
+DEFAULT_MIX = "short=6,plot=2,pandas=2,idle=0"
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in CELLS and name != "idle":
+            raise ValueError(f"Неизвестный тип ячейки: {name}")
+        weights[name] = float(weight or 1)
+    return {name: weight for name, weight in weights.items() if weight > 0}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, op: str, request):
+        started = time.perf_counter()
+        try:
+            response = await request
+            response.raise_for_status()
+            data = response.json()
+        except Exception:
+            self.errors[op] += 1
+            return None
+        self.latencies[op].append(time.perf_counter() - started)
+        if isinstance(data, dict) and data.get("is_exception"):
+            self.errors[f"{op}_exception"] += 1
+        return data
+
+    def summary(self) -> dict:
+        result = {}
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            ordered = sorted(self.latencies.get(op, []))
+            result[op] = {
+                "count": len(ordered),
+                "errors": self.errors.get(op, 0),
+                "p50_s": percentile(ordered, 0.5),
+                "p95_s": percentile(ordered, 0.95),
+                "p99_s": percentile(ordered, 0.99),
+                "max_s": ordered[-1] if ordered else None,
+            }
+        return result
+
+
+async def run_user(client: httpx.AsyncClient, recorder: Recorder, args, rng):
+    data = await recorder.call("start", client.post("/start"))
+    if data is None:
+        return
+    kernel_id = data["id"]
+    kinds, weights = zip(*args.mix.items())
+    for _ in range(args.cells):
+        kind = rng.choices(kinds, weights)[0]
+        op = f"code_{kind}"
+        script = CELLS.get(kind)
+        if kind == "idle":
+            await asyncio.sleep(args.idle_seconds)
+            # Первая ячейка после паузы включает восстановление из снапшота
+            op, script = "code_after_idle", CELLS["short"]
+        await recorder.call(
+            op, client.post("/code", json={"kernel_id": kernel_id, "script": script})
+        )
+        if args.think_time:
+            await asyncio.sleep(rng.uniform(0, args.think_time))
+    await recorder.call(
+        "shutdown", client.post("/shutdown", json={"kernel_id": kernel_id})
+    )
+
+
+async def sample_rss(pid: int, peak: dict, interval: float = 0.5):
+    """Пиковый RSS процесса сервиса вместе с дочерними (ядрами)."""
+    process = psutil.Process(pid)
+    while True:
+        try:
+            rss = process.memory_info().rss
+            for child in process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass
+        except psutil.Error:
+            return
+        peak["rss"] = max(peak["rss"], rss)
+        await asyncio.sleep(interval)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/pool")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("REPL-сервис не поднялся")
+
+
+async def main(args):
+    server = None
+    url, pid = args.url, args.pid
+    if args.spawn:
+        port = _free_port()
+        url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ, MAX_KERNEL_LIVE=str(args.server_idle_timeout))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port)],
+            env=env,
+        )
+        pid = server.pid
+
+    recorder = Recorder()
+    peak = {"rss": 0}
+    limits = httpx.Limits(max_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=url, timeout=None, limits=limits) as client:
+        try:
+            await wait_ready(client, args.ready_timeout)
+            sampler = asyncio.create_task(sample_rss(pid, peak)) if pid else None
+            rng = random.Random(args.seed)
+            started = time.perf_counter()
+            users = []
+            for user in range(args.users):
+                users.append(
+                    asyncio.create_task(
+                        run_user(client, recorder, args, random.Random(rng.random()))
+                    )
+                )
+                if args.ramp_up:
+                    await asyncio.sleep(args.ramp_up / args.users)
+            await asyncio.gather(*users)
+            elapsed = time.perf_counter() - started
+            if sampler is not None:
+                sampler.cancel()
+            server_timings = (await client.get("/timings")).json()
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=60)
+
+    cells = sum(
+        len(values)
+        for op, values in recorder.latencies.items()
+        if op.startswith("code")
+    )
+    report = {
+        "users": args.users,
+        "elapsed_s": round(elapsed, 3),
+        "cells_per_s": round(cells / elapsed, 3),
+        "ops": recorder.summary(),
+        "server": server_timings,
+        "peak_rss_mb": round(peak["rss"] / 1024**2, 1) if pid else None,
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест REPL-сервиса")
+    parser.add_argument("--url", default="http://127.0.0.1:9090")
+    parser.add_argument("--spawn", action="store_true", help="Поднять сервис локально")
+    parser.add_argument("--pid", type=int, help="PID сервиса для замера RSS")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--cells", type=int, default=10, help="Ячеек на пользователя")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument("--idle-seconds", type=float, default=0.0)
+    parser.add_argument(
+        "--server-idle-timeout",
+        type=float,
+        default=300.0,
+        help="MAX_KERNEL_LIVE для сервиса, поднятого через --spawn",
+    )
+    parser.add_argument("--think-time", type=float, default=0.0)
+    parser.add_argument("--ramp-up", type=float, default=0.0)
+    parser.add_argument("--ready-timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Куда сохранить отчёт в JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -1,17 +1,49 @@
+import asyncio
+import functools
+import json
 import os
 import time
 import uuid
+from contextlib import asynccontextmanager
+from typing import Literal
 
-from fastapi import FastAPI, HTTPException
+import httpx
+import psutil
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
-from app.run_jupyter import StatefulKernel
+from app.kernel_pool import DEFAULT_WARMUP_CODE, KernelPool
+from app.registry import KernelRegistry
+from app.run_jupyter import KERNEL_TIMINGS, StatefulKernel, collect_result
+from app.scheduler import AdmissionRejected, KernelScheduler
 
 load_dotenv("../.env")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.kernel_pool.start()
+    app.scheduler.start()
+    if app.registry is not None:
+        app.registry.start()
+    app.forward_client = httpx.AsyncClient(timeout=None)
+    yield
+    await app.scheduler.close()
+    await app.kernel_pool.close()
+    if app.registry is not None:
+        # Усыпляем ядра, чтобы их могли поднять другие воркеры
+        for wrapper in list(app.kernels.values()):
+            if wrapper.is_running:
+                await wrapper.shutdown()
+        await app.registry.close()
+    await app.forward_client.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
@@ -28,8 +60,37 @@ app.kernels_last_request = {}
 
 STATE_DIR = os.environ.get("STATE_DIR", "kernel_states")
 os.makedirs(STATE_DIR, exist_ok=True)
+TRANSFER_DIR = os.path.abspath(os.path.join(STATE_DIR, "transfer"))
+os.makedirs(TRANSFER_DIR, exist_ok=True)
 
 MAX_IDLE = float(os.environ.get("MAX_KERNEL_LIVE", 300))
+SNAPSHOT_TIMEOUT = float(os.environ.get("SNAPSHOT_TIMEOUT", 600))
+SNAPSHOT_LAZY_RESTORE = os.environ.get("SNAPSHOT_LAZY_RESTORE", "1") == "1"
+KERNEL_POOL_SIZE = int(os.environ.get("KERNEL_POOL_SIZE", 2))
+KERNEL_WARMUP_CODE = os.environ.get("KERNEL_WARMUP_CODE", DEFAULT_WARMUP_CODE)
+KERNEL_MEMORY_BUDGET = int(os.environ.get("KERNEL_MEMORY_BUDGET_MB", 0)) * 1024**2
+if not KERNEL_MEMORY_BUDGET:
+    # По умолчанию отдаём ядрам 80% памяти машины
+    KERNEL_MEMORY_BUDGET = int(psutil.virtual_memory().total * 0.8)
+MAX_KERNELS = int(os.environ.get("MAX_KERNELS", 0))
+KERNEL_ADMISSION_TIMEOUT = float(os.environ.get("KERNEL_ADMISSION_TIMEOUT", 30))
+# Сколько памяти закладывать под ядро, которое ещё запускается
+KERNEL_RSS_ESTIMATE = int(os.environ.get("KERNEL_RSS_ESTIMATE_MB", 150)) * 1024**2
+# Адрес, по которому этот воркер доступен другим воркерам. Если не задан — работаем
+# в одном процессе без реестра ядер
+REPL_WORKER_URL = os.environ.get("REPL_WORKER_URL")
+REPL_WORKER_TTL = float(os.environ.get("REPL_WORKER_TTL", 30))
+FORWARDED_HEADER = "X-Repl-Forwarded"
+
+app.registry = (
+    KernelRegistry(
+        os.path.join(STATE_DIR, "registry.db"),
+        REPL_WORKER_URL.rstrip("/"),
+        worker_ttl=REPL_WORKER_TTL,
+    )
+    if REPL_WORKER_URL
+    else None
+)
 
 
 class CodeRequest(BaseModel):
@@ -39,18 +100,117 @@ class CodeRequest(BaseModel):
 
 async def load_wrapper(kernel_id: str):
     state_file = os.path.join(STATE_DIR, f"{kernel_id}.pkl")
-    wrapper = StatefulKernel(state_file=state_file, idle_timeout=MAX_IDLE)
+    wrapper = StatefulKernel(
+        state_file=state_file,
+        idle_timeout=MAX_IDLE,
+        snapshot_dir=os.path.join(STATE_DIR, kernel_id),
+        snapshot_timeout=SNAPSHOT_TIMEOUT,
+        lazy_restore=SNAPSHOT_LAZY_RESTORE,
+    )
+    if app.registry is not None:
+        wrapper.on_shutdown = functools.partial(app.registry.release, kernel_id)
     # Запускаем ядро и (опционально) сразу загружаем предыдущий state
     await wrapper.start()
     return wrapper
 
 
+app.scheduler = KernelScheduler(
+    lambda: app.kernels,
+    memory_budget=KERNEL_MEMORY_BUDGET,
+    max_kernels=MAX_KERNELS,
+    admission_timeout=KERNEL_ADMISSION_TIMEOUT,
+    kernel_rss_estimate=KERNEL_RSS_ESTIMATE,
+    pinned=lambda: app.kernel_pool.kernels(),
+)
+app.kernel_pool = KernelPool(
+    load_wrapper,
+    size=KERNEL_POOL_SIZE,
+    warmup_code=KERNEL_WARMUP_CODE,
+    scheduler=app.scheduler,
+)
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(int(KERNEL_ADMISSION_TIMEOUT))},
+    )
+
+
+async def remote_owner(kernel_id: str, request: Request) -> str | None:
+    """Адрес другого воркера, владеющего ядром. None — запрос обрабатываем сами."""
+    if app.registry is None or request.headers.get(FORWARDED_HEADER):
+        return None
+    owner = await app.registry.owner(kernel_id)
+    if owner is None or owner == app.registry.worker_url:
+        return None
+    return owner
+
+
+async def forward(
+    owner: str,
+    path: str,
+    payload: dict | None = None,
+    content: bytes | None = None,
+    params: dict | None = None,
+) -> Response:
+    response = await app.forward_client.post(
+        f"{owner}{path}",
+        json=payload,
+        content=content,
+        params=params,
+        headers={FORWARDED_HEADER: "1"},
+    )
+    return Response(
+        content=response.content,
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type"),
+    )
+
+
+async def forward_stream(owner: str, path: str, payload: dict) -> StreamingResponse:
+    response = await app.forward_client.send(
+        app.forward_client.build_request(
+            "POST", f"{owner}{path}", json=payload, headers={FORWARDED_HEADER: "1"}
+        ),
+        stream=True,
+    )
+    return StreamingResponse(
+        response.aiter_raw(),
+        status_code=response.status_code,
+        media_type=response.headers.get("content-type"),
+        background=BackgroundTask(response.aclose),
+    )
+
+
+async def get_wrapper(kernel_id: str):
+    # Забираем ядро до запуска: его мог только что поднять другой воркер
+    if app.registry is not None and not await app.registry.claim(kernel_id):
+        raise HTTPException(
+            status_code=409,
+            detail="Ядро занято другим воркером, повторите запрос",
+            headers={"Retry-After": "1"},
+        )
+    wrapper = app.kernels.get(kernel_id)
+    if wrapper is None or not wrapper.is_running:
+        # Ядро придётся поднимать — резервируем под него ресурсы до конца запуска
+        async with app.scheduler.admission():
+            if wrapper is None:
+                wrapper = await load_wrapper(kernel_id)
+                app.kernels[kernel_id] = wrapper
+            else:
+                await wrapper.start()
+    return wrapper
+
+
 @app.post("/code")
-async def code(request: CodeRequest):
-    wrapper = app.kernels.get(request.kernel_id)
-    if wrapper is None:
-        wrapper = await load_wrapper(request.kernel_id)
-        app.kernels[request.kernel_id] = wrapper
+async def code(request: CodeRequest, http_request: Request):
+    owner = await remote_owner(request.kernel_id, http_request)
+    if owner is not None:
+        return await forward(owner, "/code", request.model_dump())
+    wrapper = await get_wrapper(request.kernel_id)
     result, err, _, attachments = await wrapper.execute(request.script)
     app.kernels_last_request[request.kernel_id] = time.time()
     return {
@@ -61,11 +221,94 @@ async def code(request: CodeRequest):
     }
 
 
+@app.post("/code/stream")
+async def code_stream(request: CodeRequest, http_request: Request):
+    """
+    Выполняет код и отдаёт iopub-сообщения построчно в формате NDJSON по мере их появления.
+    Последняя строка — событие `done` с тем же содержимым, что и ответ `/code`.
+    """
+    owner = await remote_owner(request.kernel_id, http_request)
+    if owner is not None:
+        return await forward_stream(owner, "/code/stream", request.model_dump())
+    wrapper = await get_wrapper(request.kernel_id)
+
+    async def events():
+        collected = []
+        async for event in wrapper.execute_stream(request.script):
+            collected.append(event)
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+        result, err, _, attachments = collect_result(collected)
+        app.kernels_last_request[request.kernel_id] = time.time()
+        yield json.dumps(
+            {
+                "type": "done",
+                "result": result,
+                "is_exception": bool(err),
+                "exception": err,
+                "attachments": attachments,
+            },
+            ensure_ascii=False,
+        ) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+def write_transfer_file(path: str, body: bytes):
+    with open(path, "wb") as f:
+        f.write(body)
+
+
+@app.post("/data/{kernel_id}")
+async def put_data(
+    kernel_id: str,
+    variable: str,
+    http_request: Request,
+    mode: Literal["set", "append", "extend"] = "set",
+):
+    """
+    Кладёт JSON из тела запроса в переменную ядра `variable`, при `mode=append` —
+    добавляет его в конец списка `variable`, при `mode=extend` — дописывает в
+    список все элементы JSON-массива. Данные передаются через файл и не
+    компилируются как Python-код.
+    """
+    if not variable.isidentifier():
+        raise HTTPException(status_code=400, detail="Invalid variable name")
+    body = await http_request.body()
+    owner = await remote_owner(kernel_id, http_request)
+    if owner is not None:
+        return await forward(
+            owner,
+            f"/data/{kernel_id}",
+            content=body,
+            params={"variable": variable, "mode": mode},
+        )
+    wrapper = await get_wrapper(kernel_id)
+    path = os.path.join(TRANSFER_DIR, f"{uuid.uuid4()}.json")
+    await asyncio.to_thread(write_transfer_file, path, body)
+    if mode == "append":
+        target = f"{variable}.append(_load_payload({path!r}))"
+    elif mode == "extend":
+        target = f"{variable}.extend(_load_payload({path!r}))"
+    else:
+        target = f"{variable} = _load_payload({path!r})"
+    try:
+        _, err, _, _ = await wrapper.execute(
+            f"from app.transfer import load_payload as _load_payload\n{target}"
+        )
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    app.kernels_last_request[kernel_id] = time.time()
+    return {"completed": not err, "is_exception": bool(err), "exception": err}
+
+
 @app.post("/start")
 async def start_kernel():
-    kernel_id = str(uuid.uuid4())
-    wrapper = await load_wrapper(kernel_id)
+    # Ядро из пула уже учтено планировщиком, новое пул запускает через admission
+    kernel_id, wrapper = await app.kernel_pool.acquire()
     app.kernels[kernel_id] = wrapper
+    if app.registry is not None:
+        await app.registry.claim(kernel_id)
     app.kernels_last_request[kernel_id] = time.time()
     print("Started kernel {}".format(kernel_id))
     return {"id": kernel_id}
@@ -76,10 +319,30 @@ class KernelRequest(BaseModel):
 
 
 @app.post("/shutdown")
-async def shutdown_kernel(request: KernelRequest):
+async def shutdown_kernel(request: KernelRequest, http_request: Request):
+    owner = await remote_owner(request.kernel_id, http_request)
+    if owner is not None:
+        return await forward(owner, "/shutdown", request.model_dump())
     wrapper = app.kernels.get(request.kernel_id)
     if wrapper is None:
         raise HTTPException(status_code=404, detail="Kernel not found")
     # Сохраняем и убиваем
     await wrapper.shutdown()
+    app.scheduler.release()
     return {"completed": True}
+
+
+@app.get("/pool")
+async def pool_stats():
+    return app.kernel_pool.stats()
+
+
+@app.get("/kernels")
+async def kernels_stats():
+    return await asyncio.to_thread(app.scheduler.stats)
+
+
+@app.get("/timings")
+async def kernel_timings():
+    """Длительности запуска ядер, восстановления и сохранения снапшотов, с."""
+    return KERNEL_TIMINGS.summary()
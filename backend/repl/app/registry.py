@@ -0,0 +1,123 @@
+import asyncio
+import contextlib
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class KernelRegistry:
+    """
+    Общий для всех воркеров REPL-сервиса реестр `kernel_id -> адрес воркера`.
+
+    Хранится в SQLite внутри общего STATE_DIR. Каждый воркер периодически
+    обновляет свой heartbeat; ядра воркера, который перестал его обновлять,
+    может забрать любой другой воркер и поднять их из снапшота.
+    """
+
+    def __init__(self, path: str, worker_url: str, worker_ttl: float = 30.0):
+        self.path = path
+        self.worker_url = worker_url
+        self.worker_ttl = worker_ttl
+        self._heartbeat_task: asyncio.Task | None = None
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS kernels ("
+                "kernel_id TEXT PRIMARY KEY, worker_url TEXT NOT NULL, updated_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS workers ("
+                "worker_url TEXT PRIMARY KEY, heartbeat REAL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        """Один запрос в своей транзакции; соединение закрывается сразу."""
+        with contextlib.closing(self._connect()) as conn, conn:
+            return conn.execute(sql, params)
+
+    def _heartbeat(self):
+        self._execute(
+            "INSERT OR REPLACE INTO workers (worker_url, heartbeat) VALUES (?, ?)",
+            (self.worker_url, time.time()),
+        )
+
+    def _owner(self, kernel_id: str) -> str | None:
+        with contextlib.closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT k.worker_url, w.heartbeat FROM kernels k "
+                "LEFT JOIN workers w ON w.worker_url = k.worker_url "
+                "WHERE k.kernel_id = ?",
+                (kernel_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        worker_url, heartbeat = row
+        if heartbeat is None or time.time() - heartbeat > self.worker_ttl:
+            return None
+        return worker_url
+
+    def _claim(self, kernel_id: str) -> bool:
+        now = time.time()
+        # Одним запросом: чужую запись перезаписываем, только если её воркер мёртв
+        cursor = self._execute(
+            "INSERT INTO kernels (kernel_id, worker_url, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(kernel_id) DO UPDATE SET "
+            "worker_url = excluded.worker_url, updated_at = excluded.updated_at "
+            "WHERE kernels.worker_url = excluded.worker_url "
+            "OR kernels.worker_url NOT IN "
+            "(SELECT worker_url FROM workers WHERE heartbeat >= ?)",
+            (kernel_id, self.worker_url, now, now - self.worker_ttl),
+        )
+        return cursor.rowcount > 0
+
+    async def owner(self, kernel_id: str) -> str | None:
+        """Адрес живого воркера, которому принадлежит ядро, или None."""
+        return await asyncio.to_thread(self._owner, kernel_id)
+
+    async def claim(self, kernel_id: str) -> bool:
+        """
+        Закрепляет ядро за этим воркером. False — ядро уже у другого живого
+        воркера (успел забрать между проверкой владельца и запуском).
+        """
+        return await asyncio.to_thread(self._claim, kernel_id)
+
+    async def release(self, kernel_id: str):
+        """Снимает привязку ядра к этому воркеру (например, после гибернации)."""
+        await asyncio.to_thread(
+            self._execute,
+            "DELETE FROM kernels WHERE kernel_id = ? AND worker_url = ?",
+            (kernel_id, self.worker_url),
+        )
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await asyncio.to_thread(self._heartbeat)
+            except sqlite3.Error:
+                logger.exception("Не удалось обновить heartbeat воркера")
+            await asyncio.sleep(self.worker_ttl / 3)
+
+    def start(self):
+        if self._heartbeat_task is None:
+            self._heartbeat()
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def close(self):
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        await asyncio.to_thread(self._forget_worker)
+
+    def _forget_worker(self):
+        with contextlib.closing(self._connect()) as conn, conn:
+            conn.execute(
+                "DELETE FROM workers WHERE worker_url = ?", (self.worker_url,)
+            )
+            conn.execute(
+                "DELETE FROM kernels WHERE worker_url = ?", (self.worker_url,)
+            )
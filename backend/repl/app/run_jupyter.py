@@ -1,12 +1,17 @@
 import asyncio
 import json
 import logging
+import math
 import os
 import re
 import time
+from collections import deque
+from typing import Awaitable, Callable
 
 import jupyter_client
 
+from app.snapshot import MANIFEST
+
 logger = logging.getLogger(__name__)
 
 ansi_escape = re.compile(r"\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])")
@@ -16,127 +21,230 @@ class KernelDeath(Exception):
     pass
 
 
-async def async_run_code(
-    km: jupyter_client.AsyncKernelManager,
+def percentile(ordered: list[float], q: float) -> float | None:
+    """Перцентиль по уже отсортированному списку (nearest-rank)."""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class KernelTimings:
+    """Последние длительности запуска ядра, восстановления и сохранения снапшота."""
+
+    def __init__(self, maxlen: int = 1000):
+        self._values = {
+            kind: deque(maxlen=maxlen) for kind in ("boot", "restore", "snapshot")
+        }
+
+    def record(self, kind: str, seconds: float):
+        self._values[kind].append(seconds)
+
+    def summary(self) -> dict:
+        result = {}
+        for kind, values in self._values.items():
+            ordered = sorted(values)
+            result[kind] = {
+                "count": len(ordered),
+                "p50": percentile(ordered, 0.5),
+                "p95": percentile(ordered, 0.95),
+                "max": ordered[-1] if ordered else None,
+            }
+        return result
+
+
+KERNEL_TIMINGS = KernelTimings()
+
+
+class KernelChannel:
+    """
+    Долгоживущий AsyncKernelClient для одного ядра:
+    - каналы ZMQ открываются один раз при `start`
+    - фоновый таск читает iopub и раскладывает сообщения по очередям `msg_id`
+    - несколько выполнений могут стоять в очереди ядра одновременно
+    """
+
+    def __init__(self, km: jupyter_client.AsyncKernelManager):
+        self.km = km
+        self.kc: jupyter_client.AsyncKernelClient | None = None
+        self._queues: dict[str, asyncio.Queue] = {}
+        self._router_task: asyncio.Task | None = None
+        self.dead = False
+
+    async def start(self, wait_for_ready_timeout=30):
+        self.kc = self.km.client()
+        self.kc.start_channels()
+        await self.kc.wait_for_ready(timeout=wait_for_ready_timeout)
+        self.km.add_restart_callback(self._restarting, "restart")
+        self.km.add_restart_callback(self._dead, "dead")
+        self._router_task = asyncio.create_task(self._route())
+
+    def _restarting(self):
+        logger.error(
+            "Restart shouldn't happen because config.KernelRestarter.restart_limit is expected to be set to 0"
+        )
+
+    def _dead(self):
+        logger.info("Kernel has died, will NOT restart")
+        self.dead = True
+        for queue in self._queues.values():
+            queue.put_nowait(None)
+
+    async def _route(self):
+        while True:
+            message = await self.kc.get_iopub_msg()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(json.dumps(message, indent=2, default=str))
+            queue = self._queues.get(message["parent_header"].get("msg_id"))
+            if queue is not None:
+                queue.put_nowait(message)
+
+    def submit(self, code) -> tuple[str, asyncio.Queue]:
+        if self.dead:
+            raise KernelDeath()
+        msg_id = self.kc.execute(code)
+        # Между execute и регистрацией очереди нет await, поэтому роутер ничего не потеряет
+        queue = self._queues[msg_id] = asyncio.Queue()
+        return msg_id, queue
+
+    def release(self, msg_id: str):
+        self._queues.pop(msg_id, None)
+
+    async def stop(self):
+        if self._router_task is not None:
+            self._router_task.cancel()
+            self._router_task = None
+        self.km.remove_restart_callback(self._restarting, "restart")
+        self.km.remove_restart_callback(self._dead, "dead")
+        for queue in self._queues.values():
+            queue.put_nowait(None)
+        self._queues.clear()
+        if self.kc is not None:
+            self.kc.stop_channels()
+            self.kc = None
+
+
+async def async_stream_code(
+    channel: KernelChannel,
     code,
     *,
     interrupt_after=30,
     iopub_timeout=40,
-    wait_for_ready_timeout=30,
-    shutdown_kernel=False,
 ):
+    """
+    Выполняет код и отдаёт iopub-сообщения по мере их поступления в виде словарей:
+      - {"type": "stream", "name": ..., "text": ...}
+      - {"type": "execute_result", "data": ...}
+      - {"type": "display_data", "data": ...}
+      - {"type": "error", "traceback": ...}
+
+    Таймауты начинают отсчитываться, когда ядро взялось за ячейку (status busy),
+    а не когда она встала в очередь.
+    """
     assert iopub_timeout > interrupt_after
-    try:
-
-        async def get_iopub_msg_with_death_detection(
-            kc: jupyter_client.AsyncKernelClient, *, timeout=None
-        ):
-            loop = asyncio.get_running_loop()
-            dead_fut = loop.create_future()
-
-            def restarting():
-                assert (
-                    False
-                ), "Restart shouldn't happen because config.KernelRestarter.restart_limit is expected to be set to 0"
 
-            def dead():
-                logger.info("Kernel has died, will NOT restart")
-                dead_fut.set_result(None)
+    async def send_interrupt():
+        await asyncio.sleep(interrupt_after)
+        await channel.km.interrupt_kernel()
 
-            msg_task = asyncio.create_task(kc.get_iopub_msg(timeout=timeout))
-            km.add_restart_callback(restarting, "restart")
-            km.add_restart_callback(dead, "dead")
-            try:
-                done, _ = await asyncio.wait(
-                    [dead_fut, msg_task], return_when=asyncio.FIRST_COMPLETED
-                )
-                if dead_fut in done:
-                    raise KernelDeath()
-                assert msg_task in done
-                return await msg_task
-            finally:
-                msg_task.cancel()
-                km.remove_restart_callback(restarting, "restart")
-                km.remove_restart_callback(dead, "dead")
-
-        async def send_interrupt():
-            await asyncio.sleep(interrupt_after)
-            await km.interrupt_kernel()
-
-        async def run():
-            kc = km.client()
-            kc.start_channels()
-            await kc.wait_for_ready(timeout=wait_for_ready_timeout)
-            msg_id = kc.execute(code)
-            execute_result = {}
-            error_traceback = None
-            stream_text_list = []
-            attachments = []
-            while True:
-                message = await get_iopub_msg_with_death_detection(
-                    kc, timeout=iopub_timeout
-                )
-                if logger.isEnabledFor(logging.DEBUG):
-                    logger.debug(json.dumps(message, indent=2, default=str))
-                assert message["parent_header"]["msg_id"] == msg_id
-                msg_type = message["msg_type"]
-                if msg_type == "status":
-                    if message["content"]["execution_state"] == "idle":
-                        break
-                elif msg_type == "stream":
-                    stream_name = message["content"]["name"]
-                    stream_text = message["content"]["text"]
-                    stream_text_list.append(stream_text)
-                elif msg_type == "execute_result":
-                    execute_result = message["content"]["data"]
-                elif msg_type == "error":
-                    error_traceback_lines = message["content"]["traceback"]
-                    error_traceback = "\n".join(error_traceback_lines)
-                    error_traceback = ansi_escape.sub("", error_traceback)
-                elif msg_type == "execute_input":
-                    pass
-                elif msg_type == "display_data":
-                    attachments.append(message["content"]["data"])
-                else:
-                    assert False, f"Unknown message_type: {msg_type}"
-
-            kc.stop_channels()
-
-            return (
-                "".join(stream_text_list) + execute_result.get("text/plain", ""),
-                error_traceback,
-                "".join(stream_text_list),
-                attachments,
-            )
-
-        if interrupt_after:
-            run_task = asyncio.create_task(run())
-            send_interrupt_task = asyncio.create_task(send_interrupt())
-            done, _ = await asyncio.wait(
-                [run_task, send_interrupt_task], return_when=asyncio.FIRST_COMPLETED
+    msg_id, queue = channel.submit(code)
+    started = False
+    send_interrupt_task = None
+    try:
+        while True:
+            message = await asyncio.wait_for(
+                queue.get(), timeout=iopub_timeout if started else None
             )
-            if run_task in done:
-                send_interrupt_task.cancel()
+            if message is None:
+                raise KernelDeath()
+            msg_type = message["msg_type"]
+            if msg_type == "status":
+                state = message["content"]["execution_state"]
+                if state == "busy" and not started:
+                    started = True
+                    if interrupt_after:
+                        send_interrupt_task = asyncio.create_task(send_interrupt())
+                elif state == "idle":
+                    break
+            elif msg_type == "stream":
+                yield {
+                    "type": "stream",
+                    "name": message["content"]["name"],
+                    "text": message["content"]["text"],
+                }
+            elif msg_type == "execute_result":
+                yield {"type": "execute_result", "data": message["content"]["data"]}
+            elif msg_type == "error":
+                error_traceback_lines = message["content"]["traceback"]
+                error_traceback = "\n".join(error_traceback_lines)
+                yield {
+                    "type": "error",
+                    "traceback": ansi_escape.sub("", error_traceback),
+                }
+            elif msg_type == "execute_input":
+                pass
+            elif msg_type == "display_data":
+                yield {"type": "display_data", "data": message["content"]["data"]}
             else:
-                assert send_interrupt_task in done
-            result = await run_task
-        else:
-            result = await run()
-        return result
-
+                assert False, f"Unknown message_type: {msg_type}"
     finally:
-        if shutdown_kernel:
-            await km.shutdown_kernel()
+        if send_interrupt_task is not None:
+            send_interrupt_task.cancel()
+        channel.release(msg_id)
+
+
+def collect_result(events):
+    """Собирает события `async_stream_code` в кортеж (result, error, stdout, attachments)."""
+    execute_result = {}
+    error_traceback = None
+    stream_text_list = []
+    attachments = []
+    for event in events:
+        if event["type"] == "stream":
+            stream_text_list.append(event["text"])
+        elif event["type"] == "execute_result":
+            execute_result = event["data"]
+        elif event["type"] == "error":
+            error_traceback = event["traceback"]
+        elif event["type"] == "display_data":
+            attachments.append(event["data"])
+    return (
+        "".join(stream_text_list) + execute_result.get("text/plain", ""),
+        error_traceback,
+        "".join(stream_text_list),
+        attachments,
+    )
+
+
+async def async_run_code(
+    channel: KernelChannel,
+    code,
+    *,
+    interrupt_after=30,
+    iopub_timeout=40,
+):
+    events = [
+        event
+        async for event in async_stream_code(
+            channel,
+            code,
+            interrupt_after=interrupt_after,
+            iopub_timeout=iopub_timeout,
+        )
+    ]
+    return collect_result(events)
 
 
 class StatefulKernel:
     """
     Обёртка над AsyncKernelManager, которая:
-    - при старте — запускает ядро и загружает состояние из файла (если есть)
+    - при старте — запускает ядро и загружает снапшот состояния (если есть)
     - при каждом execute — обновляет метку last_used
     - фоновым таском следит за простоями и по таймауту:
-        * сохраняет состояние в файл
+        * сохраняет инкрементальный снапшот переменных в `snapshot_dir`
         * завершает ядро
+
+    `state_file` — старый формат (`dill.dump_session`), из него состояние только читается.
+    При `lazy_restore` переменные снапшота загружаются при первом обращении к ним.
     """
 
     def __init__(
@@ -144,15 +252,40 @@ class StatefulKernel:
         kernel_name: str = "python3",
         state_file: str = "kernel_state.pkl",
         idle_timeout: float = 300.0,  # seconds
+        snapshot_dir: str = "kernel_state",
+        snapshot_timeout: float = 600.0,
+        lazy_restore: bool = True,
     ):
         self.kernel_name = kernel_name
         self.state_file = state_file
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_timeout = snapshot_timeout
+        self.lazy_restore = lazy_restore
         self.idle_timeout = idle_timeout
-        print(state_file)
+        logger.debug("Снапшоты ядра: %s", snapshot_dir)
 
         self.km: jupyter_client.AsyncKernelManager | None = None
+        self.channel: KernelChannel | None = None
         self.last_used: float | None = None
         self._idle_task: asyncio.Task | None = None
+        self._start_lock = asyncio.Lock()
+        self._active_executions = 0
+        # Вызывается после сохранения состояния и остановки ядра
+        self.on_shutdown: Callable[[], Awaitable[None]] | None = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.km is not None
+
+    @property
+    def is_busy(self) -> bool:
+        return self._active_executions > 0
+
+    @property
+    def pid(self) -> int | None:
+        if self.km is None:
+            return None
+        return getattr(self.km.provisioner, "pid", None)
 
     def _rewrite_pip_commands(self, code: str) -> tuple[str, bool]:
         """
@@ -206,20 +339,47 @@ class StatefulKernel:
         return "\n".join(new_lines), contains_pip
 
     async def start(self):
-        if self.km is None:
-            # 1) Запускаем новое ядро
-            self.km = jupyter_client.AsyncKernelManager(kernel_name=self.kernel_name)
-            await self.km.start_kernel()
-
-            # 2) Сразу после старта — если есть файл состояния, загружаем его
-            if os.path.exists(self.state_file):
-                load_code = f"import dill; dill.load_session('{self.state_file}')"
-                await async_run_code(self.km, load_code)
+        async with self._start_lock:
+            if self.km is None:
+                # 1) Запускаем новое ядро и открываем к нему постоянные каналы
+                started = time.perf_counter()
+                km = jupyter_client.AsyncKernelManager(kernel_name=self.kernel_name)
+                await km.start_kernel()
+                channel = KernelChannel(km)
+                await channel.start()
+                KERNEL_TIMINGS.record("boot", time.perf_counter() - started)
+
+                # 2) Сразу после старта — если есть снапшот состояния, загружаем его
+                load_code = None
+                if os.path.exists(os.path.join(self.snapshot_dir, MANIFEST)):
+                    load_code = (
+                        "from app.snapshot import load_snapshot; "
+                        f"load_snapshot(globals(), {self.snapshot_dir!r}, "
+                        f"lazy={self.lazy_restore})"
+                    )
+                elif os.path.exists(self.state_file):
+                    load_code = f"import dill; dill.load_session('{self.state_file}')"
+                if load_code:
+                    started = time.perf_counter()
+                    await async_run_code(
+                        channel,
+                        load_code,
+                        interrupt_after=0,
+                        iopub_timeout=self.snapshot_timeout,
+                    )
+                    KERNEL_TIMINGS.record("restore", time.perf_counter() - started)
+                self.km, self.channel = km, channel
 
         # Запускаем watcher простоя, если ещё не запущен
         if self._idle_task is None:
             self._idle_task = asyncio.create_task(self._idle_watcher())
 
+    def _run_kwargs(self, contains_pip: bool) -> dict:
+        # Для pip-установок отключаем авто-интеррапт и увеличиваем таймауты
+        if contains_pip:
+            return dict(iopub_timeout=600)
+        return {}
+
     async def execute(self, code: str):
         # Убедиться, что ядро запущено и состояние загружено
         await self.start()
@@ -227,38 +387,84 @@ class StatefulKernel:
         self.last_used = time.time()
         # Переписать потенциально небезопасные команды установки pip в привязанные к ядру
         rewritten_code, contains_pip = self._rewrite_pip_commands(code)
-
-        # Для pip-установок отключаем авто-интеррапт и увеличиваем таймауты
-        if contains_pip:
-            result = await async_run_code(
-                self.km,
-                rewritten_code,
-                iopub_timeout=600,
-                wait_for_ready_timeout=60,
-                shutdown_kernel=False,
-            )
-        else:
-            # Выполнить код через async_run_code с настройками по умолчанию
-            result = await async_run_code(
-                self.km, rewritten_code, shutdown_kernel=False
+        self._active_executions += 1
+        try:
+            return await async_run_code(
+                self.channel, rewritten_code, **self._run_kwargs(contains_pip)
             )
-        return result
+        finally:
+            self._active_executions -= 1
+            self.last_used = time.time()
 
-    async def shutdown(self):
-        """Сохранить состояние и остановить ядро."""
+    async def execute_stream(self, code: str):
+        """Как `execute`, но отдаёт события выполнения по мере их появления."""
+        await self.start()
+        self.last_used = time.time()
+        rewritten_code, contains_pip = self._rewrite_pip_commands(code)
+        self._active_executions += 1
+        try:
+            async for event in async_stream_code(
+                self.channel, rewritten_code, **self._run_kwargs(contains_pip)
+            ):
+                self.last_used = time.time()
+                yield event
+        finally:
+            self._active_executions -= 1
+            self.last_used = time.time()
+
+    async def shutdown(self, only_idle: bool = False) -> bool:
+        """
+        Сохранить состояние и остановить ядро. Держит `_start_lock`, так что
+        новое выполнение дождётся конца и поднимет ядро заново, а не попадёт
+        под остановку. При `only_idle` занятое ядро не трогается.
+        Возвращает, было ли ядро остановлено.
+        """
+        async with self._start_lock:
+            if only_idle and self.is_busy:
+                return False
+            await self._shutdown()
+        return True
+
+    async def _shutdown(self):
         if self.km is not None:
             # Попытаться сохранить состояние
             try:
-                load_code = f"import dill; dill.dump_session('{self.state_file}')"
-                await async_run_code(self.km, load_code)
+                save_code = (
+                    "from app.snapshot import save_snapshot; "
+                    f"_snapshot_stats = save_snapshot(globals(), {self.snapshot_dir!r})"
+                )
+                started = time.perf_counter()
+                await async_run_code(
+                    self.channel,
+                    save_code,
+                    interrupt_after=0,
+                    iopub_timeout=self.snapshot_timeout,
+                )
+                KERNEL_TIMINGS.record("snapshot", time.perf_counter() - started)
             except Exception:
                 logger.exception("Не удалось сохранить состояние ядра")
 
-            # Останавливаем само ядро
+            # Закрываем каналы и останавливаем само ядро
+            await self.channel.stop()
             await self.km.shutdown_kernel(now=True)
 
         # Сбросить всё, чтобы при следующем start() поднялось заново
         self.km = None
+        self.channel = None
+        self.last_used = None
+        if self.on_shutdown is not None:
+            await self.on_shutdown()
+        if self._idle_task:
+            self._idle_task.cancel()
+            self._idle_task = None
+
+    async def close(self):
+        """Остановить ядро без сохранения состояния."""
+        if self.km is not None:
+            await self.channel.stop()
+            await self.km.shutdown_kernel(now=True)
+        self.km = None
+        self.channel = None
         self.last_used = None
         if self._idle_task:
             self._idle_task.cancel()
@@ -272,5 +478,5 @@ class StatefulKernel:
                 print(
                     f"Ядро не использовалось {self.idle_timeout}s, сохраняем и убиваем"
                 )
-                await self.shutdown()
-                break
+                if await self.shutdown(only_idle=True):
+                    break
@@ -0,0 +1,271 @@
+import asyncio
+import contextlib
+import logging
+import time
+from typing import Callable
+
+import psutil
+
+from app.run_jupyter import StatefulKernel
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class KernelScheduler:
+    """
+    Следит за потреблением памяти ядер и ограничивает их количество:
+    - при превышении `memory_budget` (байты) или `max_kernels` выгружает
+      (снапшот + остановка) давно не использованные ядра
+    - `admission` оборачивает запуск ядра: ждёт освобождения ресурсов и до
+      конца запуска держит под ядро резерв, а по истечении
+      `admission_timeout` бросает `AdmissionRejected`
+
+    Резерв нужен, потому что ядро поднимается секундами: без него пачка
+    одновременных запусков видела бы одно и то же число ядер и прошла бы вся.
+    Пока ядро не запущено, его память оценивается средним RSS работающих ядер,
+    но не меньше `kernel_rss_estimate`.
+
+    `pinned` — ядра, которые учитываются в лимитах, но не выгружаются
+    (тёплый пул: его ядра уже запущены и занимают память).
+    """
+
+    def __init__(
+        self,
+        kernels: Callable[[], dict[str, StatefulKernel]],
+        memory_budget: int,
+        max_kernels: int = 0,
+        admission_timeout: float = 30.0,
+        interval: float = 5.0,
+        kernel_rss_estimate: int = 0,
+        pinned: Callable[[], dict[str, StatefulKernel]] | None = None,
+    ):
+        self.kernels = kernels
+        self.pinned = pinned or dict
+        self.memory_budget = memory_budget
+        self.max_kernels = max_kernels
+        self.admission_timeout = admission_timeout
+        self.interval = interval
+        self.kernel_rss_estimate = kernel_rss_estimate
+        self._processes: dict[int, psutil.Process] = {}
+        self._lock = asyncio.Lock()
+        self._released = asyncio.Event()
+        self._monitor_task: asyncio.Task | None = None
+        # Сколько ядер допущено, но ещё не запущено
+        self._pending = 0
+        # Ядра, уже выбранные для выгрузки: в лимитах они не считаются
+        self._evicting: set[str] = set()
+        self.evictions = 0
+        self.rejections = 0
+
+    def _process(self, pid: int) -> psutil.Process | None:
+        process = self._processes.get(pid)
+        if process is None:
+            try:
+                process = self._processes[pid] = psutil.Process(pid)
+            except psutil.NoSuchProcess:
+                return None
+        return process
+
+    def rss(self, wrapper: StatefulKernel) -> int:
+        """
+        RSS ядра вместе с дочерними процессами (например, pip). Обращается к
+        /proc, поэтому из event loop вызывается через `asyncio.to_thread`.
+        """
+        pid = wrapper.pid
+        process = self._process(pid) if pid else None
+        if process is None:
+            return 0
+        try:
+            rss = process.memory_info().rss
+            for child in process.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.NoSuchProcess:
+                    pass
+            return rss
+        except psutil.NoSuchProcess:
+            self._processes.pop(pid, None)
+            return 0
+
+    def _running(self) -> dict[str, StatefulKernel]:
+        return {
+            kernel_id: wrapper
+            for kernel_id, wrapper in self.kernels().items()
+            if wrapper.is_running
+        }
+
+    def _rss_by_kernel(self, running: dict[str, StatefulKernel]) -> dict[str, int]:
+        return {kernel_id: self.rss(wrapper) for kernel_id, wrapper in running.items()}
+
+    def _over_limits(self, rss: dict[str, int], extra: int) -> bool:
+        """Превышены ли лимиты ядрами из `rss` и ещё `extra` незапущенными."""
+        if self.max_kernels and len(rss) + extra > self.max_kernels:
+            return True
+        average = sum(rss.values()) / len(rss) if rss else 0
+        estimate = max(average, self.kernel_rss_estimate)
+        return sum(rss.values()) + extra * estimate > self.memory_budget
+
+    async def _measure(self) -> tuple[dict[str, StatefulKernel], dict[str, int]]:
+        """Ядра, которые можно выгрузить, и RSS всех учитываемых в лимитах ядер."""
+        running = {
+            kernel_id: wrapper
+            for kernel_id, wrapper in self._running().items()
+            if kernel_id not in self._evicting
+        }
+        pinned = {
+            kernel_id: wrapper
+            for kernel_id, wrapper in self.pinned().items()
+            if wrapper.is_running
+        }
+        rss = await asyncio.to_thread(self._rss_by_kernel, {**pinned, **running})
+        return running, rss
+
+    async def _select_victims(self, extra: int) -> tuple[list, bool]:
+        """
+        Под `_lock`: наименее недавно использованные простаивающие ядра, без
+        которых лимиты с `extra` новыми ядрами (и уже допущенными) не превышены,
+        и уложимся ли в лимиты после их выгрузки.
+        """
+        running, rss = await self._measure()
+        extra += self._pending
+        candidates = sorted(
+            (
+                (kernel_id, wrapper)
+                for kernel_id, wrapper in running.items()
+                if not wrapper.is_busy
+            ),
+            # last_used=None у ядра, только что выданного из пула: оно самое
+            # свежее, а не самое старое
+            key=lambda item: item[1].last_used or time.time(),
+        )
+        victims = []
+        while candidates and self._over_limits(rss, extra):
+            kernel_id, wrapper = candidates.pop(0)
+            rss.pop(kernel_id)
+            victims.append((kernel_id, wrapper))
+        self._evicting.update(kernel_id for kernel_id, _ in victims)
+        return victims, not self._over_limits(rss, extra)
+
+    async def _evict(self, victims: list):
+        """
+        Выгружает ядра вне `_lock`: снапшот идёт секундами. Ядро, которое
+        успело снова начать выполнение, не трогается.
+        """
+        for kernel_id, wrapper in victims:
+            try:
+                if await wrapper.shutdown(only_idle=True):
+                    logger.info("Выгрузили ядро %s из-за нехватки ресурсов", kernel_id)
+                    self.evictions += 1
+            except Exception:
+                logger.exception("Не удалось выгрузить ядро %s", kernel_id)
+            finally:
+                self._evicting.discard(kernel_id)
+        if victims:
+            self._released.set()
+
+    async def _evict_lru(self) -> bool:
+        """Выгружает наименее недавно использованные ядра, пока лимиты превышены."""
+        async with self._lock:
+            victims, fits = await self._select_victims(extra=0)
+        await self._evict(victims)
+        return fits
+
+    async def admit(self):
+        """
+        Резервирует место под ещё одно работающее ядро. Резерв снимается
+        `settle` — проще через `admission`.
+        """
+        deadline = time.monotonic() + self.admission_timeout
+        while True:
+            async with self._lock:
+                victims, fits = await self._select_victims(extra=1)
+                if fits and not victims:
+                    self._pending += 1
+                    return
+            if victims:
+                # После выгрузки проверяем заново: ядро могло оказаться занятым
+                await self._evict(victims)
+                continue
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                self.rejections += 1
+                raise AdmissionRejected("Недостаточно ресурсов для запуска ядра")
+            self._released.clear()
+            try:
+                await asyncio.wait_for(
+                    self._released.wait(), timeout=min(timeout, self.interval)
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def try_admit(self) -> bool:
+        """
+        Как `admit`, но без ожидания и без выгрузки чужих ядер — для ядер,
+        которые можно и не запускать (пополнение пула). Резерв снимает `settle`.
+        """
+        async with self._lock:
+            _, rss = await self._measure()
+            if self._over_limits(rss, self._pending + 1):
+                return False
+            self._pending += 1
+            return True
+
+    def settle(self):
+        """Снимает резерв `admit`: ядро запустилось (и считается само) или не смогло."""
+        self._pending -= 1
+        self._released.set()
+
+    @contextlib.asynccontextmanager
+    async def admission(self):
+        """`admit` на время запуска ядра внутри блока."""
+        await self.admit()
+        try:
+            yield
+        finally:
+            self.settle()
+
+    def release(self):
+        """Сообщает ожидающим `admit`, что ресурсы могли освободиться."""
+        self._released.set()
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self._evict_lru()
+            except Exception:
+                logger.exception("Ошибка при выгрузке ядер")
+
+    def start(self):
+        if self._monitor_task is None:
+            self._monitor_task = asyncio.create_task(self._monitor())
+
+    async def close(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+
+    def stats(self) -> dict:
+        """Снимок состояния; опрашивает процессы, поэтому вызывать в потоке."""
+        kernels = {}
+        for kernel_id, wrapper in self._running().items():
+            kernels[kernel_id] = {
+                "rss": self.rss(wrapper),
+                "last_used": wrapper.last_used,
+                "busy": wrapper.is_busy,
+            }
+        return {
+            "memory_budget": self.memory_budget,
+            "max_kernels": self.max_kernels,
+            "running": len(kernels),
+            "pending": self._pending,
+            "pinned": len(self.pinned()),
+            "total_rss": sum(kernel["rss"] for kernel in kernels.values()),
+            "evictions": self.evictions,
+            "rejections": self.rejections,
+            "kernels": kernels,
+        }
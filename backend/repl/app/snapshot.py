@@ -0,0 +1,318 @@
+"""
+Инкрементальные снапшоты пространства имён ядра.
+
+Модуль импортируется и выполняется внутри самого ядра. Каждая переменная
+сохраняется в отдельный файл, имя которого — хэш содержимого:
+  - pandas.DataFrame → parquet (если установлен pyarrow), иначе dill + zlib
+  - numpy.ndarray → `.npy`, при восстановлении открывается через mmap
+  - всё остальное → dill + zlib
+Файлы, хэш которых не поменялся с прошлого снапшота, повторно не пишутся.
+
+При ленивом восстановлении в пространство имён кладутся `LazyVariable`, а сами
+значения читаются с диска только когда ячейка на них ссылается.
+"""
+
+import hashlib
+import importlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import sys
+import types
+import zlib
+
+import dill
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+COMPRESS_LEVEL = int(os.environ.get("SNAPSHOT_COMPRESS_LEVEL", 3))
+
+# Служебные имена IPython, которые не нужно сохранять
+SKIP_NAMES = {"In", "Out", "get_ipython", "exit", "quit", "open"}
+
+HAS_PARQUET = importlib.util.find_spec("pyarrow") is not None
+
+NAME_REGEX = re.compile(r"[A-Za-z_]\w*")
+
+# Ещё не загруженные переменные: имя -> LazyVariable
+_PENDING: dict = {}
+_HOOK_REGISTERED = False
+
+
+def _is_user_variable(name: str, value) -> bool:
+    if name.startswith("_") or name in SKIP_NAMES:
+        return False
+    if isinstance(value, types.ModuleType):
+        return False
+    return True
+
+
+def _atomic_write(path: str, write):
+    """Пишет файл через временный, чтобы не испортить уже открытые mmap-ы."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _hash(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def _dill_writer(value):
+    return lambda f: f.write(zlib.compress(dill.dumps(value), COMPRESS_LEVEL))
+
+
+def _encode(value, allow_parquet: bool = True):
+    """
+    Возвращает (kind, hash, writer) для значения. writer(f) пишет содержимое в файл.
+    Для массивов и датафреймов хэш считается без сериализации, поэтому неизменённые
+    значения не сериализуются вовсе.
+    """
+    # numpy/pandas не импортируем сами: если их нет в sys.modules, значений этих типов
+    # в пространстве имён тоже быть не может
+    np = sys.modules.get("numpy")
+    pd = sys.modules.get("pandas")
+    # Только ровно ndarray: у подклассов (MaskedArray и т.п.) `.npy` потеряет
+    # маску и тип, их сохраняет dill
+    if np is not None and type(value) is np.ndarray and not value.dtype.hasobject:
+        # Не ascontiguousarray: тот превращает 0-мерный массив в одномерный
+        array = value if value.flags.c_contiguous else value.copy(order="C")
+        # Байтовое представление, а не memoryview: тот не поддерживает
+        # datetime64/timedelta64 и структурные dtype
+        content_hash = _hash(
+            str(array.dtype).encode(),
+            str(array.shape).encode(),
+            array.reshape(-1).view(np.uint8),
+        )
+        return "npy", content_hash, lambda f: np.save(f, array, allow_pickle=False)
+    if pd is not None and isinstance(value, pd.DataFrame):
+        try:
+            row_hashes = pd.util.hash_pandas_object(value, index=True).values
+        except TypeError:
+            # В ячейках есть нехэшируемые объекты — сохраняем как обычный объект
+            pass
+        else:
+            content_hash = _hash(
+                str(list(value.columns)).encode(),
+                str(list(value.dtypes)).encode(),
+                row_hashes.tobytes(),
+            )
+            if HAS_PARQUET and allow_parquet:
+                return "parquet", content_hash, lambda f: value.to_parquet(f)
+            return "dill", content_hash, _dill_writer(value)
+    data = dill.dumps(value)
+    return "dill", _hash(data), lambda f: f.write(zlib.compress(data, COMPRESS_LEVEL))
+
+
+def _decode(kind: str, path: str):
+    if kind == "npy":
+        import numpy as np
+
+        # copy-on-write: изменения остаются в памяти и не портят файл снапшота
+        return np.load(path, mmap_mode="c", allow_pickle=False)
+    if kind == "parquet":
+        import pandas as pd
+
+        return pd.read_parquet(path)
+    with open(path, "rb") as f:
+        return dill.loads(zlib.decompress(f.read()))
+
+
+class LazyVariable:
+    """
+    Заглушка переменной из снапшота. При первом обращении читает значение с диска
+    и подменяет себя в пространстве имён настоящим объектом.
+    """
+
+    __slots__ = ("_name", "_entry", "_path", "_namespace", "_value", "_loaded")
+
+    def __init__(self, name: str, entry: dict, snapshot_dir: str, namespace: dict):
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_entry", entry)
+        object.__setattr__(self, "_path", os.path.join(snapshot_dir, entry["file"]))
+        object.__setattr__(self, "_namespace", namespace)
+        object.__setattr__(self, "_value", None)
+        object.__setattr__(self, "_loaded", False)
+
+    def _materialize(self):
+        if not self._loaded:
+            object.__setattr__(self, "_value", _decode(self._entry["kind"], self._path))
+            object.__setattr__(self, "_loaded", True)
+            _PENDING.pop(self._name, None)
+            if self._namespace.get(self._name) is self:
+                self._namespace[self._name] = self._value
+        return self._value
+
+    def __getattr__(self, item):
+        return getattr(self._materialize(), item)
+
+    def __setattr__(self, key, value):
+        setattr(self._materialize(), key, value)
+
+    def __delattr__(self, item):
+        delattr(self._materialize(), item)
+
+    def __bool__(self):
+        return bool(self._materialize())
+
+    def __hash__(self):
+        return hash(self._materialize())
+
+
+def _forward(method_name: str, binary: bool = False):
+    def method(self, *args, **kwargs):
+        target = getattr(type(self._materialize()), method_name, None)
+        if target is None:
+            if binary:
+                return NotImplemented
+            raise TypeError(f"'{type(self._value).__name__}' has no {method_name}")
+        return target(self._value, *args, **kwargs)
+
+    method.__name__ = method_name
+    return method
+
+
+for _method in (
+    "__repr__", "__str__", "__format__", "__len__", "__iter__", "__reversed__",
+    "__contains__", "__getitem__", "__setitem__", "__delitem__", "__call__",
+    "__enter__", "__exit__", "__int__", "__float__", "__index__", "__array__",
+    "__neg__", "__pos__", "__abs__", "__invert__", "__dir__",
+):  # fmt: skip
+    setattr(LazyVariable, _method, _forward(_method))
+
+for _op in (
+    "add", "sub", "mul", "matmul", "truediv", "floordiv", "mod", "pow",
+    "and", "or", "xor", "lshift", "rshift",
+):  # fmt: skip
+    for _method in (f"__{_op}__", f"__r{_op}__", f"__i{_op}__"):
+        setattr(LazyVariable, _method, _forward(_method, binary=True))
+
+for _method in ("__eq__", "__ne__", "__lt__", "__le__", "__gt__", "__ge__"):
+    setattr(LazyVariable, _method, _forward(_method, binary=True))
+
+
+def _materialize_referenced(info):
+    """pre_run_cell-хук IPython: загружает переменные, которые упоминаются в ячейке."""
+    if not _PENDING:
+        return
+    for name in set(NAME_REGEX.findall(info.raw_cell or "")) & _PENDING.keys():
+        _PENDING[name]._materialize()
+
+
+def _register_hook():
+    global _HOOK_REGISTERED
+    if _HOOK_REGISTERED:
+        return
+    try:
+        from IPython import get_ipython
+    except ImportError:
+        return
+    ip = get_ipython()
+    if ip is not None:
+        ip.events.register("pre_run_cell", _materialize_referenced)
+        _HOOK_REGISTERED = True
+
+
+def _read_manifest(snapshot_dir: str) -> dict:
+    path = os.path.join(snapshot_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {"modules": {}, "variables": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_snapshot(namespace: dict, snapshot_dir: str) -> dict:
+    """
+    Сохраняет пользовательские переменные `namespace` в `snapshot_dir`.
+    Возвращает статистику: сколько переменных записано, пропущено без изменений
+    и не удалось сериализовать.
+    """
+    os.makedirs(snapshot_dir, exist_ok=True)
+    manifest = {"modules": {}, "variables": {}}
+    stats = {"written": 0, "unchanged": 0, "failed": []}
+
+    for name, value in list(namespace.items()):
+        if isinstance(value, types.ModuleType) and not name.startswith("_"):
+            manifest["modules"][name] = value.__name__
+            continue
+        if not _is_user_variable(name, value):
+            continue
+        if isinstance(value, LazyVariable):
+            if not value._loaded and os.path.exists(value._path):
+                # Переменную так и не трогали — её файл уже лежит в снапшоте
+                manifest["variables"][name] = dict(value._entry)
+                stats["unchanged"] += 1
+                continue
+            value = value._materialize()
+        try:
+            kind, content_hash, writer = _encode(value)
+            filename = f"{content_hash}.{kind}"
+            path = os.path.join(snapshot_dir, filename)
+            if os.path.exists(path):
+                # Имя файла — хэш содержимого, значит значение не менялось
+                stats["unchanged"] += 1
+            else:
+                try:
+                    _atomic_write(path, writer)
+                except Exception:
+                    if kind != "parquet":
+                        raise
+                    # Не все датафреймы совместимы с parquet (например, смешанные типы)
+                    kind, content_hash, writer = _encode(value, allow_parquet=False)
+                    filename = f"{content_hash}.{kind}"
+                    _atomic_write(os.path.join(snapshot_dir, filename), writer)
+                stats["written"] += 1
+        except Exception:
+            logger.warning("Не удалось сериализовать переменную %s", name)
+            stats["failed"].append(name)
+            continue
+        manifest["variables"][name] = {"kind": kind, "file": filename}
+
+    _atomic_write(
+        os.path.join(snapshot_dir, MANIFEST),
+        lambda f: f.write(json.dumps(manifest).encode()),
+    )
+
+    # Удаляем файлы переменных, которых больше нет
+    used = {entry["file"] for entry in manifest["variables"].values()}
+    for filename in os.listdir(snapshot_dir):
+        if filename != MANIFEST and filename not in used:
+            os.remove(os.path.join(snapshot_dir, filename))
+    return stats
+
+
+def load_snapshot(namespace: dict, snapshot_dir: str, lazy: bool = False) -> list[str]:
+    """
+    Восстанавливает модули и переменные из `snapshot_dir` в `namespace`.
+    При `lazy=True` вместо значений кладёт `LazyVariable`, поэтому восстановление
+    не зависит от размера сессии.
+    """
+    manifest = _read_manifest(snapshot_dir)
+    for name, module_name in manifest["modules"].items():
+        try:
+            namespace[name] = importlib.import_module(module_name)
+        except ImportError:
+            logger.warning("Не удалось импортировать модуль %s", module_name)
+    if lazy:
+        _register_hook()
+    restored = []
+    for name, entry in manifest["variables"].items():
+        path = os.path.join(snapshot_dir, entry["file"])
+        try:
+            if lazy:
+                namespace[name] = _PENDING[name] = LazyVariable(
+                    name, entry, snapshot_dir, namespace
+                )
+            else:
+                namespace[name] = _decode(entry["kind"], path)
+            restored.append(name)
+        except Exception:
+            logger.warning("Не удалось восстановить переменную %s", name)
+    return restored
@@ -1,11 +1,27 @@
 import asyncio
 import functools
 import json
+import os
+import weakref
 from typing import Any
 
-import aiohttp
+import httpx
 import requests
 from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+
+# Сколько вызовов одного пакета `map`/`batch` выполняется одновременно по умолчанию
+TOOL_CLIENT_CONCURRENCY = int(os.getenv("TOOL_CLIENT_CONCURRENCY", 8))
+# Размер пула соединений к сервису инструментов
+TOOL_CLIENT_POOL_SIZE = int(os.getenv("TOOL_CLIENT_POOL_SIZE", 32))
+TOOL_CLIENT_TIMEOUT = float(os.getenv("TOOL_CLIENT_TIMEOUT", 600.0))
+
+# Клиенты живут на уровне модуля, а не в модели, чтобы `tool_client`
+# оставался сериализуемым при снапшоте ядра
+_SYNC_SESSION: requests.Session | None = None
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
 
 
 class ToolExecuteException(Exception):
@@ -16,63 +32,144 @@ class ToolNotFoundException(Exception):
     pass
 
 
+def get_session() -> requests.Session:
+    """Общая на процесс ядра `requests.Session` с keep-alive соединениями."""
+    global _SYNC_SESSION
+    if _SYNC_SESSION is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=TOOL_CLIENT_POOL_SIZE, pool_maxsize=TOOL_CLIENT_POOL_SIZE
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _SYNC_SESSION = session
+    return _SYNC_SESSION
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """`httpx.AsyncClient` для текущего event loop (в ядре — loop ячеек с top-level await)."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=TOOL_CLIENT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=TOOL_CLIENT_POOL_SIZE,
+                max_keepalive_connections=TOOL_CLIENT_POOL_SIZE,
+            ),
+        )
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+def _parse_response(status_code: int, body):
+    if status_code == 200:
+        data = body["data"]
+        try:
+            data = json.loads(data)
+        except Exception:
+            pass
+        return data
+    elif status_code == 404:
+        # Инструмент не найден
+        raise ToolNotFoundException(body)
+    else:
+        # Любая другая ошибка выполнения
+        raise ToolExecuteException(body)
+
+
 class ToolClient(BaseModel):
     base_url: str
     state: Any = {}
+    timeout: float = TOOL_CLIENT_TIMEOUT
 
     def set_state(self, state):
         self.state = state
 
     async def aexecute(self, tool_name, kwargs):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
+        try:
+            response = await get_async_client().post(
                 f"{self.base_url}/{tool_name}",
-                json=kwargs,
-                timeout=600.0,
-            ) as res:
-                if res.status == 200:
-                    data = (await res.json())['data']
-                    try:
-                        data = json.loads(data)
-                    except Exception:
-                        pass
-                    return data
-                elif res.status == 404:
-                    raise ToolNotFoundException((await res.json()))
-                else:
-                    raise ToolExecuteException((await res.json()))
+                json={"kwargs": kwargs, "state": self.state},
+                timeout=self.timeout,
+            )
+        except httpx.HTTPError as e:
+            raise ToolExecuteException(str(e))
+        return _parse_response(response.status_code, response.json())
 
     def execute(self, tool_name, kwargs):
         url = f"{self.base_url}/{tool_name}"
         try:
-            response = requests.post(
-                url, json={"kwargs": kwargs, "state": self.state}, timeout=600.0
+            response = get_session().post(
+                url, json={"kwargs": kwargs, "state": self.state}, timeout=self.timeout
             )
         except requests.RequestException as e:
             # Ошибка сети или таймаут
             raise ToolExecuteException(str(e))
+        return _parse_response(response.status_code, response.json())
+
+    def _batch_payload(self, calls, concurrency):
+        return {
+            "items": [{"tool": tool_name, "kwargs": kwargs} for tool_name, kwargs in calls],
+            "state": self.state,
+            "concurrency": concurrency or TOOL_CLIENT_CONCURRENCY,
+        }
+
+    def batch(self, calls, concurrency=None):
+        """
+        Выполняет список пар `(tool_name, kwargs)` одним запросом к `/batch`:
+        сервис инструментов запускает их конкурентно и отдаёт результаты по
+        порядку, не больше `concurrency` одновременно. Первый упавший вызов
+        поднимает исключение.
+        """
+        try:
+            response = get_session().post(
+                f"{self.base_url}/batch",
+                json=self._batch_payload(calls, concurrency),
+                timeout=self.timeout,
+                stream=True,
+            )
+            response.raise_for_status()
+            return [
+                _parse_response(line["status"], line["content"])
+                for line in map(json.loads, filter(None, response.iter_lines()))
+            ]
+        except requests.RequestException as e:
+            raise ToolExecuteException(str(e))
 
-        if response.status_code == 200:
-            data = response.json()['data']
-            try:
-                data = json.loads(data)
-            except Exception:
-                pass
-            return data
-        elif response.status_code == 404:
-            # Инструмент не найден
-            raise ToolNotFoundException(response.json())
-        else:
-            # Любая другая ошибка выполнения
-            raise ToolExecuteException(response.json())
+    async def abatch(self, calls, concurrency=None):
+        client = get_async_client()
+        results = []
+        try:
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/batch",
+                json=self._batch_payload(calls, concurrency),
+                timeout=self.timeout,
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        line = json.loads(line)
+                        results.append(_parse_response(line["status"], line["content"]))
+        except httpx.HTTPError as e:
+            raise ToolExecuteException(str(e))
+        return results
+
+    def map(self, tool_name, kwargs_list, concurrency=None):
+        """Вызывает инструмент для каждого набора аргументов из `kwargs_list` через `batch`."""
+        return self.batch([(tool_name, kwargs) for kwargs in kwargs_list], concurrency)
+
+    async def amap(self, tool_name, kwargs_list, concurrency=None):
+        return await self.abatch(
+            [(tool_name, kwargs) for kwargs in kwargs_list], concurrency
+        )
 
     async def get_tools(self):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"{self.base_url}/tools",
-                timeout=600.0,
-            ) as res:
-                return await res.json()
+        response = await get_async_client().get(
+            f"{self.base_url}/tools", timeout=self.timeout
+        )
+        return response.json()
 
     def call_tool(self, func):
         """
@@ -80,7 +177,11 @@ class ToolClient(BaseModel):
         - берёт имя функции как название инструмента,
         - собирает все именованные аргументы в dict,
         - вызывает self.execute(tool_name, kwargs) и возвращает результат.
+
+        У обёртки есть асинхронный вариант `wrapper.aio(**kwargs)` для top-level
+        `await` и пакетные `wrapper.map([...])` / `await wrapper.amap([...])`.
         """
+        tool_name = func.__name__
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
@@ -89,7 +190,12 @@ class ToolClient(BaseModel):
                     f"Tool method '{func.__name__}' принимает только именованные аргументы"
                 )
             # имя инструмента — само имя метода
-            tool_name = func.__name__
             return self.execute(tool_name, kwargs)
 
+        async def aio(**kwargs):
+            return await self.aexecute(tool_name, kwargs)
+
+        wrapper.aio = aio
+        wrapper.map = functools.partial(self.map, tool_name)
+        wrapper.amap = functools.partial(self.amap, tool_name)
         return wrapper
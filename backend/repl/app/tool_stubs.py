@@ -0,0 +1,76 @@
+"""
+Заглушки сервисных инструментов внутри ядра.
+
+Заглушки и `tool_client` создаются один раз на набор инструментов (`tools_hash`),
+а перед каждой ячейкой только сверяется хэш состояния графа. Само состояние
+граф присылает, только когда хэш поменялся; если ядро его не знает (например,
+после перезапуска модуль загрузился заново), ячейка падает с
+`ToolStateMissing`, и граф повторяет её с полным состоянием.
+"""
+
+import importlib
+
+from app.tool_client import ToolClient
+
+_INSTALLED = {
+    "tools_hash": None,
+    "state_hash": None,
+    "state": None,
+    "tool_client": None,
+    "stubs": {},
+}
+
+
+class ToolStateMissing(Exception):
+    """В ядре нет состояния графа с хэшем, который прислал граф."""
+
+
+def is_installed(tools_hash: str, namespace: dict) -> bool:
+    """
+    Стоят ли заглушки этого набора инструментов. Пользовательский код мог
+    удалить или перезаписать `tool_client` и заглушки, поэтому сверяются и
+    сами объекты в `namespace`.
+    """
+    if _INSTALLED["tools_hash"] != tools_hash:
+        return False
+    if namespace.get("tool_client") is not _INSTALLED["tool_client"]:
+        return False
+    stubs = _INSTALLED["stubs"].items()
+    return all(namespace.get(name) is stub for name, stub in stubs)
+
+
+def install(namespace: dict, tool_url: str, tool_names: list[str], tools_hash: str):
+    """Создаёт `tool_client` и по заглушке на каждый инструмент в `namespace`."""
+    import datetime
+    import numpy as np
+    import pandas as pd
+
+    namespace.update(pd=pd, np=np, datetime=datetime)
+    tool_client = ToolClient(base_url=tool_url)
+    namespace["tool_client"] = tool_client
+    stubs = {}
+    for name in tool_names:
+
+        def stub(**kwargs):
+            pass
+
+        stub.__name__ = stub.__qualname__ = name
+        stubs[name] = namespace[name] = tool_client.call_tool(stub)
+    _INSTALLED.update(tools_hash=tools_hash, tool_client=tool_client, stubs=stubs)
+    # Переустановка не должна терять уже известное ядру состояние
+    if _INSTALLED["state"] is not None:
+        tool_client.set_state(_INSTALLED["state"])
+
+
+def before_cell(state_hash: str, state: dict | None = None):
+    """
+    Вызывается перед каждой ячейкой: обновляет состояние, если оно поменялось.
+    Без `state` граф считает, что ядро уже знает состояние с `state_hash`.
+    """
+    importlib.invalidate_caches()
+    if _INSTALLED["state_hash"] == state_hash:
+        return
+    if state is None:
+        raise ToolStateMissing(state_hash)
+    _INSTALLED["tool_client"].set_state(state)
+    _INSTALLED.update(state_hash=state_hash, state=state)
@@ -0,0 +1,30 @@
+"""
+Передача данных в ядро без генерации Python-кода.
+
+REPL-сервис кладёт JSON-документ в файл, а ядро читает его через `load_payload`.
+Так большие результаты инструментов не приходится превращать в литерал и
+компилировать внутри ядра.
+"""
+
+import os
+
+try:
+    import orjson
+
+    def _loads(data: bytes):
+        return orjson.loads(data)
+
+except ImportError:  # pragma: no cover - orjson есть в образе
+    import json
+
+    def _loads(data: bytes):
+        return json.loads(data)
+
+
+def load_payload(path: str):
+    """Читает JSON-документ из `path` и удаляет файл."""
+    try:
+        with open(path, "rb") as f:
+            return _loads(f.read())
+    finally:
+        os.remove(path)
@@ -1,21 +1,58 @@
-import io
+import asyncio
+import json
 import mimetypes
+import multiprocessing
 import os
 import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
 from pathlib import Path
-import requests
 
+import httpx
 from fastapi import FastAPI, HTTPException, File, UploadFile, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from langchain_gigachat import GigaChat
 from dotenv import load_dotenv
 
-from PIL import Image, ImageOps
+from app.images import to_jpeg
 
 load_dotenv("../../.env")
 
-app = FastAPI()
+FILES_DIR = os.environ.get("FILES_DIR", "files")
+os.makedirs(FILES_DIR, exist_ok=True)
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Большая сторона картинки, которая уходит в LLM
+UPLOAD_IMAGE_MAX_SIDE = int(os.getenv("UPLOAD_IMAGE_MAX_SIDE", 1024))
+UPLOAD_IMAGE_WORKERS = int(
+    os.getenv("UPLOAD_IMAGE_WORKERS", min(4, os.cpu_count() or 1))
+)
+# Сколько картинок одновременно пересылается в LANGGRAPH_API_URL
+UPLOAD_FORWARD_CONCURRENCY = int(os.getenv("UPLOAD_FORWARD_CONCURRENCY", 8))
+UPLOAD_FORWARD_TIMEOUT = float(os.getenv("UPLOAD_FORWARD_TIMEOUT", 60))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # spawn: форк процесса с работающим event loop и потоками небезопасен
+    app.image_pool = ProcessPoolExecutor(
+        max_workers=UPLOAD_IMAGE_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+    app.forward_client = httpx.AsyncClient(
+        timeout=UPLOAD_FORWARD_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=UPLOAD_FORWARD_CONCURRENCY,
+            max_keepalive_connections=UPLOAD_FORWARD_CONCURRENCY,
+        ),
+    )
+    yield
+    await app.forward_client.aclose()
+    app.image_pool.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
@@ -27,9 +64,6 @@ app.add_middleware(
     allow_headers=["*"],  # какие заголовки
 )
 
-FILES_DIR = os.environ.get("FILES_DIR", "files")
-os.makedirs(FILES_DIR, exist_ok=True)
-
 llm = GigaChat(
     profanity_check=False,
     verify_ssl_certs=False,
@@ -57,6 +91,72 @@ def uniquify(path):
     return path
 
 
+def _create_unique(path):
+    """
+    Как `uniquify`, но сразу создаёт файл (режим "x"): параллельные загрузки
+    файлов с одним именем не перезапишут друг друга.
+    """
+    # Каждый раз считаем от исходного имени, иначе получится "a (1) (1).png"
+    base = path
+    while True:
+        candidate = uniquify(base)
+        try:
+            return candidate, open(candidate, "xb")
+        except FileExistsError:
+            continue
+
+
+async def save_upload(file: UploadFile) -> str:
+    """Пишет файл на диск по частям, не блокируя event loop."""
+    filename = os.path.basename(file.filename or "") or str(uuid.uuid4())
+    path, f = await asyncio.to_thread(
+        _create_unique, os.path.join(FILES_DIR, filename)
+    )
+    try:
+        while contents := await file.read(UPLOAD_CHUNK_SIZE):
+            await asyncio.to_thread(f.write, contents)
+    finally:
+        await asyncio.to_thread(f.close)
+    return path
+
+
+_forward_semaphore: asyncio.Semaphore | None = None
+
+
+async def forward_image(jpeg: bytes) -> str:
+    """Отправляет JPEG в `LANGGRAPH_API_URL/upload/image/`, возвращает его id."""
+    global _forward_semaphore
+    api_url_base = os.getenv("LANGGRAPH_API_URL", "").rstrip("/")
+    if not api_url_base:
+        raise RuntimeError("LANGGRAPH_API_URL is not set")
+    if _forward_semaphore is None:
+        _forward_semaphore = asyncio.Semaphore(UPLOAD_FORWARD_CONCURRENCY)
+    async with _forward_semaphore:
+        response = await app.forward_client.post(
+            f"{api_url_base}/upload/image/",
+            files={"file": (f"{uuid.uuid4()}.jpg", jpeg, "image/jpeg")},
+        )
+    response.raise_for_status()
+    return response.json().get("id")
+
+
+async def process_saved(path: str, content_type: str | None, report=None) -> dict:
+    """
+    Картинку готовит для LLM в пуле процессов и пересылает в граф.
+    `report(stage)` вызывается после каждой стадии.
+    """
+    if not (content_type or "").startswith("image/"):
+        return {"path": path}
+    loop = asyncio.get_running_loop()
+    jpeg = await loop.run_in_executor(
+        app.image_pool, to_jpeg, path, UPLOAD_IMAGE_MAX_SIDE
+    )
+    if report is not None:
+        report("processed")
+    file_id = await forward_image(jpeg)
+    return {"path": path, "file_id": file_id}
+
+
 @app.options("/upload")
 def upload_options():
     return Response(
@@ -70,51 +170,64 @@ def upload_options():
 
 
 @app.post("/upload")
-def upload(file: UploadFile = File(...)):
+async def upload(file: UploadFile = File(...)):
     try:
-        path = uniquify(os.path.join(FILES_DIR, file.filename))
-        with open(path, "wb") as f:
-            while contents := file.file.read(1024 * 1024):
-                f.write(contents)
-        if file.content_type.startswith("image/"):
-            image = ImageOps.exif_transpose(Image.open(path))
-            max_side = 1024
-            if max(image.size) > max_side:
-                image.thumbnail((max_side, max_side), Image.LANCZOS)
-
-            buf = io.BytesIO()
-            image.convert("RGB").save(
-                buf,
-                format="JPEG",
-                quality=85,
-                optimize=True,
-                progressive=True,
-            )
-            buf.seek(0)
-            api_url_base = os.getenv("LANGGRAPH_API_URL", "").rstrip("/")
-            if not api_url_base:
-                raise RuntimeError("LANGGRAPH_API_URL is not set")
-            url = f"{api_url_base}/upload/image/"
-            response = requests.post(
-                url,
-                files={
-                    "file": (
-                        f"{uuid.uuid4()}.jpg",
-                        buf,
-                        "image/jpeg",
-                    )
-                },
-                timeout=60,
-            )
-            response.raise_for_status()
-            data = response.json()
-            return {"path": path, "file_id": data.get("id")}
-    except Exception as e:
-        raise e
+        path = await save_upload(file)
     finally:
-        file.file.close()
+        await file.close()
+    return await process_saved(path, file.content_type)
+
+
+@app.post("/upload/batch")
+async def upload_batch(files: list[UploadFile] = File(...)):
+    """
+    Загружает несколько файлов параллельно. Ответ — NDJSON с прогрессом по
+    каждому файлу: `{"index", "filename", "stage"}`, где stage — "saved",
+    "processed" (для картинок), затем "done" с `path`/`file_id` или "error"
+    с `detail`.
+    """
+    # Файлы сохраняем до начала ответа: после него FastAPI их закрывает
+    try:
+        saved = await asyncio.gather(
+            *(save_upload(file) for file in files), return_exceptions=True
+        )
+    finally:
+        for file in files:
+            await file.close()
+
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def run(index: int, file: UploadFile, path):
+        def report(stage: str, **extra):
+            queue.put_nowait(
+                {"index": index, "filename": file.filename, "stage": stage, **extra}
+            )
+
+        try:
+            if isinstance(path, Exception):
+                raise path
+            report("saved", path=path)
+            report("done", **await process_saved(path, file.content_type, report))
+        except Exception as e:
+            report("error", detail=str(e))
+
+    async def stream():
+        tasks = [
+            asyncio.create_task(run(index, file, path))
+            for index, (file, path) in enumerate(zip(files, saved))
+        ]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await queue.get()
+                if event["stage"] in ("done", "error"):
+                    remaining -= 1
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    return {"path": path}
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 
 @app.get("/files/{filename}")
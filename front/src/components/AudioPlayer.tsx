@@ -43,7 +43,13 @@ const AudioPlayer: React.FC<HTMLPageProps> = ({ id, alt }) => {
       controls={true}
       style={{ marginTop: "5px", marginBottom: "5px", display: "block" }}
     >
-      <source src={`data:audio/mp3;base64, ${attachment.data}`} />
+      <source
+        src={
+          attachment.blob_key
+            ? `/graph/audio/${id}/`
+            : `data:audio/mp3;base64, ${attachment.data}`
+        }
+      />
     </audio>
   );
 };
@@ -148,7 +148,11 @@ const GraphImage: React.FC<GraphImageProps> = ({ id, alt }) => {
         </SelectorButton>
         <div style={{ display: "flex" }}>
           <img
-            src={`data:image/png;base64,${attachment["data"]}`}
+            src={
+              attachment["blob_key"]
+                ? `/graph/attachments/${id}/`
+                : `data:image/png;base64,${attachment["data"]}`
+            }
             alt={`attachment-${attachment["file_id"]}`}
             style={{
               maxWidth: "100%",
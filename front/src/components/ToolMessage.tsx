@@ -10,6 +10,7 @@ import GraphImage from "./GraphImage.tsx";
 import HTMLPage from "./HTMLPage.tsx";
 import { TOOL_MAP } from "../config.ts";
 import AudioPlayer from "./AudioPlayer.tsx";
+import Plot from "react-plotly.js";
 // @ts-ignore
 import { UseStream } from "@langchain/langgraph-sdk/dist/react/stream";
 import { GraphState } from "../interfaces.ts";
@@ -116,6 +117,47 @@ const ToolProgress = styled.span`
     ${shimmer} 3.5s linear infinite;
 `;
 
+const ExecutionOutput = styled.pre`
+  margin: 8px 0 0 16px;
+  max-height: 300px;
+  overflow: auto;
+  font-size: 12px;
+  white-space: pre-wrap;
+  word-break: break-word;
+  color: #ccc;
+`;
+
+// Промежуточный вывод ячейки python, приходящий через push_ui_message
+const ExecutionAttachment = ({ data }: { data: any }) => {
+  if (data["application/vnd.plotly.v1+json"]) {
+    const fig = data["application/vnd.plotly.v1+json"];
+    return (
+      <Plot
+        data={fig.data}
+        layout={{
+          ...fig.layout,
+          template: "plotly_dark",
+          paper_bgcolor: "rgba(0,0,0,0)",
+          plot_bgcolor: "rgba(0,0,0,0)",
+          font: { color: "#fff" },
+        }}
+        useResizeHandler
+        style={{ width: "100%" }}
+      />
+    );
+  }
+  if (data["image/png"]) {
+    return (
+      <img
+        src={`data:image/png;base64,${data["image/png"]}`}
+        alt="execution-output"
+        style={{ maxWidth: "100%", borderRadius: "4px" }}
+      />
+    );
+  }
+  return null;
+};
+
 interface ToolMessageProps {
   message: Message;
   name: string;
@@ -172,6 +214,23 @@ export const ToolExecuting = ({
     return () => clearTimeout(timer);
     // @ts-ignore
   }, [progressSubstring]);
+  // @ts-ignore
+  const callIds = (messages[messages.length - 1]?.tool_calls ?? []).map(
+    // @ts-ignore
+    (call) => call.id,
+  );
+  // @ts-ignore
+  const execution = (thread?.values?.ui ?? []).filter(
+    // @ts-ignore
+    (el) =>
+      el.name === "python_execution" && callIds.includes(el.props.tool_call_id),
+  );
+  const executionText = execution
+    // @ts-ignore
+    .map((el) => el.props.text ?? "")
+    .join("");
+  // @ts-ignore
+  const executionAttachments = execution.filter((el) => el.props.attachment);
   if (
     thread?.interrupt ||
     !messages ||
@@ -194,6 +253,15 @@ export const ToolExecuting = ({
             )}
           </CollapsedText>
         </Header>
+        {executionText && <ExecutionOutput>{executionText}</ExecutionOutput>}
+        {executionAttachments.length > 0 && (
+          <AttachmentsContainer>
+            {/* @ts-ignore */}
+            {executionAttachments.map((el) => (
+              <ExecutionAttachment key={el.id} data={el.props.attachment} />
+            ))}
+          </AttachmentsContainer>
+        )}
       </Bubble>
     </ToolMessageContainer>
   );